@@ -0,0 +1,283 @@
+import io
+import os
+import timeit
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from itertools import repeat
+
+import cv2
+import numpy as np
+
+from entropyCoding import decodeFrameRuns, decodeFrames, encodeFrames, framesPerChunk
+from hierarchicalSearch import blockMatchingStrategies, calculateSADValues, createPyramidLevels, executeLevel, \
+    hierarchicalSearch, macroblockSize, numLevels, predictTemporalMotionVectors
+from rans import createRansFrequencies, decodeRansCodes, encodeRansFrames
+
+
+def calculateSADValueLoop(referenceMacroblock, targetMacroblock):
+    """
+        Calculate the SAD value pixel by pixel (the original implementation, kept as the benchmark baseline).
+    """
+    SAD = 0
+    for i in range(referenceMacroblock.shape[0]):
+        for j in range(referenceMacroblock.shape[1]):
+            SAD += abs(int(targetMacroblock[i, j]) - int(referenceMacroblock[i, j]))
+    return SAD
+
+
+def benchmarkSAD(noOfCandidates=81, noOfRepeats=3):
+    """
+        Compare the per-pixel SAD loop against the vectorized SAD engine on 64x64 macroblocks.
+    """
+    rng = np.random.default_rng(0)
+    targetMacroblock = rng.integers(0, 256, (macroblockSize, macroblockSize), dtype=np.uint8)
+    referenceMacroblocks = rng.integers(0, 256, (noOfCandidates, macroblockSize, macroblockSize), dtype=np.uint8)
+
+    loopSAD_values = [calculateSADValueLoop(referenceMacroblock, targetMacroblock)
+                      for referenceMacroblock in referenceMacroblocks]
+    assert loopSAD_values == calculateSADValues(referenceMacroblocks, targetMacroblock).tolist()
+
+    loopTime = min(timeit.repeat(
+        lambda: [calculateSADValueLoop(referenceMacroblock, targetMacroblock)
+                 for referenceMacroblock in referenceMacroblocks], number=1, repeat=noOfRepeats))
+    vectorizedTime = min(timeit.repeat(
+        lambda: calculateSADValues(referenceMacroblocks, targetMacroblock), number=1, repeat=noOfRepeats))
+
+    print(f'SAD of {noOfCandidates} {macroblockSize}x{macroblockSize} macroblocks: loop {loopTime * 1000:.2f} ms, '
+          f'vectorized {vectorizedTime * 1000:.2f} ms, speedup x{loopTime / vectorizedTime:.1f}')
+
+
+def benchmarkFullSearch(width=1280, height=768, noOfRepeats=3):
+    """
+        Compare the per-macroblock full search against the cost surface full search at the highest pyramid level.
+    """
+    rng = np.random.default_rng(0)
+    referenceFrame = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (7, 7), 0)
+    targetFrame = np.roll(referenceFrame, (5, -3), axis=(0, 1))
+    for _ in range(1, numLevels):
+        referenceFrame, targetFrame = cv2.pyrDown(referenceFrame), cv2.pyrDown(targetFrame)
+    level = numLevels - 1
+
+    assert all(map(np.array_equal, executeLevel(referenceFrame, targetFrame, level, None,
+                                                {'fullSearchMode': 'perMacroblock'}),
+                   executeLevel(referenceFrame, targetFrame, level, None, {'fullSearchMode': 'costSurface'})))
+
+    times = {}
+    for mode in ('perMacroblock', 'costSurface'):
+        times[mode] = min(timeit.repeat(lambda: executeLevel(referenceFrame, targetFrame, level, None,
+                                                             {'fullSearchMode': mode}),
+                                        number=1, repeat=noOfRepeats))
+    print(f'Full search of a {width}x{height} frame: per macroblock {times["perMacroblock"] * 1000:.2f} ms, '
+          f'cost surface {times["costSurface"] * 1000:.2f} ms, '
+          f'speedup x{times["perMacroblock"] / times["costSurface"]:.1f}')
+
+
+def benchmarkEarlyTermination(width=1280, height=768, noOfFrames=4, noOfRepeats=3):
+    """
+        Compare the full search without and with early termination (partial distortion elimination), at the highest
+        pyramid level and for the whole hierarchical search of a few frames. The motion vectors must be the same.
+    """
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height + 64, width + 64), dtype=np.uint8), (7, 7), 0)
+    frames = np.array([background[32 + 3 * i:32 + 3 * i + height, 32 - 2 * i:32 - 2 * i + width]
+                       for i in range(noOfFrames)])
+    frames = np.clip(frames + rng.normal(0, 4, frames.shape), 0, 255).astype(np.uint8)  # Camera noise
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(frames[0], frames[1])
+    level = numLevels - 1
+
+    def measure(function):
+        with redirect_stdout(io.StringIO()):  # Without the progress bars
+            return min(timeit.repeat(function, number=1, repeat=noOfRepeats))
+
+    searchStatistics = Counter()
+    assert all(map(np.array_equal, executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None),
+                   executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                {'earlyTermination': True}, searchStatistics)))
+    with redirect_stdout(io.StringIO()):
+        assert np.array_equal(hierarchicalSearch(frames)['motionVectors'],
+                              hierarchicalSearch(frames, earlyTermination=True)['motionVectors'])
+
+    times = {}
+    for earlyTermination in (False, True):
+        times[earlyTermination] = (
+            measure(lambda: executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                         {'earlyTermination': earlyTermination})),
+            measure(lambda: hierarchicalSearch(frames, earlyTermination=earlyTermination)))
+    skipped = searchStatistics['skippedPixelComparisons'] / \
+        (searchStatistics['pixelComparisons'] + searchStatistics['skippedPixelComparisons'])
+    print(f'Full search of a {width}x{height} frame, highest level / {noOfFrames} frames: '
+          f'{times[False][0] * 1000:.2f} ms / {times[False][1] * 1000:.0f} ms, with early termination '
+          f'{times[True][0] * 1000:.2f} ms / {times[True][1] * 1000:.0f} ms, speedup '
+          f'x{times[False][0] / times[True][0]:.2f} / x{times[False][1] / times[True][1]:.2f} '
+          f'({skipped:.0%} of the pixel comparisons of the highest level skipped)')
+
+
+def benchmarkTemporalPrediction(width=1280, height=768, noOfFrames=8, noOfRepeats=3):
+    """
+        Compare the full search without and with temporal prediction (the search windows around the motion vectors of
+        the previous frame), at the highest pyramid level and for the whole hierarchical search of a panning sequence.
+        The per-macroblock and cost surface searches of the windows must give the same motion vectors.
+    """
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height + 128, width + 128), dtype=np.uint8), (7, 7), 0)
+    frames = np.array([background[64 + 3 * i:64 + 3 * i + height, 64 - 5 * i:64 - 5 * i + width]
+                       for i in range(noOfFrames)])
+    frames = np.clip(frames + rng.normal(0, 4, frames.shape), 0, 255).astype(np.uint8)  # Camera noise
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(frames[-2], frames[-1])
+    level = numLevels - 1
+    noOfMacroblocks = (height // macroblockSize) * (width // macroblockSize)
+    temporalPredictions = predictTemporalMotionVectors([np.tile([[6, -10]], (noOfMacroblocks, 1))] * 2, level)
+
+    def measure(function):
+        with redirect_stdout(io.StringIO()):  # Without the progress bars
+            return min(timeit.repeat(function, number=1, repeat=noOfRepeats))
+
+    with redirect_stdout(io.StringIO()):
+        assert np.array_equal(hierarchicalSearch(frames, temporalPrediction=True)['motionVectors'],
+                              hierarchicalSearch(frames, temporalPrediction=True,
+                                                 fullSearchMode='perMacroblock')['motionVectors'])
+
+    times, searchStatistics = {}, {}
+    for temporal in (False, True):
+        searchStatistics[temporal] = Counter()
+        with redirect_stdout(io.StringIO()):
+            hierarchicalSearch(frames, temporalPrediction=temporal, searchStatistics=searchStatistics[temporal])
+        times[temporal] = (
+            measure(lambda: executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None, None,
+                                         None, temporalPredictions if temporal else None)),
+            measure(lambda: hierarchicalSearch(frames, temporalPrediction=temporal)))
+    print(f'Full search of a {width}x{height} frame, highest level / {noOfFrames} frames: '
+          f'{times[False][0] * 1000:.2f} ms / {times[False][1] * 1000:.0f} ms, with temporal prediction '
+          f'{times[True][0] * 1000:.2f} ms / {times[True][1] * 1000:.0f} ms, speedup '
+          f'x{times[False][0] / times[True][0]:.2f} / x{times[False][1] / times[True][1]:.2f} '
+          f'({searchStatistics[True]["SADEvaluations"]} SAD evaluations instead of '
+          f'{searchStatistics[False]["SADEvaluations"]}, {searchStatistics[True]["temporalFallbacks"]} fallbacks)')
+
+
+def benchmarkBlockMatching(width=1280, height=768, noOfRepeats=5):
+    """
+        Compare the fast block-matching strategies against the (cost surface) full search at the highest pyramid
+        level: their time and SAD evaluations.
+    """
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height + 64, width + 64), dtype=np.uint8), (7, 7), 0)
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(background[32:32 + height, 32:32 + width],
+                                                                    background[37:37 + height, 29:29 + width])
+    level = numLevels - 1
+
+    results = {}
+    for strategy in ('fullSearch', *blockMatchingStrategies):
+        searchStatistics = Counter()
+        executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None, {'strategy': strategy},
+                     searchStatistics)
+        results[strategy] = (min(timeit.repeat(lambda: executeLevel(referenceFramePyramid[level],
+                                                                    targetFramePyramid[level], level, None,
+                                                                    {'strategy': strategy}),
+                                               number=1, repeat=noOfRepeats)), searchStatistics['SADEvaluations'])
+    print(f'Block matching of a {width}x{height} frame, highest level: ' + ', '.join(
+        f'{strategy} {time * 1000:.2f} ms ({SAD_evaluations} SAD evaluations, '
+        f'x{results["fullSearch"][0] / time:.2f})' for strategy, (time, SAD_evaluations) in results.items()))
+
+
+def encodeFramesPickled(seqErrorImages, frameTypes, encodeFrameChunk, codeTable, executor):
+    """
+        Encode the chunks of frames in the process pool, the frames being pickled to the workers (the previous
+        implementation, kept as the benchmark baseline)
+    """
+    chunkStarts = range(0, len(seqErrorImages), framesPerChunk)
+    encodedChunks = executor.map(encodeFrameChunk, (seqErrorImages[i:i + framesPerChunk] for i in chunkStarts),
+                                 (frameTypes[i:i + framesPerChunk] for i in chunkStarts), repeat(codeTable))
+    return [encodedErrorImage for encodedChunk in encodedChunks for encodedErrorImage in encodedChunk]
+
+
+def decodeFramesPickled(encodedSeqErrorImages, decodeCodes, decodingTable, out, executor):
+    """
+        Decode the chunks of frames in the process pool, the coded frames being pickled to the workers and the decoded
+        frames back (the previous implementation, kept as the benchmark baseline)
+    """
+    chunkStarts = range(0, len(encodedSeqErrorImages), framesPerChunk)
+    decodedChunks = executor.map(decodeFrameChunkPickled, (encodedSeqErrorImages[i:i + framesPerChunk]
+                                                           for i in chunkStarts),
+                                 repeat(decodeCodes), repeat(decodingTable), repeat(out.shape[1:]))
+    for chunkStart, decodedChunk in zip(chunkStarts, decodedChunks):
+        out[chunkStart:chunkStart + len(decodedChunk)] = decodedChunk
+    return out
+
+
+def decodeFrameChunkPickled(encodedSeqErrorImages, decodeCodes, decodingTable, frameShape):
+    """
+        Decode consecutive error frames into a new array (a worker task), see decodeFramesPickled
+    """
+    decodedSeqErrorImages = np.zeros((len(encodedSeqErrorImages),) + frameShape, dtype=np.uint8)
+    for _ in decodeFrameRuns(encodedSeqErrorImages, decodeCodes, decodingTable, decodedSeqErrorImages):
+        pass
+    return decodedSeqErrorImages
+
+
+def touchFrames(seqErrorImages, frameTypes, codeTable):
+    """
+        Read the error frames without coding them (a worker task), to time the transfer of the frames alone
+    """
+    return [errorImage.max() and None for errorImage in seqErrorImages]
+
+
+def touchLanes(packedBytes, laneOffsets, decodingTable, out):
+    """
+        Write the decoded lanes without decoding them, to time the transfer of the decoded frames alone
+    """
+    out[...] = 0
+    return out
+
+
+def benchmarkEntropyCodingPool(noOfFrames=32, width=1280, height=768, noOfRepeats=3):
+    """
+        Compare the coding of the error frames in a process pool with the frames pickled to and from the workers (the
+        previous implementation) against the frames shared with the workers, and against coding them in this process:
+        with a coder that only reads (writes) the frames, which times the transfer of the frames alone, then with rANS.
+    """
+    rng = np.random.default_rng(0)
+    seqErrorImages = np.round(rng.laplace(0, 3, (noOfFrames, height, width))).astype(np.int64).astype(np.uint8)
+    frameTypes = 'P' * noOfFrames
+    frequencies = createRansFrequencies(np.bincount(seqErrorImages.ravel(), minlength=256))
+    with redirect_stdout(io.StringIO()):
+        encodedSeqErrorImages = encodeFrames(seqErrorImages, frameTypes, encodeRansFrames, frequencies)
+    out = np.empty_like(seqErrorImages)
+
+    def measure(function):
+        with redirect_stdout(io.StringIO()):  # Without the progress bars
+            return min(timeit.repeat(function, number=1, repeat=noOfRepeats))
+
+    for coderName, encodeFrameChunk, decodeCodes in (('transfer only', touchFrames, touchLanes),
+                                                     ('rANS', encodeRansFrames, decodeRansCodes)):
+        print(f'Coding of {noOfFrames} {width}x{height} error frames, {coderName} (encoding / decoding):')
+        times = (measure(lambda: encodeFrames(seqErrorImages, frameTypes, encodeFrameChunk, frequencies)),
+                 measure(lambda: decodeFrames(encodedSeqErrorImages, decodeCodes, frequencies, out)))
+        print(f'\tthis process: {times[0] * 1000:.0f} ms / {times[1] * 1000:.0f} ms')
+        for workers in sorted({2, os.cpu_count()}):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(abs, range(workers)))  # Start the workers
+                pickledTimes = (measure(lambda: encodeFramesPickled(seqErrorImages, frameTypes, encodeFrameChunk,
+                                                                    frequencies, executor)),
+                                measure(lambda: decodeFramesPickled(encodedSeqErrorImages, decodeCodes, frequencies,
+                                                                    out, executor)))
+                sharedTimes = (measure(lambda: encodeFrames(seqErrorImages, frameTypes, encodeFrameChunk, frequencies,
+                                                            executor)),
+                               measure(lambda: decodeFrames(encodedSeqErrorImages, decodeCodes, frequencies, out,
+                                                            executor=executor)))
+            print(f'\t{workers} workers: pickled frames {pickledTimes[0] * 1000:.0f} ms / '
+                  f'{pickledTimes[1] * 1000:.0f} ms, shared frames {sharedTimes[0] * 1000:.0f} ms / '
+                  f'{sharedTimes[1] * 1000:.0f} ms, speedup x{pickledTimes[0] / sharedTimes[0]:.1f} / '
+                  f'x{pickledTimes[1] / sharedTimes[1]:.1f} (x{times[0] / sharedTimes[0]:.1f} / '
+                  f'x{times[1] / sharedTimes[1]:.1f} against this process)')
+        if decodeCodes is decodeRansCodes:
+            assert np.array_equal(out, seqErrorImages)
+
+
+if __name__ == '__main__':
+    benchmarkSAD()
+    benchmarkFullSearch()
+    benchmarkEarlyTermination()
+    benchmarkTemporalPrediction()
+    benchmarkBlockMatching()
+    benchmarkEntropyCodingPool()
@@ -0,0 +1,346 @@
+import os
+import tempfile
+from itertools import repeat
+
+import numpy as np
+
+from huffman import createCodeLengthsHeader, createHuffmanCodeArrays, createHuffmanDecodingTables, createHuffmanTable, \
+    createHuffmanTreeFromHistogram, decodeHuffmanCodes, encodeHuffmanFrames, readCodeLengthsHeader
+from processPool import createProcessPool, workers
+from progressBar import progressBar
+from rans import createRansFrequencies, createRansHeader, decodeRansCodes, encodeRansFrames, readRansHeader
+from zeroRunLength import decodeZeroRunLength, encodeZeroRunLength
+
+entropyCoder = 'huffman'  # Entropy coder of the error frames: 'huffman' or 'rans' (a little smaller, slower to code)
+groupSize = None  # Frames coded with the same table (None: a single table for the whole video)
+zeroRunLength = False  # Code the error frames as (zero run, value) symbols, with their own table
+framesPerChunk = 8  # Consecutive frames coded by a worker at a time
+# Directory of the copies of the in-memory arrays shared with the workers (None: the frames are sent to the workers)
+sharedDirectory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def encodeSeqErrorImages(seqErrorImages, entropyCoder=entropyCoder, groupSize=groupSize, frameTypes=None,
+                         histogram=None, zeroRunLength=zeroRunLength, workers=workers):
+    """
+        Encode the error frames sequence in groups of frames, each group with its own table (Huffman code lengths or
+        rANS frequencies) built from the histogram of its frames. The groups are yielded one at a time, so the frames
+        can be streamed: only one group of frames is held at once.
+        Form of a group: (entropyCoder, zeroRunLength, header, encodedSeqErrorImages, frameIndex), the table header
+        comes before the frames it codes, followed by the byte offset index of the frames (see createFrameIndex)
+        groupSize: frames per group, None for a single group
+        frameTypes: a string with the type of each frame ('I', 'P' or 'S'), if given, the skip frames are not encoded
+        and are left out of the histograms
+        histogram: the histogram of all the (non skip) frames, if already gathered, for a single group
+        zeroRunLength: code the runs of zeros and the value that follows each of them as one symbol (see
+        zeroRunLength.createZeroRunLengthSymbols), the table is built from the histogram of those symbols
+        workers: worker processes for the frames of each group (one process pool for all the groups)
+    """
+    with createProcessPool(workers) as executor:
+        if isinstance(seqErrorImages, np.ndarray):
+            # The groups are views of the sequence (the workers map the file of a memory-mapped one, see encodeFrames)
+            groupLength = groupSize or max(len(seqErrorImages), 1)
+            frameTypes = 'P' * len(seqErrorImages) if frameTypes is None else frameTypes
+            for groupStart in range(0, len(seqErrorImages), groupLength):
+                yield encodeSeqErrorImagesGroup(seqErrorImages[groupStart:groupStart + groupLength],
+                                                frameTypes[groupStart:groupStart + groupLength], entropyCoder,
+                                                zeroRunLength, histogram if groupSize is None else None, executor)
+            return
+        groupFrames, groupFrameTypes = [], ''
+        for i, errorImage in enumerate(seqErrorImages):
+            groupFrames.append(errorImage)
+            groupFrameTypes += 'P' if frameTypes is None else frameTypes[i]
+            if len(groupFrames) == groupSize:
+                yield encodeSeqErrorImagesGroup(groupFrames, groupFrameTypes, entropyCoder, zeroRunLength,
+                                                executor=executor)
+                groupFrames, groupFrameTypes = [], ''
+        if groupFrames:
+            yield encodeSeqErrorImagesGroup(groupFrames, groupFrameTypes, entropyCoder, zeroRunLength,
+                                            histogram if groupSize is None else None, executor)
+
+
+def encodeSeqErrorImagesGroup(groupFrames, groupFrameTypes, entropyCoder, zeroRunLength=False, histogram=None,
+                              executor=None):
+    """
+        Encode a group of error frames with its own table, form: (entropyCoder, zeroRunLength, header,
+        encodedSeqErrorImages, frameIndex)
+    """
+    if zeroRunLength:
+        header, encodedSeqErrorImages = encodeZeroRunLength(groupFrames, entropyCoder, groupFrameTypes, executor)
+        return entropyCoder, True, header, encodedSeqErrorImages, createFrameIndex(encodedSeqErrorImages)
+    if histogram is None:
+        histogram = np.zeros(256, dtype=np.int64)
+        for errorImage, frameType in zip(groupFrames, groupFrameTypes):
+            if frameType != 'S':
+                histogram += np.bincount(errorImage.ravel(), minlength=256)
+    if entropyCoder == 'rans':
+        frequencies = createRansFrequencies(histogram)
+        header = createRansHeader(frequencies)
+        encodedSeqErrorImages = encodeFrames(groupFrames, groupFrameTypes, encodeRansFrames, frequencies, executor)
+    elif entropyCoder == 'huffman':
+        huffmanTable = createHuffmanTable(createHuffmanTreeFromHistogram(histogram))
+        header = createCodeLengthsHeader(huffmanTable)
+        encodedSeqErrorImages = encodeFrames(groupFrames, groupFrameTypes, encodeHuffmanFrames,
+                                             createHuffmanCodeArrays(huffmanTable), executor)
+    else:
+        raise ValueError(f'Unknown entropy coder: {entropyCoder}')
+    return entropyCoder, False, header, encodedSeqErrorImages, createFrameIndex(encodedSeqErrorImages)
+
+
+def decodeSeqErrorImages(encodedGroups, width, height, workers=workers, out=None):
+    """
+        Decode the error frames sequence coded in groups, switching to the entropy coder and the table of each group.
+        The groups may be read one at a time (a generator) when out is given.
+        workers: worker processes for the frames of each group (one process pool for all the groups)
+        out: the frame sequence the error frames are decoded in (see videoFunction.createFrameSequence), if given
+    """
+    if out is None:
+        encodedGroups = list(encodedGroups)
+        out = np.empty((sum(len(group[3]) for group in encodedGroups), height, width), dtype=np.uint8)
+    decodedSeqErrorImages = out
+    groupStart = 0
+    with createProcessPool(workers) as executor:
+        for entropyCoder, zeroRunLength, header, encodedSeqErrorImages, frameIndex in encodedGroups:
+            out = decodedSeqErrorImages[groupStart:groupStart + len(encodedSeqErrorImages)]
+            if zeroRunLength:
+                decodeZeroRunLength(encodedSeqErrorImages, entropyCoder, header, out, executor)
+            elif entropyCoder == 'rans':
+                decodeFrames(encodedSeqErrorImages, decodeRansCodes, readRansHeader(header), out, frameIndex, executor)
+            else:
+                huffmanTable = readCodeLengthsHeader(header)
+                decodingTables = createHuffmanDecodingTables(
+                    huffmanTable, np.array(list(huffmanTable), dtype=np.uint8)) if huffmanTable else None
+                decodeFrames(encodedSeqErrorImages, decodeHuffmanCodes, decodingTables, out, frameIndex, executor)
+            groupStart += len(encodedSeqErrorImages)
+    return decodedSeqErrorImages
+
+
+def encodeFrames(seqErrorImages, frameTypes, encodeFrameChunk, codeTable, executor=None):
+    """
+        Encode the error frames sequence with a symbol coder, in chunks of framesPerChunk consecutive frames, which are
+        independent once the table is fixed: they are encoded in the process pool (executor), if given. The workers
+        map the frames from the file of the sequence (see findMappedFile) or from a shared memory copy of it, so only
+        the chunk bounds are sent to them, else the chunks of frames are sent to them.
+        encodeFrameChunk: the coder of a chunk of frames with the code table (see huffman.encodeHuffmanFrames,
+        rans.encodeRansFrames), the skip frames ('S' in frameTypes) becoming None
+    """
+    chunkStarts = range(0, len(seqErrorImages), framesPerChunk)
+    chunkFrameTypes = [frameTypes[i:i + framesPerChunk] for i in chunkStarts]
+    encodedSeqErrorImages = []
+    progressBar(0, len(seqErrorImages), 'Encoding the error frames sequence:', 'Encoded the error frames sequence!')
+    framesFile, sharedFrames = None, None
+    if executor is not None:
+        framesFile = findMappedFile(seqErrorImages)
+        if framesFile is None and sharedDirectory is not None:
+            sharedFrames = createSharedArray((len(seqErrorImages),) + seqErrorImages[0].shape)
+            sharedFrames[...] = seqErrorImages
+            framesFile = (sharedFrames.filename, 0)
+    if framesFile is None:
+        encodedChunks = (map if executor is None else executor.map)(
+            encodeFrameChunk, (seqErrorImages[i:i + framesPerChunk] for i in chunkStarts), chunkFrameTypes,
+            repeat(codeTable))
+    else:
+        encodedChunks = executor.map(encodeSharedFrameChunk, repeat(framesFile),
+                                     repeat((len(seqErrorImages),) + seqErrorImages[0].shape), chunkStarts,
+                                     chunkFrameTypes, repeat(encodeFrameChunk), repeat(codeTable))
+    try:
+        for encodedChunk in encodedChunks:
+            encodedSeqErrorImages.extend(encodedChunk)
+            progressBar(len(encodedSeqErrorImages), len(seqErrorImages), 'Encoding the error frames sequence:',
+                        'Encoded the error frames sequence!')
+    finally:
+        if sharedFrames is not None:
+            removeSharedArray(sharedFrames)
+    return encodedSeqErrorImages
+
+
+def encodeSharedFrameChunk(framesFile, shape, chunkStart, frameTypes, encodeFrameChunk, codeTable):
+    """
+        Encode consecutive error frames of a sequence mapped from a file (a worker task), see encodeFrames
+        framesFile form: (fileName, byteOffset) of the sequence
+    """
+    sharedFrames = np.memmap(framesFile[0], dtype=np.uint8, mode='r', offset=framesFile[1], shape=shape)
+    return encodeFrameChunk(sharedFrames[chunkStart:chunkStart + len(frameTypes)], frameTypes, codeTable)
+
+
+def findMappedFile(array, writeable=False):
+    """
+        Find the file a C-contiguous array is mapped from (an np.memmap or a view of it, as the frame sequences of a
+        frameStore or the arrays of a container), so that the workers map it by its file name instead of a copy of it.
+        writeable: the mapping writes to the file, for the workers to write their part of the array in place
+        Return form: (fileName, byteOffset), None if the array is not mapped from a file
+    """
+    if not isinstance(array, np.memmap) or array.filename is None or not array.flags.c_contiguous or \
+            array.mode == 'c' or (writeable and array.mode == 'r'):
+        return None
+    mappedArray = array  # The array of the whole mapping, at the offset of the memmap in the file
+    while isinstance(mappedArray.base, np.memmap):
+        mappedArray = mappedArray.base
+    return array.filename, mappedArray.offset + array.ctypes.data - mappedArray.ctypes.data
+
+
+def findMappedBytes(encodedSeqErrorImages, frameIndex):
+    """
+        Find the file the packed bytes of the coded frames are mapped from, in the order and at the offsets of the byte
+        offset index of the frames (as the frames of a group read from a container, see
+        videoContainer.readErrorImageGroup).
+        Return form: (fileName, byteOffset) of the bytes of the sequence, None if they are not mapped from one file
+    """
+    codedFrames = [i for i, encodedErrorImage in enumerate(encodedSeqErrorImages) if encodedErrorImage is not None]
+    if int(frameIndex[-1]) == 0:
+        return None
+    mappedFiles = [findMappedFile(encodedSeqErrorImages[i][0]) for i in codedFrames]
+    if any(mappedFile is None or mappedFile[0] != mappedFiles[0][0] for mappedFile in mappedFiles):
+        return None
+    byteOffset = mappedFiles[0][1] - int(frameIndex[codedFrames[0]])
+    if any(mappedFile[1] != byteOffset + int(frameIndex[i]) for i, mappedFile in zip(codedFrames, mappedFiles)):
+        return None
+    return mappedFiles[0][0], byteOffset
+
+
+def createSharedArray(shape):
+    """
+        Create a zero uint8 array shared with the workers of the process pool: a temporary np.memmap file in the
+        sharedDirectory (in memory on Linux) that the workers map by its file name. It is removed with
+        removeSharedArray.
+    """
+    descriptor, fileName = tempfile.mkstemp(prefix='sharedArray', dir=sharedDirectory)
+    os.close(descriptor)
+    return np.memmap(fileName, dtype=np.uint8, mode='w+', shape=shape)
+
+
+def removeSharedArray(sharedArray):
+    """
+        Remove the file of an array shared with the workers (its memory is released with the last mapping of it), see
+        createSharedArray
+    """
+    os.remove(sharedArray.filename)
+
+
+def createFrameIndex(encodedSeqErrorImages):
+    """
+        Create the byte offset index of the encoded frames: the offset of each frame in the bytes of the sequence
+        joined in frame order, followed by the total length (the skip frames take no bytes).
+        Form: uint64 array of len(encodedSeqErrorImages) + 1 offsets
+    """
+    byteLengths = [0 if encodedErrorImage is None else len(encodedErrorImage[0])
+                   for encodedErrorImage in encodedSeqErrorImages]
+    return np.cumsum([0] + byteLengths, dtype=np.uint64)
+
+
+def decodeFrames(encodedSeqErrorImages, decodeCodes, decodingTable, out, frameIndex=None, executor=None):
+    """
+        Decode the error frames sequence with a symbol decoder into the output sequence, the skip frames (None) as zero
+        error frames.
+        Each run of consecutive coded frames is decoded at once, with the rows of all its frames as decoding lanes.
+        With a process pool (executor), the sequence is split in chunks of about the same number of bytes with the
+        byte offset index of the frames (frameIndex, created if None). The workers map the packed bytes of the frames
+        from the file they are read from (see findMappedBytes) and write their frames in place in the file of the
+        output sequence (see findMappedFile). The in-memory bytes and output sequence are shared as copies in the
+        sharedDirectory (see createSharedArray), else the bytes are sent to the workers and the frames sent back.
+        decodeCodes: the decoder of the lanes with the decoding table (see huffman.decodeHuffmanCodes,
+        rans.decodeRansCodes)
+    """
+    out[[encodedErrorImage is None for encodedErrorImage in encodedSeqErrorImages]] = 0
+    if all(encodedErrorImage is None for encodedErrorImage in encodedSeqErrorImages):  # Only skip frames
+        return out
+    progressBar(0, len(encodedSeqErrorImages), 'Decoding the error frames sequence:',
+                'Decoded the error frames sequence!')
+    if executor is None:
+        for runEnd in decodeFrameRuns(encodedSeqErrorImages, decodeCodes, decodingTable, out):
+            progressBar(runEnd, len(encodedSeqErrorImages), 'Decoding the error frames sequence:',
+                        'Decoded the error frames sequence!')
+        return out
+
+    if frameIndex is None:
+        frameIndex = createFrameIndex(encodedSeqErrorImages)
+    frameIndex = np.asarray(frameIndex, dtype=np.int64)
+    noOfChunks = -(-len(encodedSeqErrorImages) // framesPerChunk)
+    chunkBytes = np.linspace(0, int(frameIndex[-1]), noOfChunks + 1)[1:-1].astype(np.int64)
+    chunkBounds = np.unique(np.concatenate([[0], np.searchsorted(frameIndex[:-1], chunkBytes),
+                                            [len(encodedSeqErrorImages)]])).tolist()
+
+    sharedArrays = []
+    try:
+        bytesFile = findMappedBytes(encodedSeqErrorImages, frameIndex)
+        if bytesFile is None and sharedDirectory is not None and frameIndex[-1] > 0:
+            sharedBytes = createSharedArray(int(frameIndex[-1]))
+            sharedArrays.append(sharedBytes)
+            for i, encodedErrorImage in enumerate(encodedSeqErrorImages):
+                if encodedErrorImage is not None:
+                    sharedBytes[frameIndex[i]:frameIndex[i + 1]] = np.frombuffer(encodedErrorImage[0], dtype=np.uint8)
+            bytesFile = (sharedBytes.filename, 0)
+        # The frames without their packed bytes, when the workers map them
+        frameSpecs = encodedSeqErrorImages if bytesFile is None else \
+            [None if encodedErrorImage is None else (None,) + tuple(encodedErrorImage[1:])
+             for encodedErrorImage in encodedSeqErrorImages]
+
+        outFile, sharedFrames = findMappedFile(out, writeable=True), None
+        if outFile is None and sharedDirectory is not None:
+            sharedFrames = createSharedArray(out.shape)
+            sharedArrays.append(sharedFrames)
+            outFile = (sharedFrames.filename, 0)
+
+        for chunkStart, chunkEnd, decodedFrames in executor.map(
+                decodeSharedFrameChunk, repeat(bytesFile), repeat(outFile), repeat(out.shape), chunkBounds[:-1],
+                chunkBounds[1:], (frameSpecs[start:end] for start, end in zip(chunkBounds[:-1], chunkBounds[1:])),
+                repeat(frameIndex), repeat(decodeCodes), repeat(decodingTable)):
+            if decodedFrames is not None:
+                out[chunkStart:chunkEnd] = decodedFrames
+            progressBar(chunkEnd, len(encodedSeqErrorImages), 'Decoding the error frames sequence:',
+                        'Decoded the error frames sequence!')
+        if sharedFrames is not None:
+            out[...] = sharedFrames
+    finally:
+        for sharedArray in sharedArrays:
+            removeSharedArray(sharedArray)
+    return out
+
+
+def decodeSharedFrameChunk(bytesFile, outFile, shape, chunkStart, chunkEnd, frameSpecs, frameIndex, decodeCodes,
+                           decodingTable):
+    """
+        Decode consecutive error frames (a worker task), see decodeFrames, from the packed bytes mapped from their file
+        (bytesFile form: (fileName, byteOffset)), if given, else from the coded frames, into the output sequence mapped
+        from its file (outFile), if given, else into the returned frames.
+        Return form: (chunkStart, chunkEnd, decodedFrames), decodedFrames being None when written in place
+    """
+    packedBytes = None
+    if bytesFile is not None:
+        packedBytes = np.memmap(bytesFile[0], dtype=np.uint8, mode='r', offset=bytesFile[1],
+                                shape=int(frameIndex[-1]))
+    if outFile is None:
+        out = np.zeros((chunkEnd - chunkStart,) + tuple(shape[1:]), dtype=np.uint8)
+    else:
+        out = np.memmap(outFile[0], dtype=np.uint8, mode='r+', offset=outFile[1], shape=shape)[chunkStart:chunkEnd]
+    for _ in decodeFrameRuns(frameSpecs, decodeCodes, decodingTable, out, packedBytes,
+                             frameIndex[chunkStart:chunkEnd + 1]):
+        pass
+    return chunkStart, chunkEnd, None if outFile is not None else out
+
+
+def decodeFrameRuns(encodedSeqErrorImages, decodeCodes, decodingTable, out, packedBytes=None, frameIndex=None):
+    """
+        Decode the runs of consecutive coded frames into the output sequence (the skip frames are left as they are),
+        yielding the end of each run
+        packedBytes: the joined packed bytes of the frames (a uint8 array), if given, the bytes of each frame being at
+        its byte offset (frameIndex) instead of in the coded frame
+    """
+    width = out.shape[2]
+    runStart = 0
+    while runStart < len(encodedSeqErrorImages):
+        runEnd = runStart
+        while runEnd < len(encodedSeqErrorImages) and encodedSeqErrorImages[runEnd] is not None:
+            runEnd += 1
+        if runEnd > runStart:
+            # The bytes of the run, and the bit offsets of the rows within them
+            if packedBytes is None:
+                runBytes = b''.join(encodedSeqErrorImages[i][0] for i in range(runStart, runEnd))
+                byteOffsets = createFrameIndex(encodedSeqErrorImages[runStart:runEnd])
+            else:
+                runBytes = packedBytes[frameIndex[runStart]:frameIndex[runEnd]].tobytes()
+                byteOffsets = frameIndex[runStart:runEnd] - frameIndex[runStart]
+            laneOffsets = np.concatenate([encodedSeqErrorImages[i][2].astype(np.int64) + 8 * int(byteOffset)
+                                          for i, byteOffset in zip(range(runStart, runEnd), byteOffsets)])
+            decodeCodes(runBytes, laneOffsets, decodingTable, out[runStart:runEnd].reshape(-1, width))
+        runStart = runEnd + 1
+        yield min(runStart, len(encodedSeqErrorImages))
@@ -1,59 +1,280 @@
+from collections import Counter, OrderedDict, deque
+from itertools import repeat
+
 import cv2
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
+from motionVectorField import createMotionVectorFieldForFrames, getFrameMotionVectors
+from processPool import createProcessPool, workers
 from progressBar import *
 
 macroblockSize = 64
 radius = 32  # Search radius
 numLevels = 3  # Pyramid Levels
-
-
-def hierarchicalSearch(originalFrames):
+fullSearchMode = 'costSurface'  # 'costSurface' (all the macroblocks at once) or 'perMacroblock' (no early termination)
+framePairsPerChunk = 8  # Least consecutive frame pairs searched by a worker at a time (they share the frame pyramids)
+pyramidCacheSize = 2  # Frame pyramids kept in the cache (the target frame of a pair is the reference of the next)
+strategy = 'fullSearch'  # Search of the highest level: 'fullSearch' or one of blockMatchingStrategies
+earlyTermination = False  # Drop the candidates whose partial SAD value can no longer be selected
+partialDistortionRows = 4  # Rows of a macroblock added to the partial SAD values at a time (early termination)
+costSurfacePartialRows = 8  # Rows of each macroblock in the partial cost surface (early termination, highest level)
+temporalPrediction = False  # Seed each macroblock with the motion vector of the previous frame at the same position
+temporalHistory = 3  # Recent frames whose motion vector changes choose the search radius of a macroblock
+temporalMinimumRadius = 2  # Smallest search radius around a predicted motion vector (at the highest level)
+temporalFallbackSAD = 8  # Mean absolute difference per pixel above which a predicted match is poor (full radius)
+skipThreshold = None  # Zero motion SAD value up to which a macroblock is static (None: no skip detection, 0: lossless)
+sceneCutThreshold = None  # Histogram distance (0-1) above which a frame is a scene cut (None: no scene cut detection)
+sceneCutHistogramBins = 32  # Bins of the histograms compared by the scene cut detection
+
+# Offsets (di, dj) of the neighbouring reference macroblocks, in the order they are compared (the first minimum wins)
+neighbourOffsets = [(0, 0), (0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+# Diamond search patterns (dy, dx), the center first
+largeDiamondPattern = [(0, 0), (-2, 0), (-1, -1), (-1, 1), (0, -2), (0, 2), (1, -1), (1, 1), (2, 0)]
+smallDiamondPattern = [(0, 0), (-1, 0), (0, -1), (0, 1), (1, 0)]
+
+
+def hierarchicalSearch(originalFrames, fullSearchMode=fullSearchMode, workers=workers,
+                       pyramidCacheSize=pyramidCacheSize, strategy=strategy, searchStatistics=None,
+                       earlyTermination=earlyTermination, temporalPrediction=temporalPrediction,
+                       skipThreshold=skipThreshold, sceneCutThreshold=sceneCutThreshold):
     """
-            Execute the hierarchical search algorithm.
+        Execute the hierarchical search algorithm, return the motion vector field of the frames with the SAD values
+        (see motionVectorField.createMotionVectorField) and their types ('I', 'P' or 'S') in 'frameTypes'.
+        fullSearchMode: 'costSurface' (all the macroblocks at once) or 'perMacroblock'
+        workers: worker processes searching chunks of consecutive frame pairs (see splitFramePairs)
+        pyramidCacheSize: frame pyramids kept while the sequence is searched (each one is built once)
+        strategy: search of the highest level, 'fullSearch' or one of blockMatchingStrategies
+        searchStatistics: a collections.Counter the search statistics are added to, if given
+        earlyTermination: drop the candidates whose partial SAD value can no longer be selected
+        temporalPrediction: search the highest level around the motion vectors of the previous frame
+        skipThreshold: zero motion SAD value up to which a macroblock is static (a fully static frame is 'S')
+        sceneCutThreshold: histogram distance above which a frame is a scene cut, not searched ('I')
     """
-    motionVectors = []
+    height, width = originalFrames[0].shape[:2]
+    motionVectorField = createMotionVectorFieldForFrames(len(originalFrames) - 1, width, height, withSAD=True)
+    frameTypes = ['I']
+    if searchStatistics is None:
+        searchStatistics = Counter()
+    searchOptions = {'fullSearchMode': fullSearchMode, 'strategy': strategy, 'earlyTermination': earlyTermination,
+                     'temporalPrediction': temporalPrediction, 'skipThreshold': skipThreshold,
+                     'sceneCutThreshold': sceneCutThreshold}
 
     progressBar(0, len(originalFrames), 'Calculating the motion vectors: ', 'Motion Vectors Calculations Completed!')
+    if workers > 1:
+        # The first frame of a chunk is the last frame of the previous one: its pyramid is built once, here
+        chunkBoundaries = splitFramePairs(len(originalFrames) - 1, workers)
+        chunks = [originalFrames[start:end + 1] for start, end in zip(chunkBoundaries[:-1], chunkBoundaries[1:])]
+        firstFramePyramids = [createPyramid(originalFrames[start])[1:] for start in chunkBoundaries[:-1]]
+        with createProcessPool(workers) as executor:
+            for chunkMotionVectorField, chunkStatistics in executor.map(searchFrameSequence, chunks,
+                                                                        firstFramePyramids, repeat(searchOptions),
+                                                                        repeat(pyramidCacheSize)):
+                chunkFrames = slice(len(frameTypes) - 1, len(frameTypes) - 1 + len(chunkMotionVectorField['SAD']))
+                motionVectorField['motionVectors'][chunkFrames] = chunkMotionVectorField['motionVectors']
+                motionVectorField['SAD'][chunkFrames] = chunkMotionVectorField['SAD']
+                frameTypes.extend(chunkMotionVectorField['frameTypes'][1:])
+                searchStatistics.update(chunkStatistics)
+                progressBar(len(frameTypes), len(originalFrames), 'Calculating the motion vectors: ',
+                            'Motion Vectors Calculations Completed!')
+    else:
+        pyramidCache = OrderedDict()  # The pyramids of this sequence only, by frame index
+        recentMotionVectors = deque(maxlen=temporalHistory + 1)
+        for i in range(1, len(originalFrames)):
+            referenceFramePyramid = getFramePyramid(originalFrames, i - 1, pyramidCache, pyramidCacheSize)
+            targetFramePyramid = getFramePyramid(originalFrames, i, pyramidCache, pyramidCacheSize)
+            frameTypes.append(searchFramePair(referenceFramePyramid, targetFramePyramid, searchOptions,
+                                              searchStatistics, motionVectorField, i - 1, recentMotionVectors))
+            updateRecentMotionVectors(recentMotionVectors, frameTypes[-1], motionVectorField, i - 1)
+            progressBar(i + 1, len(originalFrames), 'Calculating the motion vectors: ',
+                        'Motion Vectors Calculations Completed!')
+
+    motionVectorField['frameTypes'] = ''.join(frameTypes)
+    return motionVectorField
+
+
+def splitFramePairs(noOfFramePairs, workers):
+    """
+        Split the frame pairs into chunks of consecutive pairs for the workers: as many chunks of at least
+        framePairsPerChunk pairs as a multiple of the workers allows (at least one per worker), of balanced sizes.
+        Consecutive chunks share a frame, the target frame of the last pair of a chunk being the reference frame of
+        the first pair of the next one.
+        Return the index of the first frame of each chunk, followed by the index of the last frame.
+    """
+    noOfChunks = noOfFramePairs // framePairsPerChunk // workers * workers
+    noOfChunks = max(noOfChunks, min(workers, noOfFramePairs))
+    if noOfChunks == 0:
+        return [0]
+    return [noOfFramePairs * chunk // noOfChunks for chunk in range(noOfChunks + 1)]
+
+
+def searchFrameSequence(originalFrames, firstFramePyramid, searchOptions, pyramidCacheSize=pyramidCacheSize):
+    """
+        Execute the hierarchical search algorithm for the consecutive frame pairs of a sequence (a worker task).
+        firstFramePyramid: the lower levels of the pyramid of the first frame (built by the parent process)
+        Return the motion vector field and the search statistics of the sequence.
+    """
+    pyramidCache = OrderedDict({0: [originalFrames[0]] + list(firstFramePyramid)})
+    searchStatistics = Counter()
+    height, width = originalFrames[0].shape[:2]
+    motionVectorField = createMotionVectorFieldForFrames(len(originalFrames) - 1, width, height, withSAD=True)
+    frameTypes = ['I']
+    recentMotionVectors = deque(maxlen=temporalHistory + 1)
     for i in range(1, len(originalFrames)):
-        referenceFrame = originalFrames[i - 1]
-        targetFrame = originalFrames[i]
+        frameTypes.append(searchFramePair(getFramePyramid(originalFrames, i - 1, pyramidCache, pyramidCacheSize),
+                                          getFramePyramid(originalFrames, i, pyramidCache, pyramidCacheSize),
+                                          searchOptions, searchStatistics, motionVectorField, i - 1,
+                                          recentMotionVectors))
+        updateRecentMotionVectors(recentMotionVectors, frameTypes[-1], motionVectorField, i - 1)
+    motionVectorField['frameTypes'] = ''.join(frameTypes)
+    return motionVectorField, searchStatistics
 
-        # Subsample previous and current frames in 3 levels
-        referenceFramePyramid, targetFramePyramid = createPyramidLevels(referenceFrame, targetFrame)
 
-        # Execute the hierarchical search algorithm for each level
-        levels = len(referenceFramePyramid)
-        MVnSAD = None
-        for level in range(levels - 1, -1, -1):
-            MVnSAD = executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, MVnSAD)
-        motionVectors.append([value[0] for value in MVnSAD])
-        progressBar(i + 1, len(originalFrames), 'Calculating the motion vectors: ',
-                    'Motion Vectors Calculations Completed!')
+def searchFramePair(referenceFramePyramid, targetFramePyramid, searchOptions, searchStatistics, motionVectorField, i,
+                    recentMotionVectors=None):
+    """
+        Execute the hierarchical search algorithm for a pair of frames (reference, target), given their pyramids, and
+        write the motion vectors and their SAD values in the i-th frame of the motion vector field.
+        searchOptions form: {'fullSearchMode': ..., 'strategy': ..., 'earlyTermination': ..., 'temporalPrediction': ...,
+        'skipThreshold': ..., 'sceneCutThreshold': ...}
+        recentMotionVectors: the motion vectors of the recent frames, oldest first (for the temporal prediction).
+        Return the type of the target frame: 'I' (intra frame) at a scene cut, 'S' (skip frame) if every macroblock is
+        static, else 'P'. The intra and skip frames keep zero motion vectors.
+    """
+    if searchOptions.get('sceneCutThreshold') is not None and \
+            isSceneCut(referenceFramePyramid[-1], targetFramePyramid[-1], searchOptions['sceneCutThreshold']):
+        searchStatistics['sceneCuts'] += 1
+        return 'I'
+
+    staticMacroblocks = None
+    if searchOptions.get('skipThreshold') is not None:
+        staticMacroblocks = findStaticMacroblocks(referenceFramePyramid[0], targetFramePyramid[0],
+                                                  searchOptions['skipThreshold'])
+        searchStatistics['skippedMacroblocks'] += int(np.count_nonzero(staticMacroblocks))
+        if staticMacroblocks.all():
+            searchStatistics['skippedFrames'] += 1
+            return 'S'
+
+    # Execute the hierarchical search algorithm for each level
+    levels = len(referenceFramePyramid)
+    temporalPredictions = None
+    if searchOptions.get('temporalPrediction') and recentMotionVectors:
+        temporalPredictions = predictTemporalMotionVectors(recentMotionVectors, levels - 1)
+    MVnSAD = None
+    for level in range(levels - 1, -1, -1):
+        MVnSAD = executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, MVnSAD, searchOptions,
+                              searchStatistics, temporalPredictions, staticMacroblocks)
+    motionVectorField['motionVectors'][i], SAD_values = MVnSAD
+    if motionVectorField['SAD'] is not None:
+        motionVectorField['SAD'][i] = SAD_values
+    return 'P'
+
+
+def isSceneCut(referenceFrame, targetFrame, sceneCutThreshold):
+    """
+        Detect a scene cut: the distance between the normalized histograms of the two frames (half of their L1
+        distance, from 0 for the same histogram to 1 for disjoint ones) is above the scene cut threshold.
+    """
+    binWidth = 256 // sceneCutHistogramBins
+    referenceHistogram = np.bincount(referenceFrame.ravel() // binWidth, minlength=sceneCutHistogramBins)
+    targetHistogram = np.bincount(targetFrame.ravel() // binWidth, minlength=sceneCutHistogramBins)
+    distance = np.abs(referenceHistogram / referenceFrame.size - targetHistogram / targetFrame.size).sum() / 2
+    return distance > sceneCutThreshold
 
-    return motionVectors
 
+def updateRecentMotionVectors(recentMotionVectors, frameType, motionVectorField, i):
+    """
+        Add the motion vectors of the i-th frame of the field to the recent ones (temporal prediction). A skip frame
+        adds nothing and a scene cut (intra frame) forgets the motion before it.
+    """
+    if frameType == 'I':
+        recentMotionVectors.clear()
+    elif frameType == 'P':
+        recentMotionVectors.append(getFrameMotionVectors(motionVectorField, i))
 
-def createPyramidLevels(referenceFrame, targetFrame):
+
+def findStaticMacroblocks(referenceFrame, targetFrame, skipThreshold):
     """
-        Create the Gaussian pyramid for the two frames.
+        Find the static macroblocks: the ones whose zero motion SAD value is not above the skip threshold.
+        Return form: (noOfRows, noOfCols) boolean array.
+    """
+    noOfRows = targetFrame.shape[0] // macroblockSize
+    noOfCols = targetFrame.shape[1] // macroblockSize
+    absoluteDifferences = cv2.absdiff(targetFrame, referenceFrame)[:noOfRows * macroblockSize,
+                                                                   :noOfCols * macroblockSize]
+    zeroMotionSAD_values = absoluteDifferences.reshape(noOfRows, macroblockSize, noOfCols, macroblockSize).sum(
+        axis=(1, 3), dtype=np.int64)
+    return zeroMotionSAD_values <= skipThreshold
+
+
+def predictTemporalMotionVectors(recentMotionVectors, level):
+    """
+        Predict the motion vector of every macroblock at the level from the previous frame, at the same position, and
+        choose its search radius from how much its motion vector changed in the recent frames (the full radius if
+        there is only one frame).
+        Return form: (predictedMotionVectors, searchRadii), (macroblocks, 2) and (macroblocks,) arrays
+    """
+    k = radius // (2 ** level)
+    recentLevelMotionVectors = np.array(recentMotionVectors) // (2 ** level)  # form: (frames, macroblocks, 2)
+    predictedMotionVectors = np.clip(recentLevelMotionVectors[-1], -k, k)
+    if len(recentLevelMotionVectors) > 1:
+        changes = np.abs(np.diff(recentLevelMotionVectors, axis=0)).max(axis=(0, 2))
+        searchRadii = np.clip(changes + 1, temporalMinimumRadius, k)
+    else:
+        searchRadii = np.full(len(predictedMotionVectors), k)
+    return predictedMotionVectors, searchRadii
+
+
+def getFramePyramid(originalFrames, i, pyramidCache, pyramidCacheSize=pyramidCacheSize):
     """
-    referenceFramePyramid = [referenceFrame]
-    targetFramePyramid = [targetFrame]
+        Get the Gaussian pyramid of the i-th frame from the cache, or create it and add it to the cache.
+        The least recently used pyramids are dropped when the cache holds more than pyramidCacheSize pyramids.
+    """
+    if i in pyramidCache:
+        pyramidCache.move_to_end(i)
+        return pyramidCache[i]
+
+    framePyramid = createPyramid(originalFrames[i])
+    pyramidCache[i] = framePyramid
+    while len(pyramidCache) > pyramidCacheSize:
+        pyramidCache.popitem(last=False)
+    return framePyramid
 
+
+def createPyramid(frame):
+    """
+        Create the Gaussian pyramid of a frame.
+    """
+    framePyramid = [frame]
     for level in range(1, numLevels):
-        referenceFrame = cv2.pyrDown(referenceFrame)
-        targetFrame = cv2.pyrDown(targetFrame)
-        referenceFramePyramid.append(referenceFrame)
-        targetFramePyramid.append(targetFrame)
+        frame = cv2.pyrDown(frame)
+        framePyramid.append(frame)
+    return framePyramid
+
 
-    return referenceFramePyramid, targetFramePyramid
+def createPyramidLevels(referenceFrame, targetFrame):
+    """
+        Create the Gaussian pyramid for the two frames.
+    """
+    return createPyramid(referenceFrame), createPyramid(targetFrame)
 
 
-def executeLevel(referenceFrame, targetFrame, level, MVnSAD):
+def executeLevel(referenceFrame, targetFrame, level, MVnSAD, searchOptions=None, searchStatistics=None,
+                 temporalPredictions=None, staticMacroblocks=None):
     """
         Execute the hierarchical search algorithm for each level.
+        MVnSAD form: (motionVectors, SAD_values), (noOfRows, noOfCols, 2) and (noOfRows, noOfCols) int64 arrays, the
+        result of the level above (None at the highest level), and the form of the result.
+        The static macroblocks, form: (noOfRows, noOfCols) boolean array, get the zero motion vector with a SAD value
+        of 0 at the highest level, which the lower levels never replace.
+        The temporalPredictions (see predictTemporalMotionVectors) reduce the search area of each macroblock at the
+        highest level, with any strategy and full search mode.
     """
+    searchOptions = {'fullSearchMode': fullSearchMode, 'strategy': strategy, 'earlyTermination': earlyTermination,
+                     'temporalPrediction': temporalPrediction, **(searchOptions or {})}
+    if searchStatistics is None:
+        searchStatistics = Counter()
     width = referenceFrame.shape[1]
     height = referenceFrame.shape[0]
     k = radius // (2 ** level)
@@ -66,14 +287,28 @@ def executeLevel(referenceFrame, targetFrame, level, MVnSAD):
                                                           noOfCols)
 
     if level == 2:  # level 3 (highest level - executing full search algorithm)
+        if searchOptions['strategy'] != 'fullSearch':
+            return executeBlockMatchingSearch(blockMatchingStrategies[searchOptions['strategy']], referenceFrame,
+                                              targetFrameInMacroblocks, macroblockLevelSize, noOfRows, noOfCols, k,
+                                              searchStatistics, temporalPredictions, staticMacroblocks)
+        if searchOptions['fullSearchMode'] == 'costSurface' or searchOptions['earlyTermination']:
+            return executeCostSurfaceSearch(referenceFrame, targetFrameInMacroblocks, macroblockLevelSize, noOfRows,
+                                            noOfCols, k, searchStatistics, searchOptions['earlyTermination'],
+                                            temporalPredictions, staticMacroblocks)
         return getMVnSADErrorValuesForHighestLevel(referenceFrame, targetFrameInMacroblocks, macroblockLevelSize,
-                                                   noOfRows, noOfCols, k)
+                                                   noOfRows, noOfCols, k, searchStatistics, temporalPredictions,
+                                                   staticMacroblocks)
     else:  # levels 1-2 (executing block-matching algorithm)
-        MVnSAD_old = [[(y * 2, x * 2), SAD] for (y, x), SAD in MVnSAD]
+        motionVectors, SAD_values = MVnSAD[0] * 2, MVnSAD[1]
+        # With early termination, the candidates that cannot beat the motion vector of the previous level are dropped
+        boundSAD_values = SAD_values if searchOptions['earlyTermination'] else None
         matchedMacroblocks = getSADErrorValues(targetFrameInMacroblocks, referenceFrameInMacroblocks, noOfRows,
-                                               noOfCols)
-        MVnSAD_new = calculateMotionVectors(matchedMacroblocks, macroblockLevelSize, noOfCols)
-        return compareMVnSAD(MVnSAD_old, MVnSAD_new)  # return the updated motion vectors and SAD values, if needed
+                                               noOfCols, searchStatistics, boundSAD_values, staticMacroblocks)
+        newMotionVectors, newSAD_values = calculateMotionVectors(matchedMacroblocks, macroblockLevelSize)
+        # Update the motion vectors and SAD values, if needed
+        improved = newSAD_values < SAD_values
+        return np.where(improved[:, :, np.newaxis], newMotionVectors, motionVectors), \
+            np.where(improved, newSAD_values, SAD_values)
 
 
 def divideFrameIntoMacroblocks(frame, macroblockLevelSize, width, height, noOfRows, noOfCols):
@@ -93,11 +328,24 @@ def divideFrameIntoMacroblocks(frame, macroblockLevelSize, width, height, noOfRo
 
 
 def getMVnSADErrorValuesForHighestLevel(referenceFrame, targetFrameInMacroblocks, macroblockLevelSize, noOfRows,
-                                        noOfCols, k):
-    MVnSAD = []  # MVnSAD list form:
-    # [ [MV_for_i_macroblock, SAD_for_i_macroblock], [MV_for_i+1_macroblock, SAD_for_i+1_macroblock], ... ]
+                                        noOfCols, k, searchStatistics, temporalPredictions=None,
+                                        staticMacroblocks=None, searchMask=None):
+    """
+        Execute the full search algorithm for each target macroblock, inside its search area (and its search window,
+        with temporalPredictions, falling back to the search area on a poor match).
+        The static macroblocks are not searched and get the zero motion vector with a SAD value of 0.
+        searchMask: the macroblocks to search, form: (noOfRows, noOfCols) boolean array, the others keep the zero
+        motion vector with a SAD value of 0 (all of them if not given)
+        Return form: (motionVectors, SAD_values), see executeLevel
+    """
+    motionVectors = np.zeros((noOfRows, noOfCols, 2), dtype=np.int64)
+    SAD_values = np.zeros((noOfRows, noOfCols), dtype=np.int64)
+    paddedReferenceFrame = padReferenceFrame(referenceFrame, macroblockLevelSize)
     for i in range(noOfRows):
         for j in range(noOfCols):
+            if (staticMacroblocks is not None and staticMacroblocks[i, j]) or \
+                    (searchMask is not None and not searchMask[i, j]):
+                continue
             targetMacroblock = targetFrameInMacroblocks[i][j]
 
             # Find the coordinates of the pixel (top-left corner) on the target macroblock, which is equivalent of
@@ -107,11 +355,471 @@ def getMVnSADErrorValuesForHighestLevel(referenceFrame, targetFrameInMacroblocks
             # Find the search area on the reference frame that is inside the given radius (k).
             startingPixel, endingPixel = findSearchArea(targetPixel, k, referenceFrame.shape[1],
                                                         referenceFrame.shape[0])
-            MVnSAD.append(
-                executeFullSearch(referenceFrame, targetMacroblock, targetPixel, macroblockLevelSize, startingPixel,
-                                  endingPixel)
-            )
-    return MVnSAD
+            searchArea = (startingPixel, endingPixel)
+            if temporalPredictions is not None:
+                # The search window around the predicted motion vector, inside the search area
+                dy, dx = temporalPredictions[0][i * noOfCols + j].tolist()
+                searchRadius = int(temporalPredictions[1][i * noOfCols + j])
+                searchArea = ((max(startingPixel[0], targetPixel[0] + dy - searchRadius),
+                               max(startingPixel[1], targetPixel[1] + dx - searchRadius)),
+                              (min(endingPixel[0], targetPixel[0] + dy + searchRadius),
+                               min(endingPixel[1], targetPixel[1] + dx + searchRadius)))
+            MVnSAD = searchMacroblockArea(paddedReferenceFrame, targetMacroblock, targetPixel, macroblockLevelSize,
+                                          *searchArea, searchStatistics)
+            if temporalPredictions is not None and \
+                    (MVnSAD is None or MVnSAD[1] > temporalFallbackSAD * targetMacroblock.size):
+                # Poor predicted match: search the full radius
+                MVnSAD = searchMacroblockArea(paddedReferenceFrame, targetMacroblock, targetPixel,
+                                              macroblockLevelSize, startingPixel, endingPixel, searchStatistics)
+                searchStatistics['temporalFallbacks'] += 1
+            motionVectors[i, j], SAD_values[i, j] = MVnSAD
+    return motionVectors, SAD_values
+
+
+def searchMacroblockArea(paddedReferenceFrame, targetMacroblock, targetPixel, macroblockLevelSize, startingPixel,
+                         endingPixel, searchStatistics):
+    """
+        Execute the full search of the target macroblock inside the search area, None if the area is empty.
+    """
+    if startingPixel[0] > endingPixel[0] or startingPixel[1] > endingPixel[1]:
+        return None
+    searchStatistics['SADEvaluations'] += \
+        (endingPixel[0] - startingPixel[0] + 1) * (endingPixel[1] - startingPixel[1] + 1)
+    return executeFullSearch(paddedReferenceFrame, targetMacroblock, targetPixel, macroblockLevelSize, startingPixel,
+                             endingPixel, searchStatistics)
+
+
+def executeCostSurfaceSearch(referenceFrame, targetFrameInMacroblocks, macroblockLevelSize, noOfRows, noOfCols, k,
+                             searchStatistics, earlyTermination=False, temporalPredictions=None,
+                             staticMacroblocks=None):
+    """
+        Execute the full search algorithm for all the target macroblocks at once. The SAD values of every displacement
+        (dy, dx) inside the radius (k) form the cost surface of each macroblock, and the motion vector is its minimum.
+        With temporalPredictions (see predictTemporalMotionVectors), each macroblock is only searched inside its
+        search window, and a poor match is replaced by the full search of the macroblock.
+        The static macroblocks are not searched and get the zero motion vector with a SAD value of 0.
+    """
+    searchSize = 2 * k + 1
+    candidates = findSearchAreaCandidates(referenceFrame.shape, noOfRows, noOfCols, macroblockLevelSize, k)
+    if staticMacroblocks is not None:
+        candidates &= ~staticMacroblocks
+    windowCandidates = candidates
+    if temporalPredictions is not None:
+        windowCandidates = candidates & findSearchWindowCandidates(temporalPredictions, noOfRows, noOfCols, k)
+    costSurface = searchCostSurface(referenceFrame, targetFrameInMacroblocks, k, windowCandidates, earlyTermination,
+                                    searchStatistics)
+
+    fallbackMVnSAD = None
+    if temporalPredictions is not None:
+        # Poor predicted match: add the rest of the search area of the macroblock
+        fallbacks = np.min(costSurface, axis=0) > temporalFallbackSAD * macroblockLevelSize * macroblockLevelSize
+        if staticMacroblocks is not None:
+            fallbacks &= ~staticMacroblocks
+        noOfFallbacks = int(np.count_nonzero(fallbacks))
+        searchStatistics['temporalFallbacks'] += noOfFallbacks
+        if noOfFallbacks > noOfRows * noOfCols // 4:
+            costSurface = np.minimum(costSurface, searchCostSurface(
+                referenceFrame, targetFrameInMacroblocks, k, candidates & ~windowCandidates & fallbacks,
+                earlyTermination, searchStatistics))
+        elif noOfFallbacks:
+            # A few macroblocks (the borders the motion uncovers): a cost surface of the full radius would cost as much
+            # as for all the macroblocks, search them one at a time
+            fallbackMVnSAD = getMVnSADErrorValuesForHighestLevel(referenceFrame, targetFrameInMacroblocks,
+                                                                 macroblockLevelSize, noOfRows, noOfCols, k,
+                                                                 searchStatistics, searchMask=fallbacks)
+
+    # The first minimum in (dy, dx) row-major order, the same order the search area is scanned by executeFullSearch
+    bestDisplacements = np.argmin(costSurface, axis=0)
+
+    motionVectors = np.stack(np.divmod(bestDisplacements, searchSize), axis=-1) - k
+    SAD_values = np.take_along_axis(costSurface, bestDisplacements[np.newaxis], axis=0)[0]
+    if staticMacroblocks is not None:
+        motionVectors[staticMacroblocks] = 0
+        SAD_values[staticMacroblocks] = 0
+    if fallbackMVnSAD is not None:
+        motionVectors[fallbacks] = fallbackMVnSAD[0][fallbacks]
+        SAD_values[fallbacks] = fallbackMVnSAD[1][fallbacks]
+    return motionVectors, SAD_values
+
+
+def findSearchAreaCandidates(frameShape, noOfRows, noOfCols, macroblockLevelSize, k):
+    """
+        Find the displacements (dy, dx) inside the radius (k) that are inside the search area of each macroblock (see
+        findSearchArea).
+        Return form: (dy, dx, noOfRows, noOfCols) boolean array
+    """
+    height, width = frameShape
+
+    # Coordinates of the pixel (top-left corner) of every target macroblock, form: (y,) and (x,)
+    targetPixelsY = np.arange(noOfRows) * macroblockLevelSize
+    targetPixelsX = np.arange(noOfCols) * macroblockLevelSize
+
+    referencePixelsY = targetPixelsY[np.newaxis, :] + np.arange(-k, k + 1)[:, np.newaxis]  # form: (dy, noOfRows)
+    referencePixelsX = targetPixelsX[np.newaxis, :] + np.arange(-k, k + 1)[:, np.newaxis]  # form: (dx, noOfCols)
+    insideY = (referencePixelsY >= 0) & (referencePixelsY <= height)
+    insideX = (referencePixelsX >= 0) & (referencePixelsX <= width)
+    return insideY[:, np.newaxis, :, np.newaxis] & insideX[np.newaxis, :, np.newaxis, :]
+
+
+def findSearchWindowCandidates(temporalPredictions, noOfRows, noOfCols, k):
+    """
+        Find the displacements (dy, dx) inside the radius (k) that are inside the search window of each macroblock:
+        its search radius around its predicted motion vector (see predictTemporalMotionVectors).
+        Return form: (dy, dx, noOfRows, noOfCols) boolean array
+    """
+    predictedMotionVectors, searchRadii = temporalPredictions
+    predictedMotionVectors = predictedMotionVectors.reshape(noOfRows, noOfCols, 2)
+    searchRadii = searchRadii.reshape(noOfRows, noOfCols)
+    displacements = np.arange(-k, k + 1)[:, np.newaxis, np.newaxis]
+    insideY = np.abs(displacements - predictedMotionVectors[:, :, 0]) <= searchRadii  # form: (dy, noOfRows, noOfCols)
+    insideX = np.abs(displacements - predictedMotionVectors[:, :, 1]) <= searchRadii  # form: (dx, noOfRows, noOfCols)
+    return insideY[:, np.newaxis] & insideX[np.newaxis, :]
+
+
+def searchCostSurface(referenceFrame, targetFrameInMacroblocks, k, candidates, earlyTermination, searchStatistics):
+    """
+        Calculate the cost surface of the candidate displacements of each macroblock, candidates form: (dy, dx,
+        noOfRows, noOfCols) boolean array. Only the displacements that are a candidate of some macroblock are
+        calculated, and the other entries get np.iinfo(np.int64).max.
+        With early termination, the cost surface first only sums the first costSurfacePartialRows rows of each
+        macroblock, and the rest of the rows are only added to the candidates that can still be selected (see
+        completePartialCostSurface).
+        Return form: (dy * dx, noOfRows, noOfCols) array
+    """
+    macroblockLevelSize = targetFrameInMacroblocks.shape[2]
+    partialRows = min(costSurfacePartialRows, macroblockLevelSize) if earlyTermination else macroblockLevelSize
+    costSurface = calculateCostSurfaceRows(referenceFrame, targetFrameInMacroblocks, k, 0, partialRows, candidates)
+    costSurface[~candidates] = np.iinfo(np.int64).max
+    searchStatistics['SADEvaluations'] += int(np.count_nonzero(candidates))
+
+    costSurface = costSurface.reshape(-1, *costSurface.shape[2:])
+    if partialRows < macroblockLevelSize and candidates.any():
+        costSurface = completePartialCostSurface(referenceFrame, targetFrameInMacroblocks, costSurface, k, partialRows,
+                                                 searchStatistics)
+    return costSurface
+
+
+def calculateCostSurfaceRows(referenceFrame, targetFrameInMacroblocks, k, firstRow, lastRow, candidates=None):
+    """
+        Calculate the SAD values of the rows firstRow to lastRow (excluded) of every target macroblock, for every
+        displacement (dy, dx) inside the radius (k). The reference pixels outside the frame do not count.
+        With candidates, form: (dy, dx, noOfRows, noOfCols) boolean array, only the dy and dx that are a candidate of
+        some macroblock are calculated (the other entries are left undefined).
+        Return form: (dy, dx, noOfRows, noOfCols) array
+    """
+    height, width = referenceFrame.shape
+    noOfRows, noOfCols, macroblockLevelSize = targetFrameInMacroblocks.shape[:3]
+    searchSize = 2 * k + 1
+    bandRows = lastRow - firstRow
+    bandHeight, targetWidth = bandRows * noOfRows, noOfCols * macroblockLevelSize
+
+    # Pad the reference frame on every side, so that every displacement has a full reference macroblock
+    paddedReferenceFrame = cv2.copyMakeBorder(referenceFrame, k, k, k, k, cv2.BORDER_CONSTANT, value=0)
+
+    # The rows of the frames in the order (row in the macroblock, macroblock row), so that the rows of all the
+    # macroblocks are summed as whole rows
+    targetRows = np.ascontiguousarray(
+        targetFrameInMacroblocks[:, :, firstRow:lastRow].transpose(2, 0, 1, 3)).reshape(bandHeight, targetWidth)
+    rowsY = (np.arange(firstRow, lastRow)[:, np.newaxis] + np.arange(noOfRows) * macroblockLevelSize).ravel()
+
+    # The padded pixels do not count in the SAD value: the rows of each dy and the columns of each dx out of the frame
+    paddedRows = [np.flatnonzero((rowsY + dy - k < 0) | (rowsY + dy - k >= height)) for dy in range(searchSize)]
+    referencePixelsX = np.arange(targetWidth) + np.arange(-k, k + 1)[:, np.newaxis]  # form: (dx, x)
+    insideColumns = ((referencePixelsX >= 0) & (referencePixelsX < width)).astype(np.uint16)[:, np.newaxis, :]
+
+    displacementsY, displacementsX = np.arange(searchSize), np.arange(searchSize)
+    if candidates is not None:
+        displacementsY = np.flatnonzero(candidates.any(axis=(1, 2, 3)))
+        displacementsX = np.flatnonzero(candidates.any(axis=(0, 2, 3)))
+        insideColumns = insideColumns[displacementsX]
+    noOfDisplacementsX = len(displacementsX)
+
+    # costSurface form: (dy, dx, noOfRows, noOfCols), built one dy slice at a time to bound the memory
+    costSurface = np.empty((searchSize, searchSize, noOfRows, noOfCols), dtype=np.int64)
+    absoluteDifferences = np.empty((noOfDisplacementsX, bandHeight, targetWidth), dtype=np.uint8)  # (dx, row, x)
+    for dy in displacementsY:
+        referenceRows = np.ascontiguousarray(paddedReferenceFrame[dy:dy + noOfRows * macroblockLevelSize].reshape(
+            noOfRows, macroblockLevelSize, -1)[:, firstRow:lastRow].transpose(1, 0, 2)).reshape(bandHeight, -1)
+        for n, dx in enumerate(displacementsX):
+            cv2.absdiff(targetRows, referenceRows[:, dx:dx + targetWidth], dst=absoluteDifferences[n])
+        if len(paddedRows[dy]):
+            absoluteDifferences[:, paddedRows[dy]] = 0
+
+        # Box filter: sum the rows of the macroblocks (at most macroblockLevelSize * 255) without the padded columns,
+        # then their columns (exact in float32, below 2 ** 24)
+        rowSums = absoluteDifferences.reshape(noOfDisplacementsX, bandRows, -1).sum(axis=1, dtype=np.uint16)
+        rowSums.reshape(noOfDisplacementsX, noOfRows, targetWidth)[...] *= insideColumns
+        costSurface[dy, displacementsX] = cv2.reduce(rowSums.reshape(-1, macroblockLevelSize), 1, cv2.REDUCE_SUM,
+                                                     dtype=cv2.CV_32F).reshape(noOfDisplacementsX, noOfRows, noOfCols)
+    return costSurface
+
+
+def completePartialCostSurface(referenceFrame, targetFrameInMacroblocks, partialCostSurface, k, partialRows,
+                               searchStatistics):
+    """
+        Complete the cost surface of the partial SAD values of the first partialRows rows of each macroblock, form:
+        (dy * dx, noOfRows, noOfCols), np.iinfo(np.int64).max for the displacements that are not a candidate (partial
+        distortion elimination). The full SAD value of the best partial candidate of each macroblock bounds the others,
+        and only the candidates whose partial SAD value is within the bound get the rest of their rows. The other
+        candidates get np.iinfo(np.int64).max, so the first minimum does not change.
+    """
+    noOfRows, noOfCols, macroblockLevelSize = targetFrameInMacroblocks.shape[:3]
+    searchSize = 2 * k + 1
+    remainingRows = macroblockLevelSize - partialRows
+
+    # The remaining rows of every reference macroblock, padded with -1 (the padded pixels do not count)
+    paddedReferenceFrame = cv2.copyMakeBorder(referenceFrame.astype(np.int16), k, k, k, k, cv2.BORDER_CONSTANT,
+                                              value=-1)
+    referenceMacroblocks = sliding_window_view(paddedReferenceFrame, (remainingRows, macroblockLevelSize))
+    targetMacroblocks = targetFrameInMacroblocks[:, :, partialRows:].astype(np.int16)
+
+    def calculateSADValuesOfCandidates(displacements, rows, cols):
+        dy, dx = np.divmod(displacements, searchSize)
+        references = referenceMacroblocks[dy + rows * macroblockLevelSize + partialRows,
+                                          dx + cols * macroblockLevelSize].reshape(len(displacements), -1)
+        absoluteDifferences = cv2.absdiff(references, targetMacroblocks[rows, cols].reshape(len(displacements), -1))
+        absoluteDifferences[references < 0] = 0
+        return partialCostSurface[displacements, rows, cols] + cv2.reduce(
+            absoluteDifferences, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F).ravel().astype(np.int64)
+
+    # The full SAD value of the best partial candidate bounds the others: the candidates before it (in the scan order)
+    # win a tie, the ones after it lose it
+    # The macroblocks without any candidate (static, or searched in another pass) keep a bound of -1
+    insideCandidates = partialCostSurface < np.iinfo(np.int64).max
+    bestPartialDisplacements = np.argmin(partialCostSurface, axis=0)
+    searchedRows, searchedCols = np.nonzero(insideCandidates.any(axis=0))
+    boundSAD_values = np.full((noOfRows, noOfCols), -1, dtype=np.int64)
+    boundSAD_values[searchedRows, searchedCols] = calculateSADValuesOfCandidates(
+        bestPartialDisplacements[searchedRows, searchedCols], searchedRows, searchedCols)
+    candidates = partialCostSurface < boundSAD_values + (
+            np.arange(searchSize * searchSize)[:, np.newaxis, np.newaxis] <= bestPartialDisplacements)
+
+    noOfCandidates = int(np.count_nonzero(candidates))
+    noOfInsideCandidates = int(np.count_nonzero(insideCandidates))
+    if noOfCandidates > noOfInsideCandidates // 8:
+        # Too many candidates left (a flat cost surface): adding the rest of the rows of every one is faster
+        remainingCostSurface = calculateCostSurfaceRows(
+            referenceFrame, targetFrameInMacroblocks, k, partialRows, macroblockLevelSize,
+            candidates.reshape(searchSize, searchSize, noOfRows, noOfCols)).reshape(partialCostSurface.shape)
+        costSurface = np.where(candidates, partialCostSurface + remainingCostSurface, np.iinfo(np.int64).max)
+        noOfCompletedCandidates = noOfInsideCandidates
+    else:
+        costSurface = np.full_like(partialCostSurface, np.iinfo(np.int64).max)
+        candidates = np.nonzero(candidates)
+        costSurface[candidates] = calculateSADValuesOfCandidates(*candidates)
+        noOfCompletedCandidates = noOfCandidates + len(searchedRows)
+    searchStatistics['pixelComparisons'] += \
+        (noOfInsideCandidates * partialRows + noOfCompletedCandidates * remainingRows) * macroblockLevelSize
+    searchStatistics['skippedPixelComparisons'] += \
+        max(noOfInsideCandidates - noOfCompletedCandidates, 0) * remainingRows * macroblockLevelSize
+    return costSurface
+
+
+def executeBlockMatchingSearch(blockMatchingStrategy, referenceFrame, targetFrameInMacroblocks, macroblockLevelSize,
+                               noOfRows, noOfCols, k, searchStatistics, temporalPredictions=None,
+                               staticMacroblocks=None):
+    """
+        Execute a fast block-matching strategy for all the target macroblocks at once: each step of the strategy
+        evaluates its candidates for every macroblock still searching. The strategy only calculates the SAD values of
+        the candidates it visits, inside the same search area as the full search.
+        With temporalPredictions (see predictTemporalMotionVectors), the strategy is seeded with the predicted motion
+        vector, and a poor match is replaced by the full search of the macroblock.
+    """
+    height, width = referenceFrame.shape
+    searchSize = 2 * k + 1
+    macroblocks = np.arange(noOfRows * noOfCols)  # The macroblocks searched, in raster order
+    if staticMacroblocks is not None:
+        macroblocks = np.flatnonzero(~staticMacroblocks)
+
+    # The reference frame padded (bottom and right), so that every reference macroblock of the search area has the full
+    # macroblock size. The padded pixels do not count in the SAD value.
+    referenceMacroblocks = sliding_window_view(cv2.copyMakeBorder(referenceFrame, 0, macroblockLevelSize, 0,
+                                                                  macroblockLevelSize, cv2.BORDER_CONSTANT, value=0),
+                                               (macroblockLevelSize, macroblockLevelSize))
+    targetMacroblocks = targetFrameInMacroblocks.reshape(noOfRows * noOfCols, -1)
+
+    targetPixels = np.stack(np.divmod(np.arange(noOfRows * noOfCols), noOfCols), axis=1) * macroblockLevelSize
+
+    # The SAD values of the motion vectors of each macroblock, -1 for the ones not visited yet inside the search area
+    # (see findSearchArea) and np.iinfo(np.int32).max outside it. The patterns move the candidates at most
+    # max((k + 1) // 2, 2) past the radius (the first step of threeStepSearch), so the SAD values have this margin on
+    # every side.
+    gridRadius = k + max((k + 1) // 2, 2)
+    displacements = np.arange(-gridRadius, gridRadius + 1)
+    insideY = (targetPixels[:, 0, np.newaxis] + displacements >= 0) & (np.abs(displacements) <= k) & \
+              (targetPixels[:, 0, np.newaxis] + displacements <= height)
+    insideX = (targetPixels[:, 1, np.newaxis] + displacements >= 0) & (np.abs(displacements) <= k) & \
+              (targetPixels[:, 1, np.newaxis] + displacements <= width)
+    SAD_values = np.where(insideY[:, :, np.newaxis] & insideX[:, np.newaxis, :], np.int32(-1),
+                          np.iinfo(np.int32).max)
+    flatSAD_values = SAD_values.reshape(-1)
+    gridSize = 2 * gridRadius + 1
+
+    def evaluateCandidates(searchedMacroblocks, motionVectors):
+        """
+            Calculate the SAD values of the candidate motion vectors of the macroblocks, form: (macroblocks,
+            candidates, 2), that are inside the search area and not visited yet, and return the first candidate of each
+            macroblock with the minimum SAD value, form: (macroblocks, 2). The first candidates (the centers of the
+            patterns) are always inside the search area.
+        """
+        candidates = (searchedMacroblocks[:, np.newaxis] * gridSize + motionVectors[..., 0] + gridRadius) * gridSize + \
+            motionVectors[..., 1] + gridRadius  # Indices in the flat SAD values
+
+        newCandidates = candidates[flatSAD_values[candidates] == -1]
+        # Keep one of the repeated candidates: the one whose position its SAD value entry holds
+        positions = -2 - np.arange(len(newCandidates))
+        flatSAD_values[newCandidates] = positions
+        newCandidates = newCandidates[flatSAD_values[newCandidates] == positions]
+        if len(newCandidates):
+            macroblocks, gridPositions = np.divmod(newCandidates, gridSize * gridSize)
+            rows = targetPixels[macroblocks, 0] + gridPositions // gridSize - gridRadius
+            cols = targetPixels[macroblocks, 1] + gridPositions % gridSize - gridRadius
+            absoluteDifferences = cv2.absdiff(referenceMacroblocks[rows, cols].reshape(len(newCandidates), -1),
+                                              targetMacroblocks[macroblocks])
+            newSAD_values = cv2.reduce(absoluteDifferences, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+
+            # The reference macroblocks that cross the bottom or right border, without their padded pixels
+            crossing = np.flatnonzero((rows > height - macroblockLevelSize) | (cols > width - macroblockLevelSize))
+            if len(crossing):
+                pixels = np.arange(macroblockLevelSize)
+                insidePixels = (pixels < (height - rows[crossing])[:, np.newaxis])[:, :, np.newaxis] & \
+                               (pixels < (width - cols[crossing])[:, np.newaxis])[:, np.newaxis, :]
+                newSAD_values[crossing] = (absoluteDifferences[crossing].reshape(insidePixels.shape) *
+                                           insidePixels).sum(axis=(1, 2))
+            flatSAD_values[newCandidates] = newSAD_values
+            searchStatistics['SADEvaluations'] += len(newCandidates)
+        return motionVectors[np.arange(len(motionVectors)), np.argmin(flatSAD_values[candidates], axis=1)]
+
+    def finishMotionVectors(searchedMacroblocks, motionVectors):
+        """
+            Replace the poor predicted matches (temporal prediction) by the full search of the radius, in the scan
+            order of the full search.
+        """
+        if temporalPredictions is None:
+            return motionVectors
+        poorMatches = SAD_values[searchedMacroblocks, motionVectors[:, 0] + gridRadius,
+                                 motionVectors[:, 1] + gridRadius] > \
+            temporalFallbackSAD * macroblockLevelSize * macroblockLevelSize
+        if poorMatches.any():
+            motionVectors[poorMatches] = evaluateCandidates(searchedMacroblocks[poorMatches], np.broadcast_to(
+                searchWindow((0, 0), k), (np.count_nonzero(poorMatches), searchSize * searchSize, 2)))
+            searchStatistics['temporalFallbacks'] += int(np.count_nonzero(poorMatches))
+        return motionVectors
+
+    startingMotionVectors = np.zeros((len(macroblocks), 1, 2), dtype=np.int64)  # The zero motion vector
+    if temporalPredictions is not None:
+        startingMotionVectors = np.concatenate(
+            (startingMotionVectors, temporalPredictions[0][macroblocks, np.newaxis].astype(np.int64)), axis=1)
+    motionVectors = blockMatchingStrategy(evaluateCandidates, finishMotionVectors, k, macroblocks,
+                                          startingMotionVectors, (noOfRows, noOfCols))
+
+    # The static macroblocks keep the zero motion vector with a SAD value of 0
+    allMotionVectors = np.zeros((noOfRows * noOfCols, 2), dtype=np.int64)
+    allMotionVectors[macroblocks] = motionVectors
+    allSAD_values = np.zeros(noOfRows * noOfCols, dtype=np.int64)
+    allSAD_values[macroblocks] = SAD_values[macroblocks, motionVectors[:, 0] + gridRadius,
+                                            motionVectors[:, 1] + gridRadius]
+    return allMotionVectors.reshape(noOfRows, noOfCols, 2), allSAD_values.reshape(noOfRows, noOfCols)
+
+
+def searchWindow(center, searchRadius):
+    """
+        The candidate motion vectors inside the search radius around the center, in row-major (scan) order.
+        Return form: (candidates, 2) array
+    """
+    displacements = np.arange(-searchRadius, searchRadius + 1)
+    return np.stack(np.meshgrid(displacements, displacements, indexing='ij'), axis=-1).reshape(-1, 2) + center
+
+
+def threeStepSearch(evaluateCandidates, finishMotionVectors, k, macroblocks, startingMotionVectors, gridShape):
+    """
+        Three-step search: compare the center with its 8 neighbours at the current step size, move to the best one and
+        halve the step size, until the step size is 1.
+    """
+    center = evaluateCandidates(macroblocks, startingMotionVectors)
+    step = max(1, (k + 1) // 2)
+    while step >= 1:
+        center = evaluateCandidates(macroblocks, center[:, np.newaxis] + np.array(neighbourOffsets) * step)
+        step //= 2
+    return finishMotionVectors(macroblocks, center)
+
+
+def diamondSearch(evaluateCandidates, finishMotionVectors, k, macroblocks, startingMotionVectors, gridShape):
+    """
+        Diamond search: move the large diamond pattern until its center is the best candidate, then finish with the
+        small diamond pattern.
+    """
+    center = evaluateCandidates(macroblocks, startingMotionVectors)
+    return finishMotionVectors(macroblocks, smallDiamondSearch(evaluateCandidates, macroblocks,
+                                                               largeDiamondSearch(evaluateCandidates, macroblocks,
+                                                                                  center)))
+
+
+def predictiveZonalSearch(evaluateCandidates, finishMotionVectors, k, macroblocks, startingMotionVectors, gridShape):
+    """
+        Predictive zonal search: start from the best of the zero motion vector, the predicted one and the motion vectors
+        of the left, top and top-right macroblocks, then refine it with the small diamond pattern.
+        A macroblock waits for its neighbours (finished, see executeBlockMatchingSearch): the macroblocks are searched
+        in wavefronts, (row, col) in the wavefront col + 2 * row. A missing (or static) neighbour gives the zero motion
+        vector, which is already a candidate.
+    """
+    noOfRows, noOfCols = gridShape
+    # The motion vectors found, with a row on top and a column on each side of zero motion vectors
+    motionVectorGrid = np.zeros((noOfRows + 1, noOfCols + 2, 2), dtype=np.int64)
+    rows, cols = np.divmod(macroblocks, noOfCols)
+    wavefronts = cols + 2 * rows
+    motionVectors = np.empty((len(macroblocks), 2), dtype=np.int64)
+    for wavefront in np.unique(wavefronts):
+        batch = np.flatnonzero(wavefronts == wavefront)
+        batchRows, batchCols = rows[batch] + 1, cols[batch] + 1
+        neighbourMotionVectors = np.stack((motionVectorGrid[batchRows, batchCols - 1],
+                                           motionVectorGrid[batchRows - 1, batchCols],
+                                           motionVectorGrid[batchRows - 1, batchCols + 1]), axis=1)
+        center = evaluateCandidates(macroblocks[batch],
+                                    np.concatenate((startingMotionVectors[batch], neighbourMotionVectors), axis=1))
+        motionVectors[batch] = finishMotionVectors(macroblocks[batch],
+                                                   smallDiamondSearch(evaluateCandidates, macroblocks[batch], center))
+        motionVectorGrid[batchRows, batchCols] = motionVectors[batch]
+    return motionVectors
+
+
+def largeDiamondSearch(evaluateCandidates, macroblocks, center):
+    """
+        Move the large diamond search pattern until its center is the best candidate.
+    """
+    return moveSearchPattern(evaluateCandidates, macroblocks, center, largeDiamondPattern)
+
+
+def smallDiamondSearch(evaluateCandidates, macroblocks, center):
+    """
+        Move the small diamond search pattern until its center is the best candidate.
+    """
+    return moveSearchPattern(evaluateCandidates, macroblocks, center, smallDiamondPattern)
+
+
+def moveSearchPattern(evaluateCandidates, macroblocks, center, searchPattern):
+    """
+        Move the search pattern of each macroblock until its center is the best candidate, the macroblocks still
+        moving being evaluated together.
+    """
+    center = center.copy()
+    moving = np.arange(len(macroblocks))
+    while len(moving):
+        bestCandidates = evaluateCandidates(macroblocks[moving], center[moving, np.newaxis] + np.array(searchPattern))
+        moved = np.any(bestCandidates != center[moving], axis=1)
+        center[moving] = bestCandidates
+        moving = moving[moved]
+    return center
+
+
+# Block-matching strategies for the highest level,
+# form: {name: strategy(evaluateCandidates, finishMotionVectors, k, macroblocks, startingMotionVectors, gridShape)},
+# returning the finished motion vectors of the macroblocks, form: (macroblocks, 2)
+blockMatchingStrategies = {
+    'threeStep': threeStepSearch,
+    'diamond': diamondSearch,
+    'predictiveZonal': predictiveZonalSearch,
+}
 
 
 def findSearchArea(targetPixel, k, width, height):
@@ -137,158 +845,146 @@ def findSearchArea(targetPixel, k, width, height):
     return startingPixel, endingPixel
 
 
-def executeFullSearch(referenceFrame, targetMacroblock, targetPixel, macroblockLevelSize, startingPixel, endingPixel):
+def padReferenceFrame(referenceFrame, macroblockLevelSize):
     """
-        Execute full search algorithm for the target macroblock.
+        Pad the reference frame (bottom and right) with -1, so that every reference macroblock of the search area has
+        the full macroblock size. The padded pixels are ignored by the SAD calculation.
     """
-    SAD_values = []  # SAD_values list form: [SAD_value_i, SAD_value_i+1, ...]
-    pixels = []  # pixels list form: [(pixel_i_y, pixel_i_x), (pixel_i+1_y, pixel_i+1_x), ...]
+    height, width = referenceFrame.shape
+    paddedReferenceFrame = np.full((height + macroblockLevelSize, width + macroblockLevelSize), -1, dtype=np.int16)
+    paddedReferenceFrame[:height, :width] = referenceFrame
+    return paddedReferenceFrame
 
-    for row in range(startingPixel[0], endingPixel[0] + 1):
-        for col in range(startingPixel[1], endingPixel[1] + 1):
-            referenceMacroblock = constructReferenceMacroblock(referenceFrame, row, col, macroblockLevelSize)
-            SAD_values.append(calculateSADValue(referenceMacroblock, targetMacroblock))
-            pixels.append((row, col))
 
-    minSAD = min(SAD_values)  # Minimum SAD value
-    referencePixel = pixels[SAD_values.index(minSAD)]
+def executeFullSearch(paddedReferenceFrame, targetMacroblock, targetPixel, macroblockLevelSize, startingPixel,
+                      endingPixel, searchStatistics=None):
+    """
+        Execute full search algorithm for the target macroblock.
+    """
+    # All the reference macroblocks of the search area, form: (rows, cols, macroblockLevelSize, macroblockLevelSize)
+    referenceMacroblocks = sliding_window_view(paddedReferenceFrame, (macroblockLevelSize, macroblockLevelSize))[
+                           startingPixel[0]:endingPixel[0] + 1, startingPixel[1]:endingPixel[1] + 1]
+    SAD_values = calculateSADValues(referenceMacroblocks, targetMacroblock)
+
+    # The first minimum in row-major order, the same order the search area is scanned
+    row, col = np.unravel_index(np.argmin(SAD_values), SAD_values.shape)
+    minSAD = int(SAD_values[row, col])  # Minimum SAD value
+    referencePixel = (startingPixel[0] + int(row), startingPixel[1] + int(col))
 
     # Calculate motion vector, form: (dy, dx)
     motionVector = (referencePixel[0] - targetPixel[0], referencePixel[1] - targetPixel[1])
     return [motionVector, minSAD]
 
 
-def constructReferenceMacroblock(referenceFrame, row, col, macroblockLevelSize):
+def calculatePartialDistortionSADValues(referenceMacroblocks, targetMacroblocks, bounds, searchStatistics):
     """
-        Construct the reference macroblock from the reference frame.
+        Calculate the SAD values between the reference macroblocks and their target macroblocks (both of form:
+        (n, macroblockLevelSize, macroblockLevelSize)), adding partialDistortionRows rows at a time. A candidate is
+        dropped as soon as its partial SAD value reaches its bound, and its SAD value becomes np.iinfo(np.int64).max.
     """
-    return referenceFrame[row: row + macroblockLevelSize, col: col + macroblockLevelSize]
+    macroblockLevelSize = referenceMacroblocks.shape[1]
+    SAD_values = np.zeros(len(referenceMacroblocks), dtype=np.int64)
+    candidates = np.arange(len(referenceMacroblocks))  # The candidates that are not dropped yet
+
+    for row in range(0, macroblockLevelSize, partialDistortionRows):
+        rows = slice(row, row + partialDistortionRows)
+        SAD_values[candidates] += calculateSADValues(referenceMacroblocks[candidates, rows],
+                                                     targetMacroblocks[candidates, rows])
+        remainingRows = max(0, macroblockLevelSize - row - partialDistortionRows)
+        searchStatistics['pixelComparisons'] += \
+            len(candidates) * (macroblockLevelSize - row - remainingRows) * referenceMacroblocks.shape[2]
+
+        dropped = SAD_values[candidates] >= bounds[candidates]
+        SAD_values[candidates[dropped]] = np.iinfo(np.int64).max
+        searchStatistics['skippedPixelComparisons'] += \
+            int(np.count_nonzero(dropped)) * remainingRows * referenceMacroblocks.shape[2]
+        candidates = candidates[~dropped]
+        if len(candidates) == 0:
+            break
+    return SAD_values
 
 
 def calculateSADValue(referenceMacroblock, targetMacroblock):
     """
         Calculate the SAD value between the reference macroblock and the target macroblock.
     """
-    SAD = 0
-    for i in range(referenceMacroblock.shape[0]):
-        for j in range(referenceMacroblock.shape[1]):
-            SAD += abs(int(targetMacroblock[i, j]) - int(referenceMacroblock[i, j]))
-    return SAD
+    height, width = referenceMacroblock.shape
+    return int(calculateSADValues(referenceMacroblock, targetMacroblock[:height, :width]))
 
 
-def getSADErrorValues(targetFrameInMacroblocks, referenceFrameInMacroblocks, noOfRows, noOfCols):
+def calculateSADValues(referenceMacroblocks, targetMacroblock):
+    """
+        Calculate the SAD values between a batch of reference macroblocks and the target macroblock in one call.
+        The macroblocks are compared on their last two axes, the leading axes are broadcast against each other.
+        Reference pixels with a negative value (padding) do not count in the SAD value.
+    """
+    # Widen the pixels, so that neither the differences nor the sums can overflow
+    referenceMacroblocks = np.asarray(referenceMacroblocks, dtype=np.int16)
+    differences = np.abs(referenceMacroblocks - np.asarray(targetMacroblock, dtype=np.int16))
+    differences[np.broadcast_to(referenceMacroblocks < 0, differences.shape)] = 0
+    return differences.sum(axis=(-2, -1), dtype=np.int64)
+
+
+def getSADErrorValues(targetFrameInMacroblocks, referenceFrameInMacroblocks, noOfRows, noOfCols, searchStatistics,
+                      boundSAD_values=None, staticMacroblocks=None):
     """
         Sum of Absolute Differences (SAD) error function.
         Because k is always smaller than the macroblock size, the search window is always to the nearest neighbors of
         the current macroblock.
+        With boundSAD_values (early termination), the neighbours are dropped as soon as their partial SAD value reaches
+        the bound of their macroblock or the SAD value of the macroblock at the same position. A matched macroblock
+        whose SAD value is not below its bound may then be another one, but it is never selected by executeLevel.
+        The static macroblocks are not compared with any neighbour.
     """
-    # matchedMacroblocks list form: [(i, j), SAD_value] where (i, j) is the coordinate of the matched macroblock in
-    # the reference frame
-    matchedMacroblocks = []
-
-    for i in range(noOfRows):
-        for j in range(noOfCols):
-            # neighRefMacroblocksCoord contains the coordinates of the reference macroblocks that are neighbors of
-            # the target macroblock
-            neighRefMacroblocksCoord = [(i, j)]
-
-            # neighRefSAD_values contains the SAD values of the reference macroblocks that are neighbors of the
-            # target macroblock
-            neighRefSAD_values = \
-                [calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i][j])]
-
-            # left reference macroblock
-            if j > 0:
-                neighRefMacroblocksCoord.append((i, j - 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i][j - 1]))
-
-            # right reference macroblock
-            if j < noOfCols - 1:
-                neighRefMacroblocksCoord.append((i, j + 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i][j + 1]))
-
-            # top reference macroblock
-            if i > 0:
-                neighRefMacroblocksCoord.append((i - 1, j))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i - 1][j]))
-
-            # bottom reference macroblock
-            if i < noOfRows - 1:
-                neighRefMacroblocksCoord.append((i + 1, j))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i + 1][j]))
-
-            # top-left reference macroblock
-            if i > 0 and j > 0:
-                neighRefMacroblocksCoord.append((i - 1, j - 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i - 1][j - 1]))
-
-            # top-right reference macroblock
-            if i > 0 and j < noOfCols - 1:
-                neighRefMacroblocksCoord.append((i - 1, j + 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i - 1][j + 1]))
-
-            # bottom-left reference macroblock
-            if i < noOfRows - 1 and j > 0:
-                neighRefMacroblocksCoord.append((i + 1, j - 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i + 1][j - 1]))
-
-            # bottom-right reference macroblock
-            if i < noOfRows - 1 and j < noOfCols - 1:
-                neighRefMacroblocksCoord.append((i + 1, j + 1))
-                neighRefSAD_values.append(
-                    calculateSADValue(targetFrameInMacroblocks[i][j], referenceFrameInMacroblocks[i + 1][j + 1]))
-
-            minSAD = min(neighRefSAD_values)  # Minimum SAD value
-            refMacroblockCoord = neighRefMacroblocksCoord[neighRefSAD_values.index(minSAD)]  # Reference
-            # macroblock coordinates with the minimum SAD value
-            matchedMacroblocks.append([refMacroblockCoord, minSAD])  # Append the matched macroblock coordinates
-            # and the minimum SAD value to the list
-    return matchedMacroblocks
-
-
-def calculateMotionVectors(matchedMacroblocks, macroblockLevelSize, noOfCols):
-    """
-        Calculate the motion vectors for each matched macroblock.
-    """
-    # MVnSAD list form: [ [MV_for_i_matchedMacroblock, SAD_for_i_matchedMacroblock],
-    # [MV_for_i+1_matchedMacroblock, SAD_for_i+1_matchedMacroblock], ... ]
-    MVnSAD = []
-
-    for i in range(len(matchedMacroblocks)):
-        # Find the coordinates of the target macroblock in a frame (noOfCol x noOfRows)
-        targetMacroblockRow = i // noOfCols
-        targetMacroblockCol = i % noOfCols
-
-        # Find the coordinates of the pixel (top-left corner) on the target macroblock, which is equivalent of the pixel
-        # on reference frame. Pixel form: (y, x)
-        targetPixel = (targetMacroblockRow * macroblockLevelSize, targetMacroblockCol * macroblockLevelSize)
-
-        # Find the coordinates of the reference macroblock
-        refMacroblockRow, refMacroblockCol = matchedMacroblocks[i][0]
-
-        # Find the coordinates of the pixel (top-left corner) on the reference macroblock, which is equivalent of the
-        # pixel on reference frame. refPixel form: (y, x)
-        referencePixel = (refMacroblockRow * macroblockLevelSize, refMacroblockCol * macroblockLevelSize)
-
-        # Calculate the motion vector, motionVector form: (dy, dx)
-        motionVector = (referencePixel[0] - targetPixel[0], referencePixel[1] - targetPixel[1])
-        SAD_value = matchedMacroblocks[i][1]  # SAD value of the matched macroblocks
-        MVnSAD.append([motionVector, SAD_value])  # Append the motion vector and the SAD value in MVnSAD list
-    return MVnSAD
-
-
-def compareMVnSAD(MVnSAD, MVnSAD_new):
-    """
-        Compare and update the motion vectors and SAD values, if necessary.
-    """
-    for i in range(len(MVnSAD)):
-        if MVnSAD[i][1] > MVnSAD_new[i][1]:
-            MVnSAD[i] = MVnSAD_new[i]
-    return MVnSAD
+    # Surround the reference macroblocks with one padded macroblock on each side, so that every target macroblock
+    # has 9 neighbouring reference macroblocks
+    macroblockLevelSize = referenceFrameInMacroblocks.shape[2]
+    paddedReferenceFrameInMacroblocks = np.full(
+        (noOfRows + 2, noOfCols + 2, macroblockLevelSize, macroblockLevelSize), -1, dtype=np.int16)
+    paddedReferenceFrameInMacroblocks[1:-1, 1:-1] = referenceFrameInMacroblocks
+
+    # neighRefMacroblocks form: (9, noOfRows, noOfCols, macroblockLevelSize, macroblockLevelSize), one slice for each
+    # neighbour offset
+    neighRefMacroblocks = np.stack([
+        paddedReferenceFrameInMacroblocks[1 + di:1 + di + noOfRows, 1 + dj:1 + dj + noOfCols]
+        for di, dj in neighbourOffsets
+    ])
+
+    # The neighbours outside the frame are never selected
+    rows = np.arange(noOfRows)[:, np.newaxis]
+    cols = np.arange(noOfCols)[np.newaxis, :]
+    outside = np.stack([(rows + di < 0) | (rows + di >= noOfRows) | (cols + dj < 0) | (cols + dj >= noOfCols)
+                        for di, dj in neighbourOffsets])
+    if staticMacroblocks is not None:
+        outside |= staticMacroblocks
+    searchStatistics['SADEvaluations'] += int(outside.size - np.count_nonzero(outside))
+
+    if boundSAD_values is None:
+        neighRefSAD_values = calculateSADValues(neighRefMacroblocks, targetFrameInMacroblocks)
+    else:
+        # The macroblock at the same position (the first neighbour) is calculated first and tightens the bounds
+        neighRefSAD_values = np.full(outside.shape, np.iinfo(np.int64).max, dtype=np.int64)
+        neighRefSAD_values[0] = calculateSADValues(neighRefMacroblocks[0], targetFrameInMacroblocks)
+        searchStatistics['pixelComparisons'] += targetFrameInMacroblocks.size
+        bounds = np.minimum(np.reshape(boundSAD_values, (noOfRows, noOfCols)), neighRefSAD_values[0])
+        candidates = np.nonzero(~outside[1:])  # form: (n - 1, i, j) of the other neighbours inside the frame
+        neighRefSAD_values[1:][candidates] = calculatePartialDistortionSADValues(
+            neighRefMacroblocks[1:][candidates], targetFrameInMacroblocks[candidates[1:]],
+            bounds[candidates[1:]], searchStatistics)
+    neighRefSAD_values[outside] = np.iinfo(np.int64).max
+
+    # matchedMacroblocks form: (offsets, SAD_values), (noOfRows, noOfCols, 2) and (noOfRows, noOfCols) arrays, the
+    # offset (di, dj) of the matched macroblock in the reference frame from the target macroblock
+    bestNeighbours = np.argmin(neighRefSAD_values, axis=0)  # The first minimum in the order of neighbourOffsets
+    return np.array(neighbourOffsets)[bestNeighbours], \
+        np.take_along_axis(neighRefSAD_values, bestNeighbours[np.newaxis], axis=0)[0]
+
+
+def calculateMotionVectors(matchedMacroblocks, macroblockLevelSize):
+    """
+        Calculate the motion vectors of the matched macroblocks (see getSADErrorValues): the pixel (top-left corner)
+        of the reference macroblock minus the one of the target macroblock, form: (dy, dx).
+        Return form: (motionVectors, SAD_values)
+    """
+    offsets, SAD_values = matchedMacroblocks
+    return offsets * macroblockLevelSize, SAD_values
@@ -1,36 +1,17 @@
-from collections import Counter
 from heapq import *
 
 import numpy as np
 
-from progressBar import progressBar
+maxCodeLength = 57  # Longest Huffman code supported (the decoder peeks at the 57 bits always held by 8 bytes)
+peekBits = 12  # Bits peeked by the first level table of the Huffman decoder
 
 
-def createHuffmanTree(seqErrorImages):
+def createHuffmanTreeFromHistogram(histogram):
     """
-        Create the Huffman tree
+        Create the Huffman tree from the histogram of the pixel values (see videoFunction.updateHistogram)
     """
-    # Create a leaf node for each unique character and build a min heap of all leaf nodes
-    heap = [[wt, [sym, ""]] for sym, wt in Counter(seqErrorImages.flatten()).items()]
-    heapify(heap)  # Transform list x into a heap, in-place, in linear time.
-
-    while len(heap) > 1:
-        # Extract two nodes with the minimum frequency from the min heap
-        left = heappop(heap)
-        right = heappop(heap)
-
-        # For each extracted node, assign a bit 0 for left and 1 for the right
-        for pair in left[1:]:
-            pair[1] = '0' + pair[1]
-        for pair in right[1:]:
-            pair[1] = '1' + pair[1]
-
-        # Create a new internal node with a frequency equal to the sum of the two nodes frequencies
-        # Assign the left and right nodes as children of this new node
-        heappush(heap, [left[0] + right[0]] + left[1:] + right[1:])
-
-        # Return the root node
-    return sorted(heappop(heap)[1:], key=lambda p: (len(p[-1]), p))  # Return the root node
+    codeLengths = createHuffmanCodeLengths(histogram)
+    return [[symbol, code] for symbol, code in createCanonicalHuffmanTable(codeLengths).items()]
 
 
 def createHuffmanTable(huffmanTree):
@@ -44,40 +25,210 @@ def createHuffmanTable(huffmanTree):
     return huffmanTable
 
 
-def encodeHuffman(seqErrorImages, huffmanTable):
-    """
-        Encode the error frames sequence
-    """
-    encodedSeqErrorImages = []
-    progressBar(0, len(seqErrorImages), 'Encoding the error frames sequence:', 'Encoded the error frames sequence!')
-    for i, errorImage in enumerate(seqErrorImages):
-        encodedSeqErrorImage = ''
-        for pixel in errorImage.flatten():
-            encodedSeqErrorImage += huffmanTable[pixel]
-        encodedSeqErrorImages.append(encodedSeqErrorImage)
-        progressBar(i + 1, len(seqErrorImages), 'Encoding the error frames sequence:',
-                    'Encoded the error frames sequence!')
-    return encodedSeqErrorImages
-
-
-def decodeHuffman(encodedSeqErrorImages, huffmanTable, width, height):
-    """
-        Decode the error frames sequence with the Huffman table
-    """
-    reverseTable = {code: symbol for symbol, code in huffmanTable.items()}
-    decodedSeqErrorImages = []
-    progressBar(0, len(encodedSeqErrorImages), 'Decoding the error frames sequence:',
-                'Decoded the error frames sequence!')
-    for i, encodedErrorImage in enumerate(encodedSeqErrorImages):
-        decodedErrorImage = []
-        currentCode = ""
-        for bit in encodedErrorImage:
-            currentCode += bit
-            if currentCode in reverseTable:
-                decodedErrorImage.append(reverseTable[currentCode])
-                currentCode = ""
-        decodedErrorImage = np.array(decodedErrorImage, dtype='uint8').reshape((height, width))
-        decodedSeqErrorImages.append(np.array(decodedErrorImage))
-        progressBar(i + 1, len(encodedSeqErrorImages), 'Decoding the error frames sequence:',
-                    'Decoded the error frames sequence!')
-    return decodedSeqErrorImages
+def createHuffmanCodeLengths(histogram):
+    """
+        Create the Huffman code lengths of the symbols from their histogram (0 for the absent symbols).
+        The merges of the min heap only record the parent of each node, the code lengths are the depths of the leaves.
+        A single symbol gets a 1 bit code.
+    """
+    symbols = np.flatnonzero(histogram)
+    heap = [(int(histogram[symbol]), node) for node, symbol in enumerate(symbols)]
+    heapify(heap)
+    parents = [0] * max(2 * len(symbols) - 1, 0)
+    nextNode = len(symbols)
+    while len(heap) > 1:
+        # Merge the two nodes with the minimum frequency into a new internal node
+        leftWeight, left = heappop(heap)
+        rightWeight, right = heappop(heap)
+        parents[left] = parents[right] = nextNode
+        heappush(heap, (leftWeight + rightWeight, nextNode))
+        nextNode += 1
+
+    # The parents are created after their children, the root is the last node
+    depths = [0] * len(parents)
+    for node in range(len(parents) - 2, -1, -1):
+        depths[node] = depths[parents[node]] + 1
+    codeLengths = np.zeros(len(histogram), dtype=np.uint8)
+    codeLengths[symbols] = np.maximum(depths[:len(symbols)], 1)
+    return codeLengths
+
+
+def createCanonicalHuffmanTable(codeLengths, symbols=None):
+    """
+        Create the canonical Huffman table from the code lengths: the symbols sorted by code length, then by symbol,
+        take consecutive codes (a longer code continues from the previous one shifted to its length).
+        symbols: the symbol of each code length, the index of the code length if not given (pixel values)
+    """
+    if symbols is None:
+        symbols = range(len(codeLengths))
+    huffmanTable = {}
+    code, previousLength = 0, 0
+    for length, symbol in sorted((int(length), symbol) for symbol, length in zip(symbols, codeLengths) if length):
+        code <<= length - previousLength
+        huffmanTable[symbol] = format(code, f'0{length}b')
+        code, previousLength = code + 1, length
+    return huffmanTable
+
+
+def createCodeLengthsHeader(huffmanTable):
+    """
+        Create the header of the canonical Huffman table: the code length of each pixel value (0 if absent), 256 bytes
+    """
+    codeLengths = np.zeros(256, dtype=np.uint8)
+    for symbol, code in huffmanTable.items():
+        codeLengths[symbol] = len(code)
+    return codeLengths.tobytes()
+
+
+def readCodeLengthsHeader(header):
+    """
+        Read the canonical Huffman table from its header (code lengths)
+    """
+    return createCanonicalHuffmanTable(np.frombuffer(header, dtype=np.uint8))
+
+
+def createHuffmanCodeArrays(huffmanTable, noOfSymbols=256):
+    """
+        Create the lookup arrays of the Huffman table, indexed by the symbol (pixel value, or symbol index): the code
+        words (as integers) and their lengths in bits
+    """
+    codeWords = np.zeros(noOfSymbols, dtype=np.uint64)
+    codeLengths = np.zeros(noOfSymbols, dtype=np.uint64)
+    for symbol, code in huffmanTable.items():
+        if len(code) > maxCodeLength:
+            raise ValueError(f'Huffman code of {len(code)} bits, longer than the {maxCodeLength} bits supported')
+        codeWords[symbol] = int(code, 2) if code else 0
+        codeLengths[symbol] = len(code)
+    return codeWords, codeLengths
+
+
+def packHuffmanCodes(symbols, codeWords, codeLengths):
+    """
+        Pack the Huffman codes of the symbols (one row per decoding lane) into bytes, most significant bit first and
+        the last byte zero padded.
+        The codes are summed into 64 bit words (they never overlap, so the sum is their concatenation): each code is
+        shifted to its end in the word where it ends, and the head of a code that starts in the previous word is
+        added there. Pairs of symbols are coded with one lookup when their codes fit in 64 bits together.
+        Return form: (packedBytes, bitLength, rowOffsets), rowOffsets being the bit offset of each row of symbols
+    """
+    noOfRows = len(symbols)
+    symbols = np.ascontiguousarray(symbols).reshape(-1)
+    if symbols.dtype == np.uint8 and len(codeWords) == 256 and 2 * int(codeLengths.max()) <= 64:
+        # Pair table indexed [second, first], as the little endian uint16 view of a symbol pair
+        pairCodeWords = ((codeWords[None, :] << codeLengths[:, None]) | codeWords[:, None]).ravel()
+        pairCodeLengths = (codeLengths[None, :] + codeLengths[:, None]).ravel()
+        pairs = symbols[:len(symbols) // 2 * 2].view('<u2')
+        codes, lengths = pairCodeWords[pairs], pairCodeLengths[pairs]
+        if len(symbols) % 2:
+            codes = np.append(codes, codeWords[symbols[-1]])
+            lengths = np.append(lengths, codeLengths[symbols[-1]])
+    else:
+        codes, lengths = codeWords[symbols], codeLengths[symbols]
+
+    if len(lengths) % noOfRows == 0:  # Every row is made of whole pairs
+        rowBitLengths = lengths.reshape(noOfRows, -1).sum(axis=1)
+    else:
+        rowBitLengths = codeLengths[symbols].reshape(noOfRows, -1).sum(axis=1)
+    rowOffsets = (np.cumsum(rowBitLengths) - rowBitLengths).astype(np.uint32)
+
+    ends = np.cumsum(lengths)
+    bitLength = int(ends[-1]) if len(ends) else 0
+    if bitLength == 0:  # No symbols, or a single symbol with an empty code
+        return b'', 0, rowOffsets
+    lastWords = (ends - np.uint64(1)) >> np.uint64(6)
+    endsInWord = ends - (lastWords << np.uint64(6))  # 1 to 64
+
+    # The codes are sorted by word, so each word sums a contiguous range of them
+    noOfWords = (bitLength + 63) // 64
+    wordStarts = np.searchsorted(lastWords, np.arange(noOfWords + 1, dtype=np.uint64))
+    nonEmptyWords = wordStarts[:-1] < wordStarts[1:]
+    words = np.zeros(noOfWords, dtype=np.uint64)
+    words[nonEmptyWords] = np.add.reduceat(codes << (np.uint64(64) - endsInWord), wordStarts[:-1][nonEmptyWords])
+    split = endsInWord < lengths
+    words[lastWords[split].astype(np.int64) - 1] |= codes[split] >> endsInWord[split]
+    return words.astype('>u8').tobytes()[:(bitLength + 7) // 8], bitLength, rowOffsets
+
+
+def createHuffmanDecodingTables(huffmanTable, symbolValues):
+    """
+        Create the lookup tables of the Huffman decoder, for the symbols in the order of the Huffman table.
+        The first level table is indexed by the next peekBits bits and resolves the codes up to peekBits bits. The
+        longer codes share a second level table per first level entry (their first peekBits bits), indexed by the bits
+        that follow.
+        symbolValues: the decoded value of each symbol (pixel values, or symbol indices)
+        Return form: {'symbols': ..., 'lengths': ..., 'subtables': ..., 'subtableBits': ..., 'peekBits': ...}, the
+        first level entries followed by the second level ones; subtables holds the second level table offset of each
+        first level entry (-1 when the entry is resolved)
+    """
+    codes = list(huffmanTable.values())
+    tableBits = min(peekBits, max(len(code) for code in codes))
+    subtableBits = np.zeros(1 << tableBits, dtype=np.int64)
+    for code in codes:
+        if len(code) > tableBits:
+            prefix = int(code[:tableBits], 2)
+            subtableBits[prefix] = max(subtableBits[prefix], len(code) - tableBits)
+    subtables = np.full(1 << tableBits, -1, dtype=np.int64)
+    hasSubtable = subtableBits > 0
+    subtables[hasSubtable] = (1 << tableBits) + np.cumsum(1 << subtableBits[hasSubtable]) - \
+                             (1 << subtableBits[hasSubtable])
+
+    noOfEntries = (1 << tableBits) + int((1 << subtableBits[hasSubtable]).sum())
+    symbols = np.zeros(noOfEntries, dtype=symbolValues.dtype)
+    lengths = np.ones(noOfEntries, dtype=np.int32)
+    for symbolValue, code in zip(symbolValues, codes):
+        if len(code) <= tableBits:  # Every entry starting with the code
+            first = int(code, 2) << (tableBits - len(code)) if code else 0
+            entries = slice(first, first + (1 << (tableBits - len(code))))
+        else:
+            prefix = int(code[:tableBits], 2)
+            freeBits = subtableBits[prefix] - (len(code) - tableBits)
+            first = subtables[prefix] + (int(code[tableBits:], 2) << freeBits)
+            entries = slice(first, first + (1 << freeBits))
+        symbols[entries] = symbolValue
+        lengths[entries] = len(code)
+    return {'symbols': symbols, 'lengths': lengths, 'subtables': subtables, 'subtableBits': subtableBits,
+            'peekBits': tableBits}
+
+
+def decodeHuffmanCodes(packedBytes, laneOffsets, decodingTables, out):
+    """
+        Decode packed Huffman codes with the lookup tables into the output array, one row of symbols per decoding lane
+        starting at its bit offset.
+        The lanes decode one symbol each per step: peek the next bits at the lane position, look the code up in the
+        first level table (and in the second level table for a long code), write the symbol and move past the code.
+    """
+    tableBits = decodingTables['peekBits']
+    if tableBits == 0:  # A single symbol with an empty code
+        out[...] = decodingTables['symbols'][0]
+        return out
+
+    # The 64 bits from each byte, as an overlapping view of the bytes (at least 57 of them follow each bit position)
+    paddedBytes = packedBytes + bytes(8)
+    byteWords = np.ndarray((len(paddedBytes) - 7,), dtype='>u8', buffer=paddedBytes, strides=(1,))
+    subtables, lengths, symbols = decodingTables['subtables'], decodingTables['lengths'], decodingTables['symbols']
+    hasLongCodes = (subtables >= 0).any()
+
+    positions = np.asarray(laneOffsets, dtype=np.int64)
+    for column in range(out.shape[1]):
+        windows = byteWords[positions >> 3].astype(np.uint64) << (positions & 7).astype(np.uint64)
+        entries = (windows >> np.uint64(64 - tableBits)).astype(np.intp)
+        if hasLongCodes:
+            laneSubtables = subtables[entries]
+            isLong = laneSubtables >= 0
+            if isLong.any():
+                longBits = decodingTables['subtableBits'][entries[isLong]].astype(np.uint64)
+                entries[isLong] = laneSubtables[isLong] + \
+                                  ((windows[isLong] << np.uint64(tableBits)) >> (np.uint64(64) - longBits))
+        out[:, column] = symbols[entries]
+        positions += lengths[entries]
+    return out
+
+
+def encodeHuffmanFrames(seqErrorImages, frameTypes, codeTable):
+    """
+        Encode consecutive error frames with the code arrays of the Huffman table (codeTable: (codeWords, codeLengths),
+        see createHuffmanCodeArrays), each frame as packed bits, form: (packedBytes, bitLength, rowOffsets), the rows
+        being decoded side by side. The skip frames ('S') become None. See entropyCoding.encodeFrames
+    """
+    return [None if frameType == 'S' else packHuffmanCodes(errorImage, *codeTable)
+            for errorImage, frameType in zip(seqErrorImages, frameTypes)]
@@ -1,39 +1,23 @@
-from collections import Counter
-from heapq import *
-
 import numpy as np
 
+from huffman import createCanonicalHuffmanTable, createHuffmanCodeArrays, createHuffmanCodeLengths, \
+    createHuffmanDecodingTables, decodeHuffmanCodes, packHuffmanCodes
+from motionVectorField import createMotionVectorField, getPredictedFrames
+
 
-def createHuffmanTreeVector(motionVectors):
+def createHuffmanTreeVector(motionVectorField):
     """
-        Create the Huffman tree for the motion vectors
+        Create the Huffman tree for the motion vectors (or their residuals) of a motion vector field, as the canonical
+        codes of the vectors sorted by code length
     """
-    # Flatten the motion vectors
-    motionVectorsFlat = [value for mv in motionVectors for value in mv]
-
-    # Convert the flattened motion vectors to tuples
-    motionVectorsTuples = [tuple(mv) for mv in motionVectorsFlat]
-
-    # Create a leaf node for each unique character and build a min heap of all leaf nodes
-    heap = [[wt, [sym, ""]] for sym, wt in Counter(motionVectorsTuples).items()]
-    heapify(heap)
-
-    while len(heap) > 1:
-        # Extract two nodes with the minimum frequency from the min heap
-        left = heappop(heap)
-        right = heappop(heap)
-
-        # For each extracted node, assign a bit 0 for left and 1 for the right
-        for pair in left[1:]:
-            pair[1] = '0' + pair[1]
-        for pair in right[1:]:
-            pair[1] = '1' + pair[1]
-
-        # Create a new internal node with a frequency equal to the sum of the two nodes frequencies
-        # Assign the left and right nodes as children of this new node
-        heappush(heap, [left[0] + right[0]] + left[1:] + right[1:])
-
-    return sorted(heappop(heap)[1:], key=lambda p: (len(p[-1]), p))
+    # Count the motion vectors of the P frames (skip frames and intra frames have none)
+    codedVectors = motionVectorField['motionVectors'][getPredictedFrames(motionVectorField)].reshape(-1, 2)
+    if not len(codedVectors):
+        return []  # No P frames (a single frame, or only skip and intra frames): an empty tree
+    symbols, counts = np.unique(codedVectors.astype(np.int64), axis=0, return_counts=True)
+    codeLengths = createHuffmanCodeLengths(counts)
+    return [[symbol, code] for symbol, code in
+            createCanonicalHuffmanTable(codeLengths, list(map(tuple, symbols.tolist()))).items()]
 
 
 def createHuffmanTableVector(huffmanTree):
@@ -47,33 +31,71 @@ def createHuffmanTableVector(huffmanTree):
     return huffmanTable
 
 
-def encodeHuffmanVector(motionVectors, huffmanTable):
+def createCodeLengthsHeaderVector(huffmanTable):
+    """
+        Create the header of the canonical Huffman table of the motion vectors: (dy, dx, code length) of each vector,
+        as int16 values
+    """
+    return np.array([symbol + (len(code),) for symbol, code in huffmanTable.items()], dtype='<i2').tobytes()
+
+
+def readCodeLengthsHeaderVector(header):
+    """
+        Read the canonical Huffman table of the motion vectors from its header
+    """
+    entries = np.frombuffer(header, dtype='<i2').reshape(-1, 3).tolist()
+    return createCanonicalHuffmanTable([entry[2] for entry in entries], [tuple(entry[:2]) for entry in entries])
+
+
+def getVectorKeys(vectors):
+    """
+        Get an integer key of each (dy, dx) vector, in the same order as the vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.int64).reshape(-1, 2)
+    return (vectors[:, 0] << 32) + vectors[:, 1]
+
+
+def encodeHuffmanVector(motionVectorField, huffmanTable):
     """
-        Encode the motion vectors
+        Encode the motion vectors (or their residuals) of a motion vector field, each frame as packed bits (form:
+        (packedBytes, bitLength, rowOffsets), a single row), skip frames and intra frames become None
+        The vectors of all the P frames are looked up in the table at once, by their keys (see getVectorKeys).
     """
-    encodedMotionVectors = []
-    for motionVector in motionVectors:
-        encodedMotionVector = ''
-        for value in motionVector:
-            encodedMotionVector += huffmanTable[tuple(value)]
-        encodedMotionVectors.append(encodedMotionVector)
+    predictedFrames = getPredictedFrames(motionVectorField)
+    encodedMotionVectors = [None] * len(motionVectorField['motionVectors'])
+    if not len(predictedFrames):
+        return encodedMotionVectors  # Nothing to code, the table is empty
+    symbolKeys = getVectorKeys(list(huffmanTable))
+    keyOrder = np.argsort(symbolKeys)
+    codeWords, codeLengths = createHuffmanCodeArrays(dict(enumerate(huffmanTable.values())), len(huffmanTable))
+    codedVectors = motionVectorField['motionVectors'][predictedFrames].reshape(len(predictedFrames), -1, 2)
+    symbols = keyOrder[np.searchsorted(symbolKeys[keyOrder], getVectorKeys(codedVectors))].reshape(
+        len(predictedFrames), -1)
+
+    for i, frameSymbols in zip(predictedFrames, symbols):
+        encodedMotionVectors[i] = packHuffmanCodes(frameSymbols[None, :], codeWords, codeLengths)
     return encodedMotionVectors
 
 
-def decodeHuffmanVector(encodedMotionVectors, huffmanTable, width, height):
+def decodeHuffmanVector(encodedMotionVectors, huffmanTable, frameTypes, noOfRows, noOfCols):
     """
-        Decode the motion vectors with the Huffman table
+        Decode the motion vectors with the Huffman table, into a motion vector field of the frame types (see
+        motionVectorField.createMotionVectorField), the None frames (skip frames and intra frames) keep zero motion
+        vectors.
+        The frames are decoded at once, each frame being a decoding lane.
     """
-    reverseTable = {code: symbol for symbol, code in huffmanTable.items()}
-    decodedMotionVectors = []
-    for encodedMotionVector in encodedMotionVectors:
-        decodedMotionVector = []
-        currentCode = ""
-        for bit in encodedMotionVector:
-            currentCode += bit
-            if currentCode in reverseTable:
-                decodedMotionVector.append(reverseTable[currentCode])
-                currentCode = ""
-        decodedMotionVector = np.array(decodedMotionVector, dtype='int').reshape((height, width))
-        decodedMotionVectors.append(decodedMotionVector)
-    return decodedMotionVectors
+    motionVectorField = createMotionVectorField(len(encodedMotionVectors), noOfRows, noOfCols)
+    motionVectorField['frameTypes'] = frameTypes
+    codedFrames = [i for i, encodedMotionVector in enumerate(encodedMotionVectors) if encodedMotionVector is not None]
+    if not codedFrames:
+        return motionVectorField
+    decodingTables = createHuffmanDecodingTables(huffmanTable, np.arange(len(huffmanTable)))
+    packedBytes = [encodedMotionVectors[i][0] for i in codedFrames]
+    byteLengths = np.array([len(frameBytes) for frameBytes in packedBytes], dtype=np.int64)
+    laneOffsets = 8 * (np.cumsum(byteLengths) - byteLengths)
+    symbolIndices = decodeHuffmanCodes(b''.join(packedBytes), laneOffsets, decodingTables,
+                                       np.empty((len(codedFrames), noOfRows * noOfCols), dtype=np.int64))
+
+    symbols = np.array(list(huffmanTable), dtype=np.int64).reshape(-1, 2)
+    motionVectorField['motionVectors'][codedFrames] = symbols[symbolIndices].reshape(-1, noOfRows, noOfCols, 2)
+    return motionVectorField
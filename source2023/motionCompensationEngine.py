@@ -0,0 +1,48 @@
+import numpy as np
+
+macroblockSize = 64
+
+
+def getCompensationRectangles(frameMotionVectors, width, height, sameLocationInterior=False):
+    """
+        Get the rectangles copied by the motion compensation of a frame, for all its macroblocks at once.
+        Each moved macroblock (non zero motion vector) of the reference frame is copied to its position moved by its
+        motion vector, clipped to the frame: the part that falls out of the frame is dropped.
+        sameLocationInterior: the macroblocks that stay fully inside the frame are copied from their moved position in
+        the reference frame instead of their own position (background fill of thema 2).
+        Return an array of rectangles in raster order, form: [[targetY0, targetY1, targetX0, targetX1, sourceY0,
+        sourceX0], ...]
+    """
+    motionVectors = np.asarray(frameMotionVectors, dtype=np.int64).reshape(-1, 2)
+    macroblockIndices = np.arange(len(motionVectors))
+    refY = macroblockIndices // (width // macroblockSize) * macroblockSize
+    refX = macroblockIndices % (width // macroblockSize) * macroblockSize
+    targetY, targetX = refY + motionVectors[:, 0], refX + motionVectors[:, 1]
+
+    # Clip the moved macroblocks to the frame, the source rectangles move along
+    targetY0, targetY1 = np.clip(targetY, 0, height), np.clip(targetY + macroblockSize, 0, height)
+    targetX0, targetX1 = np.clip(targetX, 0, width), np.clip(targetX + macroblockSize, 0, width)
+    sourceY0, sourceX0 = refY + targetY0 - targetY, refX + targetX0 - targetX
+    if sameLocationInterior:
+        interior = (targetY >= 0) & (targetX >= 0) & (targetY + macroblockSize <= height) & \
+                   (targetX + macroblockSize <= width)
+        sourceY0, sourceX0 = np.where(interior, targetY, sourceY0), np.where(interior, targetX, sourceX0)
+
+    moved = motionVectors.any(axis=1) & (targetY1 > targetY0) & (targetX1 > targetX0)
+    return np.stack([targetY0, targetY1, targetX0, targetX1, sourceY0, sourceX0], axis=1)[moved]
+
+
+def compensateFrame(referenceFrame, frameMotionVectors, out, sameLocationInterior=False):
+    """
+        Motion compensate a frame into the output buffer (caller-supplied, same shape as the reference frame).
+        The moved macroblocks are copied in raster order, so a later macroblock overwrites an earlier one where they
+        overlap. The output buffer is not cleared: where no macroblock is copied (zero motion vectors) it keeps its
+        content.
+        frameMotionVectors: the (dy, dx) motion vectors of the macroblocks in row-major order (list or array)
+    """
+    height, width = out.shape[:2]
+    rectangles = getCompensationRectangles(frameMotionVectors, width, height, sameLocationInterior)
+    for targetY0, targetY1, targetX0, targetX1, sourceY0, sourceX0 in rectangles.tolist():
+        out[targetY0:targetY1, targetX0:targetX1] = referenceFrame[sourceY0:sourceY0 + targetY1 - targetY0,
+                                                                   sourceX0:sourceX0 + targetX1 - targetX0]
+    return out
@@ -1,406 +1,62 @@
 import numpy as np
 
+from motionCompensationEngine import compensateFrame
+from motionVectorField import getFrameMotionVectors
 from progressBar import *
 
-macroblockSize = 64
 
-
-def motionCompensationForEncoding(frames, motionVectors, width, height):
+def motionCompensationForEncoding(frames, motionVectorField, width, height, out=None):
     """
-        Motion compensation for encoding.
+        Motion compensation for encoding, with the motion vector field of the frames (see
+        motionVectorField.createMotionVectorField).
+        A skip frame ('S') is predicted by its reference frame, and an intra frame ('I') by a zero frame, so its error
+        frame is the frame itself.
+        The compensated frames are written in one preallocated sequence, the moved macroblocks of a frame are copied
+        by the motion compensation engine (the rest of the frame stays zero).
+        out: the zero frame sequence the compensated frames are written in (see videoFunction.createFrameSequence), if
+        given
     """
-    noOfCols = width // macroblockSize
-    motionCompensatedFrames = [frames[0]]  # I frame
-    noOfMacroblocks = len(motionVectors[0])
+    motionCompensatedFrames = np.zeros((len(frames), height, width), dtype=np.uint8) if out is None else out
+    motionCompensatedFrames[0] = frames[0]  # I frame
 
     progressBar(0, len(frames), 'Creating Motion Compensation Frames: ', 'Motion Compensation Frames Created!')
     for i in range(1, len(frames)):
-        # Get the reference (previous) and target (current) frame
+        # Get the reference (previous) frame and the type of the current frame
         referenceFrame = frames[i - 1]
-        targetFrame = np.zeros_like(referenceFrame)
-        idxOfVectorsForCurrFrame = i - 1
-
-        for j in range(noOfMacroblocks):
-            # Get the motion vector of the current macroblock
-            motionVector = motionVectors[idxOfVectorsForCurrFrame][j]
-
-            # Get the starting pixel of the current macroblock
-            macroblockIdx = (j // noOfCols, j % noOfCols)  # (y, x)
-            startingRefPixel = (macroblockIdx[0] * macroblockSize, macroblockIdx[1] * macroblockSize)  # (y, x)
-            targetFrame = motionCompensationForEncodingOnSpecificFrame(motionVector, targetFrame, referenceFrame,
-                                                                       startingRefPixel, width, height)
-        motionCompensatedFrames.append(targetFrame)
+        frameType = motionVectorField['frameTypes'][i]
+        if frameType == 'S':  # Skip frame
+            motionCompensatedFrames[i] = referenceFrame
+        elif frameType == 'P':  # The intra frames stay zero
+            compensateFrame(referenceFrame, getFrameMotionVectors(motionVectorField, i - 1), motionCompensatedFrames[i])
         progressBar(i + 1, len(frames), 'Creating Motion Compensation Frames: ', 'Motion Compensation Frames Created!')
     return motionCompensatedFrames
 
 
-def motionCompensationForEncodingOnSpecificFrame(motionVector, targetFrame, referenceFrame, startingRefPixel, width,
-                                                 height):
-    """
-        Motion compensation on a specific frame for encoding.
-    """
-    if motionVector[0] == 0 and motionVector[1] == 0:
-        # No movement
-        return targetFrame
-    return performMotionCompensationForEncoding(startingRefPixel, motionVector, referenceFrame, targetFrame, width,
-                                                height)
-
-
-def performMotionCompensationForEncoding(startingRefPixel, motionVector, referenceFrame, targetFrame, width, height):
-    """
-        Perform motion compensation for encoding.
-    """
-    startingTargetPixel = (startingRefPixel[0] + motionVector[0], startingRefPixel[1] + motionVector[1])
-
-    # out of bounds (top left)
-    if startingTargetPixel[0] < 0 and startingTargetPixel[1] < 0:
-        dy = startingTargetPixel[0] + macroblockSize
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-        return targetFrame
-
-    # out of bounds (bottom right)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0] and \
-            startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dy, dx = height - startingTargetPixel[0], width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-        return targetFrame
-
-    # out of bounds (top right)
-    if startingTargetPixel[0] < 0 and startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dy = startingTargetPixel[0] + macroblockSize
-        dx = width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-        return targetFrame
-
-    # out of bounds (bottom left)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0] and startingTargetPixel[1] < 0:
-        dy = height - startingTargetPixel[0]
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-        return targetFrame
-
-    # out of bounds (left)
-    if startingTargetPixel[1] < 0:
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-        return targetFrame
-
-    # out of bounds (top)
-    if startingTargetPixel[0] < 0:
-        dy = startingTargetPixel[0] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-            ]
-        return targetFrame
-
-    # out of bounds (right)
-    if startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dx = width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-        return targetFrame
-
-    # out of bounds (bottom)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0]:
-        dy = height - startingTargetPixel[0]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-            ]
-        return targetFrame
-
-    # if no out of bounds
-    targetFrame[
-    startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-    startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-    ] = referenceFrame[
-        startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-        startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-        ]
-    return targetFrame
-
-
-def motionCompensationForDecoding(motionVectors, width, height, decodedSeqErrorImages):
+def motionCompensationForDecoding(motionVectorField, width, height, decodedSeqErrorImages, out=None):
     """
-        Motion compensation for decoding.
+        Motion compensation for decoding, with the decoded motion vector field of the frames.
+        A skip frame ('S') is predicted by its reference frame, and an intra frame ('I') by a zero frame.
+        The moved macroblocks carry their error image along: the engine compensates the reference frame plus the
+        error image, which is added in one reused frame buffer.
+        out: the zero frame sequence the compensated frames are written in (see videoFunction.createFrameSequence), if
+        given
     """
-    noOfCols = width // macroblockSize
-    motionCompensatedFrames = []
-    noOfMacroblocks = len(motionVectors[0])
+    noOfFrames = len(motionVectorField['motionVectors'])  # The frames after the first one
+    motionCompensatedFrames = np.zeros((noOfFrames, height, width), dtype=np.uint8) if out is None else out
     iFrame = decodedSeqErrorImages[0]
+    referenceBuffer = np.empty((height, width), dtype=np.uint8)  # Decoded reference frame of the current frame
 
-    for i in range(1, len(motionVectors) + 1):  # len(motionVectors) equals to the number of frames
+    for i in range(1, noOfFrames + 1):
         if i == 1:
+            # The I frame is already decoded, it has no error image to add
             referenceFrame = iFrame
         else:
-            referenceFrame = motionCompensatedFrames[-1]  # Reference frame is the last frame in the list
-        targetFrame = np.zeros_like(referenceFrame)
-        seqErrorImage = decodedSeqErrorImages[i - 1]
-        for j in range(noOfMacroblocks):
-            # Get the motion vector of the current macroblock
-            if i == 1:  # I frame
-                motionVector = motionVectors[0][j]
-            else:
-                motionVector = motionVectors[i - 1][j]
-
-            # Get the starting pixel of the current macroblock
-            macroblockIdx = (j // noOfCols, j % noOfCols)  # (y, x)
-            startingRefPixel = (macroblockIdx[0] * macroblockSize, macroblockIdx[1] * macroblockSize)  # (y, x)
-            targetFrame = motionCompensationForDecodingOnSpecificFrame(motionVector, targetFrame, referenceFrame,
-                                                                       startingRefPixel, width, height, seqErrorImage)
-        motionCompensatedFrames.append(targetFrame)
+            # Reference frame is the last compensated frame
+            referenceFrame = np.add(motionCompensatedFrames[i - 2], decodedSeqErrorImages[i - 1], out=referenceBuffer)
+        frameType = motionVectorField['frameTypes'][i]
+        if frameType == 'S':  # Skip frame: the decoded reference frame
+            motionCompensatedFrames[i - 1] = referenceFrame
+        elif frameType == 'P':  # Intra frame: decoded from its error image only (stays zero)
+            compensateFrame(referenceFrame, getFrameMotionVectors(motionVectorField, i - 1),
+                            motionCompensatedFrames[i - 1])
     return motionCompensatedFrames
-
-
-def motionCompensationForDecodingOnSpecificFrame(motionVector, targetFrame, referenceFrame, startingRefPixel, width,
-                                                 height, seqErrorImage):
-    """
-        Motion compensation on a specific frame for decoding.
-    """
-    if motionVector[0] == 0 and motionVector[1] == 0:
-        # No movement
-        return targetFrame
-    return performMotionCompensationForDecoding(startingRefPixel, motionVector, referenceFrame, targetFrame, width,
-                                                height, seqErrorImage)
-
-
-def performMotionCompensationForDecoding(startingRefPixel, motionVector, referenceFrame, targetFrame, width, height,
-                                         seqErrorImage):
-    """
-        Perform motion compensation for decoding.
-    """
-    startingTargetPixel = (startingRefPixel[0] + motionVector[0], startingRefPixel[1] + motionVector[1])
-
-    # out of bounds (top left)
-    if startingTargetPixel[0] < 0 and startingTargetPixel[1] < 0:
-        dy = startingTargetPixel[0] + macroblockSize
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-             startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-             ]
-        return targetFrame
-
-    # out of bounds (bottom right)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0] and \
-            startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dy, dx = height - startingTargetPixel[0], width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0]:startingRefPixel[0] + dy,
-             startingRefPixel[1]:startingRefPixel[1] + dx
-             ]
-        return targetFrame
-
-    # out of bounds (top right)
-    if startingTargetPixel[0] < 0 and startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dy = startingTargetPixel[0] + macroblockSize
-        dx = width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-             startingRefPixel[1]:startingRefPixel[1] + dx
-             ]
-        return targetFrame
-
-    # out of bounds (bottom left)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0] and startingTargetPixel[1] < 0:
-        dy = height - startingTargetPixel[0]
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0]:startingRefPixel[0] + dy,
-             startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-             ]
-        return targetFrame
-
-    # out of bounds (left)
-    if startingTargetPixel[1] < 0:
-        dx = startingTargetPixel[1] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-             startingRefPixel[1] + macroblockSize - dx:startingRefPixel[1] + macroblockSize
-             ]
-        return targetFrame
-
-    # out of bounds (top)
-    if startingTargetPixel[0] < 0:
-        dy = startingTargetPixel[0] + macroblockSize
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0] + macroblockSize - dy:startingRefPixel[0] + macroblockSize,
-             startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-             ]
-        return targetFrame
-
-    # out of bounds (right)
-    if startingTargetPixel[1] + macroblockSize > targetFrame.shape[1]:
-        dx = width - startingTargetPixel[1]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-            startingRefPixel[1]:startingRefPixel[1] + dx
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-             startingRefPixel[1]:startingRefPixel[1] + dx
-             ]
-        return targetFrame
-
-    # out of bounds (bottom)
-    if startingTargetPixel[0] + macroblockSize > targetFrame.shape[0]:
-        dy = height - startingTargetPixel[0]
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] = referenceFrame[
-            startingRefPixel[0]:startingRefPixel[0] + dy,
-            startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-            ]
-
-        # Add the error image to the target frame
-        targetFrame[
-        startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-        startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-        ] += seqErrorImage[
-             startingRefPixel[0]:startingRefPixel[0] + dy,
-             startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-             ]
-        return targetFrame
-
-    # if no out of bounds
-    targetFrame[
-    startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-    startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-    ] = referenceFrame[
-        startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-        startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-        ]
-
-    # Add the error image to the target frame
-    targetFrame[
-    startingTargetPixel[0]:startingTargetPixel[0] + macroblockSize,
-    startingTargetPixel[1]:startingTargetPixel[1] + macroblockSize
-    ] += seqErrorImage[
-         startingRefPixel[0]:startingRefPixel[0] + macroblockSize,
-         startingRefPixel[1]:startingRefPixel[1] + macroblockSize
-         ]
-    return targetFrame
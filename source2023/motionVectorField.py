@@ -0,0 +1,44 @@
+import numpy as np
+
+from motionCompensationEngine import macroblockSize
+
+motionVectorType = np.int16  # Type of the motion vector components (the search radius is far below the int16 range)
+SAD_type = np.int32  # Type of the SAD values (a 64x64 macroblock sums up to 64 * 64 * 255)
+
+
+def createMotionVectorField(noOfFrames, noOfRows, noOfCols, withSAD=False):
+    """
+        Create the motion vector field of noOfFrames target frames (the frames after the first one): zero motion
+        vectors, all the frames being P frames.
+        Form: {'motionVectors': ..., 'SAD': ..., 'frameTypes': ...}
+        motionVectors: (frames, rows, cols, 2) int16 array of the (dy, dx) motion vector of each macroblock, the i-th
+        frame of the field being the motion of the (i + 1)-th video frame. The skip and intra frames keep zero motion
+        vectors.
+        SAD: (frames, rows, cols) int32 array of the SAD values of the motion vectors (withSAD), or None
+        frameTypes: a string with the type of each video frame, the first one included ('I', 'P' or 'S')
+    """
+    return {'motionVectors': np.zeros((noOfFrames, noOfRows, noOfCols, 2), dtype=motionVectorType),
+            'SAD': np.zeros((noOfFrames, noOfRows, noOfCols), dtype=SAD_type) if withSAD else None,
+            'frameTypes': 'I' + 'P' * noOfFrames}
+
+
+def createMotionVectorFieldForFrames(noOfFrames, width, height, withSAD=False):
+    """
+        Create the motion vector field of the target frames of a video, one motion vector per macroblock
+    """
+    return createMotionVectorField(noOfFrames, height // macroblockSize, width // macroblockSize, withSAD)
+
+
+def getPredictedFrames(motionVectorField):
+    """
+        Get the indices (in the field) of the frames that have motion vectors, the P frames
+    """
+    frameTypes = np.frombuffer(motionVectorField['frameTypes'][1:].encode(), dtype='S1')
+    return np.flatnonzero(frameTypes == b'P')
+
+
+def getFrameMotionVectors(motionVectorField, i):
+    """
+        Get the motion vectors of the i-th frame of the field, as a (macroblocks, 2) array in row-major order
+    """
+    return motionVectorField['motionVectors'][i].reshape(-1, 2)
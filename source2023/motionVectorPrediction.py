@@ -0,0 +1,66 @@
+import numpy as np
+
+from motionVectorField import createMotionVectorField, getPredictedFrames
+
+
+def predictMotionVectors(motionVectorFields, rows, columns):
+    """
+        Median prediction of the motion vectors of the macroblocks at (rows, columns) (index arrays), in all the motion
+        vector fields (form: (frames, macroblock rows, macroblock columns, 2)) at once.
+        The prediction is the median of the left, top and top right motion vectors, per component. The top left one
+        stands for the top right one in the last column, and the top one for the left one in the first column. The
+        macroblocks of the first row are predicted by their left motion vector (zero for the first macroblock).
+    """
+    noOfColumns = motionVectorFields.shape[2]
+    hasTop = (rows > 0)[:, None]
+    topRows = np.maximum(rows - 1, 0)
+    top = np.where(hasTop, motionVectorFields[:, topRows, columns], 0)
+    topRightColumns = np.where(columns + 1 < noOfColumns, columns + 1, np.maximum(columns - 1, 0))
+    topRight = np.where(hasTop, motionVectorFields[:, topRows, topRightColumns], 0)
+    left = np.where((columns > 0)[:, None], motionVectorFields[:, rows, np.maximum(columns - 1, 0)], top)
+    median = np.maximum(np.minimum(left, top), np.minimum(np.maximum(left, top), topRight))
+    return np.where(hasTop, median, left)
+
+
+def createMotionVectorResiduals(motionVectorField):
+    """
+        Create the residuals of the motion vectors against their median prediction (see predictMotionVectors), for the
+        P frames of the motion vector field all at once.
+        Return form: a motion vector field (see motionVectorField.createMotionVectorField) of the residuals, without
+        SAD values
+    """
+    predictedFrames = getPredictedFrames(motionVectorField)
+    noOfRows, noOfColumns = motionVectorField['motionVectors'].shape[1:3]
+    motionVectorFields = motionVectorField['motionVectors'][predictedFrames].astype(np.int64)
+    rows, columns = np.divmod(np.arange(noOfRows * noOfColumns), noOfColumns)
+    residuals = motionVectorFields[:, rows, columns] - predictMotionVectors(motionVectorFields, rows, columns)
+
+    residualField = createMotionVectorField(len(motionVectorField['motionVectors']), noOfRows, noOfColumns)
+    residualField['motionVectors'][predictedFrames] = residuals.reshape(-1, noOfRows, noOfColumns, 2)
+    residualField['frameTypes'] = motionVectorField['frameTypes']
+    return residualField
+
+
+def readMotionVectorResiduals(residualField):
+    """
+        Recreate the motion vector field from the field of its residuals, for all the P frames at once.
+        A macroblock is predicted from its left, top, top right and top left neighbours, which are all on earlier
+        wavefronts (column + 2 * row), so the macroblocks of a wavefront are recreated together.
+    """
+    predictedFrames = getPredictedFrames(residualField)
+    noOfRows, noOfColumns = residualField['motionVectors'].shape[1:3]
+    residuals = residualField['motionVectors'][predictedFrames].astype(np.int64).reshape(
+        len(predictedFrames), noOfRows * noOfColumns, 2)
+    motionVectorFields = np.zeros((len(predictedFrames), noOfRows, noOfColumns, 2), dtype=np.int64)
+    rows, columns = np.divmod(np.arange(noOfRows * noOfColumns), noOfColumns)
+    wavefronts = columns + 2 * rows
+    for wavefront in range(int(wavefronts.max(initial=-1)) + 1):
+        macroblocks = np.flatnonzero(wavefronts == wavefront)
+        wavefrontRows, wavefrontColumns = rows[macroblocks], columns[macroblocks]
+        motionVectorFields[:, wavefrontRows, wavefrontColumns] = residuals[:, macroblocks] + \
+            predictMotionVectors(motionVectorFields, wavefrontRows, wavefrontColumns)
+
+    motionVectorField = createMotionVectorField(len(residualField['motionVectors']), noOfRows, noOfColumns)
+    motionVectorField['motionVectors'][predictedFrames] = motionVectorFields
+    motionVectorField['frameTypes'] = residualField['frameTypes']
+    return motionVectorField
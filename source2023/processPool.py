@@ -0,0 +1,11 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+workers = 1  # Worker processes of the motion search and of the entropy coding (1: run them in this process)
+
+
+def createProcessPool(workers=workers):
+    """
+        Create the process pool of the workers, a null context (None executor) for a single worker
+    """
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
@@ -0,0 +1,128 @@
+import numpy as np
+
+scaleBits = 14  # The symbol frequencies of the rANS coder sum to 2 ** scaleBits
+stateLowerBound = 1 << 16  # The rANS state stays in [stateLowerBound, stateLowerBound << 16), 16 bits moved at a time
+
+
+def createRansFrequencies(histogram):
+    """
+        Quantize the histogram of the pixel values to the rANS frequencies: they sum to 2 ** scaleBits, and every value
+        that appears keeps a frequency of at least 1. The values that never appear get 0 (an empty histogram gives
+        only zeros).
+    """
+    histogram = np.asarray(histogram, dtype=np.int64)
+    total = int(histogram.sum())
+    if total == 0:
+        return np.zeros(len(histogram), dtype=np.int64)
+    present = histogram > 0
+    scaled = histogram * (1 << scaleBits)
+    frequencies = np.where(present, np.maximum(scaled // total, 1), 0)
+
+    # Give the slots left by the rounding down to the largest remainders, or take the extra slots of the values
+    # raised to 1 from the largest frequencies
+    missing = (1 << scaleBits) - int(frequencies.sum())
+    if missing > 0:
+        remainders = np.where(present, scaled % total, -1)
+        frequencies[np.argsort(-remainders, kind='stable')[:missing]] += 1
+    while missing < 0:
+        largest = np.argsort(-frequencies, kind='stable')[:min(-missing, int((frequencies > 1).sum()))]
+        frequencies[largest] -= 1
+        missing += len(largest)
+    return frequencies
+
+
+def createRansHeader(frequencies):
+    """
+        Create the header of the rANS frequencies: the frequency of each pixel value, as uint16 values
+    """
+    return np.asarray(frequencies, dtype='<u2').tobytes()
+
+
+def readRansHeader(header):
+    """
+        Read the rANS frequencies from their header
+    """
+    return np.frombuffer(header, dtype='<u2').astype(np.int64)
+
+
+def packRansCodes(symbols, frequencies):
+    """
+        Encode rows of symbols with rANS, each row being an independent stream (a decoding lane), all the rows at once.
+        The symbols are encoded from the last one, each step for all the rows: the state sheds its 16 low bits when it
+        would overflow, then takes the symbol in.
+        Each row is stored as its final state (two 16-bit words) followed by the shed words in decoding order.
+        Return form: (packedBytes, bitLength, rowOffsets), the uint32 bit offset of each row (as for the Huffman codes)
+    """
+    symbols = np.asarray(symbols)
+    noOfRows, noOfColumns = symbols.shape
+    cumulativeFrequencies = np.cumsum(frequencies) - frequencies
+    stateLimits = ((stateLowerBound >> scaleBits) << 16) * np.asarray(frequencies, dtype=np.uint64)
+
+    states = np.full(noOfRows, stateLowerBound, dtype=np.uint64)
+    words = np.zeros((noOfRows, noOfColumns + 2), dtype='<u2')
+    shed = np.zeros((noOfRows, noOfColumns + 2), dtype=bool)
+    shed[:, :2] = True
+    for column in range(noOfColumns - 1, -1, -1):
+        columnSymbols = symbols[:, column]
+        overflow = states >= stateLimits[columnSymbols]
+        words[:, column + 2] = states & np.uint64(0xffff)
+        shed[:, column + 2] = overflow
+        states = np.where(overflow, states >> np.uint64(16), states)
+        columnFrequencies = frequencies[columnSymbols].astype(np.uint64)
+        states = ((states // columnFrequencies) << np.uint64(scaleBits)) + states % columnFrequencies + \
+                 cumulativeFrequencies[columnSymbols].astype(np.uint64)
+    words[:, 0] = states >> np.uint64(16)
+    words[:, 1] = states & np.uint64(0xffff)
+
+    rowWords = shed.sum(axis=1)
+    rowOffsets = (16 * (np.cumsum(rowWords) - rowWords)).astype(np.uint32)
+    packedWords = words[shed]
+    return packedWords.tobytes(), 16 * len(packedWords), rowOffsets
+
+
+def decodeRansCodes(packedBytes, laneOffsets, frequencies, out):
+    """
+        Decode rANS streams into the output array, one row of symbols per decoding lane starting at its bit offset.
+        The lanes decode one symbol each per step: the slot of the state (its low scaleBits bits) gives the symbol, the
+        state gives it out and reads a 16-bit word when it falls under the lower bound.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    cumulativeFrequencies = (np.cumsum(frequencies) - frequencies).astype(np.uint64)
+    slotSymbols = np.repeat(np.arange(len(frequencies)), frequencies).astype(out.dtype)
+    frequencies = frequencies.astype(np.uint64)
+
+    words = np.frombuffer(packedBytes + bytes(4), dtype='<u2').astype(np.uint64)
+    positions = np.asarray(laneOffsets, dtype=np.int64) // 16
+    states = (words[positions] << np.uint64(16)) | words[positions + 1]
+    positions += 2
+    slotMask = np.uint64((1 << scaleBits) - 1)
+    for column in range(out.shape[1]):
+        slots = states & slotMask
+        columnSymbols = slotSymbols[slots.astype(np.intp)]
+        out[:, column] = columnSymbols
+        states = frequencies[columnSymbols] * (states >> np.uint64(scaleBits)) + slots - \
+                 cumulativeFrequencies[columnSymbols]
+        underflow = states < stateLowerBound
+        states[underflow] = (states[underflow] << np.uint64(16)) | words[positions[underflow]]
+        positions += underflow
+    return out
+
+
+def encodeRansFrames(seqErrorImages, frameTypes, frequencies):
+    """
+        Encode consecutive error frames with the rANS frequencies, each frame as packed 16-bit words, form:
+        (packedBytes, bitLength, rowOffsets), the rows being decoded side by side. The skip frames ('S') become None.
+        The rows of all the coded frames are encoded at once, then split back into frames. See
+        entropyCoding.encodeFrames
+    """
+    codedFrames = [errorImage for errorImage, frameType in zip(seqErrorImages, frameTypes) if frameType != 'S']
+    if not codedFrames:
+        return [None] * len(frameTypes)
+    height = codedFrames[0].shape[0]
+    packedBytes, bitLength, rowOffsets = packRansCodes(np.concatenate(codedFrames), frequencies)
+
+    frameBitOffsets = np.append(rowOffsets[::height].astype(np.int64), bitLength)
+    frameEncodings = iter([(packedBytes[start // 8:end // 8], end - start, (frameRowOffsets - start).astype(np.uint32))
+                           for start, end, frameRowOffsets in
+                           zip(frameBitOffsets[:-1], frameBitOffsets[1:], rowOffsets.reshape(-1, height))])
+    return [None if frameType == 'S' else next(frameEncodings) for frameType in frameTypes]
@@ -0,0 +1,50 @@
+import importlib.util
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sourceDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, sourceDirectory)
+
+
+@pytest.fixture
+def workingDirectory(tmp_path, monkeypatch):
+    """
+        Run the test in the source2023 directory of a temporary tree, next to the auxiliary2023 folders
+    """
+    for folder in ('OriginalVideos', 'OutputVideos', 'VideoProperties'):
+        (tmp_path / 'auxiliary2023' / folder).mkdir(parents=True)
+    (tmp_path / 'source2023').mkdir()
+    monkeypatch.chdir(tmp_path / 'source2023')
+    return tmp_path
+
+
+@pytest.fixture
+def loadThema():
+    """
+        Load a thema script as a module (their file names are not module names)
+    """
+    def load(name):
+        spec = importlib.util.spec_from_file_location('thema_' + name.replace('.', '_'),
+                                                      os.path.join(sourceDirectory, f'thema_{name}.py'))
+        thema = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(thema)
+        return thema
+
+    return load
+
+
+def createMovingFrames(noOfFrames, height, width, seed=0):
+    """
+        Create grayscale frames of a textured background with a bright square moving over it, form: (frames, height,
+        width) uint8
+    """
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (7, 7), 0)
+    frames = np.repeat(background[np.newaxis], noOfFrames, axis=0)
+    for i, frame in enumerate(frames):
+        frame[20:60, 10 + 6 * i:50 + 6 * i] = 255
+    return frames
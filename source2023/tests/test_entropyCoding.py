@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import entropyCoding
+from conftest import createMovingFrames
+from entropyCoding import decodeSeqErrorImages, encodeSeqErrorImages
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('zeroRunLength', [False, True])
+@pytest.mark.parametrize('entropyCoder', ['huffman', 'rans'])
+def test_errorFramesRoundTrip(entropyCoder, zeroRunLength, workers):
+    seqErrorImages = np.diff(createMovingFrames(20, 64, 128).astype(np.int16), axis=0, prepend=0).astype(np.uint8)
+    frameTypes = 'IPPSPPPPPPSSPPPPPPPP'
+    seqErrorImages[[i for i, frameType in enumerate(frameTypes) if frameType == 'S']] = 0
+    encodedGroups = encodeSeqErrorImages(seqErrorImages, entropyCoder, groupSize=7, frameTypes=frameTypes,
+                                         zeroRunLength=zeroRunLength, workers=workers)
+    out = np.full_like(seqErrorImages, 7)
+    decodeSeqErrorImages(encodedGroups, 128, 64, workers=workers, out=out)
+    assert np.array_equal(out, seqErrorImages)
+
+
+@pytest.mark.parametrize('sharedDirectory', [entropyCoding.sharedDirectory, None])
+@pytest.mark.parametrize('entropyCoder', ['huffman', 'rans'])
+def test_mappedErrorFramesRoundTrip(entropyCoder, sharedDirectory, monkeypatch, tmp_path):
+    # The workers map the memory-mapped sequences in place, and code the frames sent to them without a shared directory
+    monkeypatch.setattr(entropyCoding, 'sharedDirectory', sharedDirectory)
+    sharedArrays = []
+    createSharedArray = entropyCoding.createSharedArray
+    monkeypatch.setattr(entropyCoding, 'createSharedArray',
+                        lambda shape: sharedArrays.append(shape) or createSharedArray(shape))
+    frames = np.diff(createMovingFrames(20, 64, 128).astype(np.int16), axis=0, prepend=0).astype(np.uint8)
+    seqErrorImages = np.memmap(tmp_path / 'seqErrorImages.raw', dtype=np.uint8, mode='w+', shape=frames.shape)
+    seqErrorImages[...] = frames
+    encodedGroups = list(encodeSeqErrorImages(seqErrorImages, entropyCoder, groupSize=7, workers=2))
+    out = np.memmap(tmp_path / 'decodedSeqErrorImages.raw', dtype=np.uint8, mode='w+', shape=frames.shape)
+    out[...] = 7
+    # Packed bytes mapped from a file, as read from a container
+    packedBytes = np.memmap(tmp_path / 'errorBits.raw', dtype=np.uint8, mode='w+',
+                            shape=sum(int(group[4][-1]) for group in encodedGroups))
+    mappedGroups, byteOffset = [], 0
+    for entropyCoder, zeroRunLength, header, encodedSeqErrorImages, frameIndex in encodedGroups:
+        packedBytes[byteOffset:byteOffset + int(frameIndex[-1])] = np.frombuffer(
+            b''.join(encodedErrorImage[0] for encodedErrorImage in encodedSeqErrorImages), dtype=np.uint8)
+        mappedGroups.append((entropyCoder, zeroRunLength, header, [
+            (packedBytes[byteOffset + int(start):byteOffset + int(end)],) + tuple(encodedErrorImage[1:])
+            for encodedErrorImage, start, end in zip(encodedSeqErrorImages, frameIndex[:-1], frameIndex[1:])],
+            frameIndex))
+        byteOffset += int(frameIndex[-1])
+    decodeSeqErrorImages(mappedGroups, 128, 64, workers=2, out=out)
+    assert np.array_equal(out, frames)
+    assert sharedArrays == []
@@ -0,0 +1,98 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import hierarchicalSearch as hierarchicalSearchModule
+from conftest import createMovingFrames
+from hierarchicalSearch import blockMatchingStrategies, calculateSADValue, createPyramid, createPyramidLevels, \
+    executeLevel, hierarchicalSearch, macroblockSize, numLevels, padReferenceFrame, predictTemporalMotionVectors, \
+    radius, splitFramePairs
+
+
+def createFramePair(content):
+    """
+        Create a (reference, target) frame pair: a moving square on a textured background, a flat frame (a flat cost
+        surface), noise (no match) or shifted noise (the matches cross the bottom and right borders)
+    """
+    if content == 'moving':
+        return createMovingFrames(2, 192, 320)
+    if content == 'flat':
+        return np.full((2, 192, 320), 90, dtype=np.uint8)
+    frames = np.random.default_rng(0).integers(0, 256, (2, 192, 320), dtype=np.uint8)
+    if content == 'shifted':
+        frames[1] = np.roll(frames[0], (-16, -16), axis=(0, 1))
+    return frames
+
+
+@pytest.mark.parametrize('content', ['moving', 'flat', 'noise'])
+def test_earlyTerminationHighestLevel(content):
+    # The candidates dropped by the early termination are never selected by the full search
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(*createFramePair(content))
+    level = numLevels - 1
+    assert all(map(np.array_equal, executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                                {'earlyTermination': True}),
+                   executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                {'fullSearchMode': 'perMacroblock'})))
+
+
+@pytest.mark.parametrize('content', ['moving', 'flat', 'noise'])
+@pytest.mark.parametrize('earlyTermination', [False, True])
+def test_temporalPredictionHighestLevel(content, earlyTermination):
+    # The search windows of the cost surface give the motion vectors of the per-macroblock search of the windows,
+    # with the same fallbacks
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(*createFramePair(content))
+    level = numLevels - 1
+    noOfMacroblocks = (192 // macroblockSize) * (320 // macroblockSize)
+    rng = np.random.default_rng(1)
+    temporalPredictions = predictTemporalMotionVectors(
+        [rng.integers(-radius, radius + 1, (noOfMacroblocks, 2)) for _ in range(2)], level)
+    staticMacroblocks = np.zeros((192 // macroblockSize, 320 // macroblockSize), dtype=bool)
+    staticMacroblocks[0, 0] = True
+    searchStatistics = [Counter(), Counter()]
+    assert all(map(np.array_equal, executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                                {'earlyTermination': earlyTermination}, searchStatistics[0],
+                                                temporalPredictions, staticMacroblocks),
+                   executeLevel(referenceFramePyramid[level], targetFramePyramid[level], level, None,
+                                {'fullSearchMode': 'perMacroblock'}, searchStatistics[1], temporalPredictions,
+                                staticMacroblocks)))
+    assert searchStatistics[0]['temporalFallbacks'] == searchStatistics[1]['temporalFallbacks']
+
+
+@pytest.mark.parametrize('content', ['moving', 'noise', 'shifted'])
+@pytest.mark.parametrize('strategy', sorted(blockMatchingStrategies))
+def test_blockMatchingStrategySAD_values(content, strategy):
+    # The SAD value of each motion vector is the one of its reference macroblock, without the pixels out of the frame
+    referenceFramePyramid, targetFramePyramid = createPyramidLevels(*createFramePair(content))
+    level = numLevels - 1
+    referenceFrame, targetFrame = referenceFramePyramid[level], targetFramePyramid[level]
+    macroblockLevelSize, k = macroblockSize // 2 ** level, radius // 2 ** level
+    paddedReferenceFrame = padReferenceFrame(referenceFrame, macroblockLevelSize)
+    motionVectors, SAD_values = executeLevel(referenceFrame, targetFrame, level, None, {'strategy': strategy})
+    if content == 'shifted':  # The match of the bottom-right macroblock crosses both borders
+        assert motionVectors[-1, -1].tolist() == [4, 4]
+    for (i, j), SAD in np.ndenumerate(SAD_values):
+        dy, dx = motionVectors[i, j].tolist()
+        y, x = i * macroblockLevelSize, j * macroblockLevelSize
+        assert max(abs(dy), abs(dx)) <= k
+        assert 0 <= y + dy <= targetFrame.shape[0] and 0 <= x + dx <= targetFrame.shape[1]
+        assert SAD == calculateSADValue(
+            paddedReferenceFrame[y + dy:y + dy + macroblockLevelSize, x + dx:x + dx + macroblockLevelSize],
+            targetFrame[y:y + macroblockLevelSize, x:x + macroblockLevelSize])
+
+
+def test_workersSearch(monkeypatch):
+    # The chunks of the process pool give the motion vectors of this process, the parent building the pyramid of the
+    # first frame of each chunk only
+    frames = createMovingFrames(7, 128, 192)
+    assert splitFramePairs(6, 2) == [0, 3, 6]
+    motionVectorField = hierarchicalSearch(frames)
+    pyramidFrames = []
+    monkeypatch.setattr(hierarchicalSearchModule, 'createPyramid',
+                        lambda frame: pyramidFrames.append(frame) or createPyramid(frame))
+    workersMotionVectorField = hierarchicalSearch(frames, workers=2)
+    assert np.array_equal(motionVectorField['motionVectors'], workersMotionVectorField['motionVectors'])
+    assert motionVectorField['frameTypes'] == workersMotionVectorField['frameTypes']
+    assert len(pyramidFrames) == 2 and np.array_equal(pyramidFrames[0], frames[0]) and \
+           np.array_equal(pyramidFrames[1], frames[3])
+
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from conftest import createMovingFrames
+
+
+def encodeAndDecode(thema, frames, monkeypatch):
+    """
+        Encode and decode the frames with the thema script, return the decoded frames
+    """
+    height, width = frames.shape[1:]
+    monkeypatch.setattr(thema, 'readGrayscaleVideo',
+                        lambda *args, **kwargs: (frames.copy(), [len(frames), width, height, 25.0]))
+    outputs = {}
+    monkeypatch.setattr(thema, 'createVideoOutput',
+                        lambda outputFrames, *args: outputs.setdefault(args[-1], np.array(outputFrames)))
+    thema.videoEncoder(exportVideos=False)
+    thema.videoDecoder()
+    return outputs['thema_1_2_decodedVideo.avi']
+
+
+@pytest.mark.parametrize('noOfFrames', [1, 2, 5])
+def test_staticClip(workingDirectory, loadThema, monkeypatch, noOfFrames):
+    # No P frames: the motion vector table and its coded frames are empty
+    frames = np.repeat(createMovingFrames(1, 128, 128), noOfFrames, axis=0)
+    assert np.array_equal(encodeAndDecode(loadThema('1.2'), frames, monkeypatch), frames)
+
+
+def test_movingClip(workingDirectory, loadThema, monkeypatch):
+    frames = createMovingFrames(5, 128, 128)
+    assert np.array_equal(encodeAndDecode(loadThema('1.2'), frames, monkeypatch), frames)
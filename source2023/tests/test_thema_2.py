@@ -0,0 +1,35 @@
+import os
+import time
+
+import numpy as np
+
+import videoFunction
+from conftest import createMovingFrames
+
+
+def test_originalVideoIsExportedBeforeTheFramesAreCompensated(workingDirectory, loadThema, monkeypatch):
+    thema = loadThema('2')
+    frames = createMovingFrames(6, 128, 128)
+    originalFrames = frames.copy()
+    monkeypatch.setattr(thema, 'readGrayscaleVideo', lambda *args, **kwargs: (frames, [len(frames), 128, 128, 25.0]))
+
+    writtenFrames = {}
+
+    class DelayedVideoWriter:
+        # A video writer slower than the motion search, that keeps the frames it is given
+        def __init__(self, fileName, *args):
+            self.frames = writtenFrames.setdefault(os.path.basename(fileName), [])
+
+        def write(self, frame):
+            time.sleep(0.05)
+            self.frames.append(frame[..., 0].copy())
+
+        def release(self):
+            pass
+
+    monkeypatch.setattr(videoFunction.cv2, 'VideoWriter', DelayedVideoWriter)
+    thema.algorithm(exportVideos=True)
+
+    assert not np.array_equal(frames, originalFrames)  # The object was removed in place
+    assert np.array_equal(writtenFrames['thema_2_originalGrayScaleVideo.avi'], originalFrames)
+    assert np.array_equal(writtenFrames['thema_2_final.avi'], frames)
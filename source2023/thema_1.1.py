@@ -1,102 +1,104 @@
 import os
 
-from huffman import *
+from entropyCoding import *
+from videoContainer import *
 from videoFunction import *
 
 videoPath = '../auxiliary2023/OriginalVideos/thema_1.avi'
 
 
-def videoEncoder():
+def videoEncoder(exportVideos=exportVideos, frameStore=frameStore):
     """
         Encode the video
+        exportVideos: export the diagnostic videos, written in the background while the video is encoded
+        frameStore: directory of the memory-mapped files of the frame sequences (None: in memory), see
+        createFrameSequence
     """
     # ------------------------------- Load Video Properties -------------------------------- #
-    # Read the video
-    frames, videoProperties = openVideo(videoPath)
+    # Read the video, each frame is converted to grayscale as it is decoded
+    frames, videoProperties = readGrayscaleVideo(videoPath, prefetch=8, frameStore=frameStore)
     print(
-        f'The video has {len(frames)} frames, a height of {videoProperties[2]} pixels, a width of'
+        f'The video has {videoProperties[0]} frames, a height of {videoProperties[2]} pixels, a width of'
         f' {videoProperties[1]} pixels and a framerate of {videoProperties[3]} frames per second.')
 
-    # Convert the video to grayscale
-    frames = createGrayscaleVideo(frames)
-
     width = videoProperties[1]
     height = videoProperties[2]
     fps = videoProperties[3]
 
     # The grayscale original video
-    createVideoOutput(frames, width, height, fps, 'thema_1_1_originalGrayScaleVideo.avi')
-    print('Original grayscale video exported successfully!')
+    if exportVideos:
+        createVideoOutput(frames, width, height, fps, 'thema_1_1_originalGrayScaleVideo.avi')
 
     # Calculate the entropy of the original grayscale video
     H = entropyScore(frames)
     print('Entropy of the original grayscale video is: ', H)
 
-    # Create the video of the error frames sequence
-    seqErrorImages = calSeqErrorImages(frames)
-    createVideoOutput(seqErrorImages, width, height, fps, 'thema_1_1_seqErrorFrames.avi')
-
-    # Huffman encoding
-    # Create the Huffman tree
-    huffmanTree = createHuffmanTree(seqErrorImages)
-    print('\tHuffman tree created successfully!')
-
-    # Create the Huffman table
-    huffmanTable = createHuffmanTable(huffmanTree)
-    print('\tHuffman table created successfully!')
-
-    # Encode the error frames sequence
-    encodedSeqErrorImages = encodeHuffman(seqErrorImages, huffmanTable)
-
-    # Save the encoded error frames sequence
-    videoSpecs = np.array([len(frames), width, height, fps], dtype='float64')
-
-    saveEncodedData(encodedSeqErrorImages, 'thema_1_1_encodedSF.pkl')
-    saveEncodedData(huffmanTable, 'thema_1_1_hT.pkl')
-    saveEncodedData(videoSpecs, 'thema_1_1_vS.pkl')
-
+    # Create the video of the error frames sequence, their histogram is gathered as they are calculated
+    seqErrorImagesHistogram = createHistogram()
+    seqErrorImages = calSeqErrorImages(frames, seqErrorImagesHistogram,
+                                       createFrameSequence(len(frames), height, width, 'thema_1_1_seqErrorImages',
+                                                           frameStore))
+    if exportVideos:
+        createVideoOutput(seqErrorImages, width, height, fps, 'thema_1_1_seqErrorFrames.avi')
+    print('Entropy of the error frames sequence is: ', entropyScoreFromHistogram(seqErrorImagesHistogram))
+
+    # Entropy encoding
+    # Encode the error frames sequence with the entropy coder (entropyCoding.entropyCoder), the frames identical to the
+    # previous one are skip frames
+    # Each group of frames is coded with its own table (a single group by default, from the histogram)
+    frameTypes = 'I' + ''.join('P' if errorImage.any() else 'S' for errorImage in seqErrorImages[1:])
+    # The encoded error frames sequence and the video properties are saved in a single container file, each group of
+    # frames being written as soon as it is encoded
+    container = createContainer('thema_1_1.vc', [len(frames), width, height, fps])
+    writeContainerArray(container, 'frameTypes', createFrameTypesArray(frameTypes))
+    noOfGroups = writeErrorImageGroups(container, encodeSeqErrorImages(
+        seqErrorImages, frameTypes=frameTypes, histogram=seqErrorImagesHistogram, workers=os.cpu_count()))
+    closeContainer(container)
+    print(f'\tError frames encoded with {noOfGroups} {entropyCoder} tables successfully!')
+
+    waitVideoOutputs()
     print('\tEncoded video properties exported successfully!')
+    if exportVideos:
+        print('Original grayscale video exported successfully!')
 
     # Return the entropy of the original grayscale video
     return H
 
 
-def videoDecoder():
+def videoDecoder(frameStore=frameStore):
     """
         Decode the video
+        frameStore: directory of the memory-mapped files of the frame sequences (None: in memory), see
+        createFrameSequence
     """
-    encodedSeqErrorImages = readEncodedData('thema_1_1_encodedSF.pkl')
-    huffmanTable = readEncodedData('thema_1_1_hT.pkl')
-    videoSpecs = readEncodedData('thema_1_1_vS.pkl')
+    # Map the container file, the coded frames are read from it one group at a time as they are decoded
+    videoProperties, arrays = openContainer('thema_1_1.vc')
+    encodedGroups = readErrorImageGroups(arrays)
 
     print('\tEncoded video properties imported successfully!')
-    width = int(videoSpecs[1])
-    height = int(videoSpecs[2])
-    fps = float(videoSpecs[3])
+    width = videoProperties[1]
+    height = videoProperties[2]
+    fps = videoProperties[3]
 
-    # Huffman decoding
-    # Decode the error frames sequence
-    decodedSeqErrorImages = decodeHuffman(encodedSeqErrorImages, huffmanTable, width, height)
+    # Entropy decoding
+    # Decode the error frames sequence, with the entropy coder and the table of each group of frames
+    # Each frame sequence is written in place
+    noOfFrames = videoProperties[0]
+    decodedSeqErrorImages = decodeSeqErrorImages(
+        encodedGroups, width, height, workers=os.cpu_count(),
+        out=createFrameSequence(noOfFrames, height, width, 'thema_1_1_decodedSeqErrorImages', frameStore))
 
     # Recreate the frames of the original video
-    decodedFrames = []
-    firstFrameFlag = True
-    referenceFrame = None
-    for errorImage in decodedSeqErrorImages:
-        if firstFrameFlag:
-            decodedFrames.append(errorImage)
-            referenceFrame = errorImage
-            firstFrameFlag = False
+    decodedFrames = createFrameSequence(noOfFrames, height, width, 'thema_1_1_decodedFrames', frameStore)
+    for i, errorImage in enumerate(decodedSeqErrorImages):
+        if i == 0:
+            decodedFrames[0] = errorImage
         else:
-            decodedFrame = referenceFrame + errorImage  # Add errorImage to referenceFrame
-            decodedFrames.append(decodedFrame)
-            referenceFrame = decodedFrame
-
-    # Convert the list to a numpy array
-    decodedFrames = np.array(decodedFrames, dtype='uint8')
+            np.add(decodedFrames[i - 1], errorImage, out=decodedFrames[i])  # Add errorImage to the reference frame
 
     # Create the video of the decoded frames
     createVideoOutput(decodedFrames, width, height, fps, 'thema_1_1_decodedVideo.avi')
+    waitVideoOutputs()
     print('Decoded grayscale video exported successfully!')
 
     H = entropyScore(decodedFrames)
@@ -1,54 +1,76 @@
 import os
+from collections import Counter
 
 from hierarchicalSearch import hierarchicalSearch
-from huffman import *
+from entropyCoding import *
 from huffmanVectors import *
 from motionCompensation_thema_1_2 import *
+from motionVectorPrediction import createMotionVectorResiduals, readMotionVectorResiduals
+from videoContainer import *
 from videoFunction import *
 
 videoPath = '../auxiliary2023/OriginalVideos/thema_1.avi'
 
 
-def videoEncoder():
+def videoEncoder(exportVideos=exportVideos, frameStore=frameStore):
     """
         Encode the video
+        exportVideos: export the diagnostic videos, written in the background while the video is encoded
+        frameStore: directory of the memory-mapped files of the frame sequences (None: in memory), see
+        createFrameSequence
     """
     # ------------------------------- Load Video Properties -------------------------------- #
-    # Read the video
-    frames, videoProperties = openVideo(videoPath)
+    # Read the video, each frame is converted to grayscale as it is decoded
+    frames, videoProperties = readGrayscaleVideo(videoPath, prefetch=8, frameStore=frameStore)
     print(
-        f'The video has {len(frames)} frames, a height of {videoProperties[2]} pixels, a width of'
+        f'The video has {videoProperties[0]} frames, a height of {videoProperties[2]} pixels, a width of'
         f' {videoProperties[1]} pixels and a framerate of {videoProperties[3]} frames per second.')
 
-    # Convert the video to grayscale
-    frames = createGrayscaleVideo(frames)
-
     width = videoProperties[1]
     height = videoProperties[2]
     fps = videoProperties[3]
 
     # The grayscale original video
-    createVideoOutput(frames, width, height, fps, 'thema_1_2_originalGrayScaleVideo.avi')
-    print('Original grayscale video exported successfully!')
+    if exportVideos:
+        createVideoOutput(frames, width, height, fps, 'thema_1_2_originalGrayScaleVideo.avi')
 
     # Calculate the entropy of the original grayscale video
     H = entropyScore(frames)
     print('Entropy of the original grayscale video is: ', H)
 
-    # Calculate the motion vectors using the hierarchical search algorithm
-    motionVectors = hierarchicalSearch(frames)
-
-    # Calculate the motion compensated frames
-    motionCompensatedFrames = motionCompensationForEncoding(frames, motionVectors, width, height)
-    createVideoOutput(motionCompensatedFrames, width, height, fps, 'thema_1_2_motionCompensatedFrames.avi')
+    # Calculate the motion vector field using the hierarchical search algorithm
+    # The static frames (identical to their reference frame) become skip frames, and the scene cuts intra frames
+    searchStatistics = Counter()
+    motionVectorField = hierarchicalSearch(frames, workers=os.cpu_count(), searchStatistics=searchStatistics,
+                                           skipThreshold=0, sceneCutThreshold=0.5)
+    print(f'\tMotion vectors calculated with {searchStatistics["SADEvaluations"]} SAD evaluations.')
+    frameTypes = motionVectorField['frameTypes']
+    print(f'\t{frameTypes.count("S")} skip frames, {frameTypes.count("I") - 1} scene cuts and '
+          f'{searchStatistics["skippedMacroblocks"]} static macroblocks.')
+
+    # Calculate the motion compensated frames, each intermediate frame sequence is written in place
+    motionCompensatedFrames = motionCompensationForEncoding(
+        frames, motionVectorField, width, height,
+        createFrameSequence(len(frames), height, width, 'thema_1_2_motionCompensatedFrames', frameStore))
+    if exportVideos:
+        createVideoOutput(motionCompensatedFrames, width, height, fps, 'thema_1_2_motionCompensatedFrames.avi')
 
     # Calculate the sequence error images
-    seqErrorImages = calculateSeqErrorImages(frames, motionCompensatedFrames)
-    createVideoOutput(seqErrorImages, width, height, fps, 'thema_1_2_seqErrorImages.avi')
+    # Their histogram is gathered as they are calculated (the skip frames are not encoded)
+    seqErrorImagesHistogram = createHistogram()
+    seqErrorImages = calculateSeqErrorImages(
+        frames, motionCompensatedFrames, seqErrorImagesHistogram, frameTypes,
+        createFrameSequence(len(frames), height, width, 'thema_1_2_seqErrorImages', frameStore))
+    if exportVideos:
+        createVideoOutput(seqErrorImages, width, height, fps, 'thema_1_2_seqErrorImages.avi')
+    print('Entropy of the error frames sequence is: ', entropyScoreFromHistogram(seqErrorImagesHistogram))
 
     # ------------------------------------- Huffman encoding ------------------------------------- #
+    # The motion vectors are coded as their residuals against the median of their neighbours
+    motionVectorResiduals = createMotionVectorResiduals(motionVectorField)
+
     # Create the Huffman tree for the Motion Vectors
-    huffmanTreeVectors = createHuffmanTreeVector(motionVectors)
+    huffmanTreeVectors = createHuffmanTreeVector(motionVectorResiduals)
     print('\tHuffman tree created for the vectors successfully!')
 
     # Create the Huffman table for the Motion Vectors
@@ -56,77 +78,75 @@ def videoEncoder():
     print('\tHuffman table created successfully!')
 
     # Encode the motion vectors for the Motion Vectors
-    encodedMotionVectors = encodeHuffmanVector(motionVectors, huffmanCodeBookVectors)
+    encodedMotionVectors = encodeHuffmanVector(motionVectorResiduals, huffmanCodeBookVectors)
     print('\tMotion vectors encoded successfully!')
 
-    # Create the Huffman tree for the Sequence Error Images
-    huffmanTreeSeqErrorImages = createHuffmanTree(seqErrorImages)
-    print('\tHuffman tree created for the sequence error images successfully!')
-
-    # Create the Huffman table for the Sequence Error Images
-    huffmanCodeBookSeqErrorImages = createHuffmanTable(huffmanTreeSeqErrorImages)
-    print('\tHuffman table created for the sequence error images successfully!')
-
-    # Encode the sequence error images for the Sequence Error Images
-    encodedSeqErrorImages = encodeHuffman(seqErrorImages, huffmanCodeBookSeqErrorImages)
-    print('\tSequence error images encoded successfully!')
-
     # ------------------------------------------ Save data ---------------------------------------- #
-    # Save the motion vectors
-    saveEncodedData(encodedMotionVectors, 'thema_1_2_eMV.pkl')
-    saveEncodedData(huffmanCodeBookVectors, 'thema_1_2_hCBV.pkl')
-    motionVectorsSpecs = (len(motionVectors[0]), len(motionVectors[0][0]))
-    saveEncodedData(motionVectorsSpecs, 'thema_1_2_mVS.pkl')
-    print('\tEncoded motion vectors saved successfully!')
-
-    # Save the sequence error images
-    saveEncodedData(encodedSeqErrorImages, 'thema_1_2_eSEI.pkl')
-    saveEncodedData(huffmanCodeBookSeqErrorImages, 'thema_1_2_hCBSEI.pkl')
-    print('\tEncoded sequence error images saved successfully!')
-
-    # Save the video properties
-    saveEncodedData(videoProperties, 'thema_1_2_vP.pkl')
+    # Save the motion vectors, the sequence error images and the video properties in a single container file
+    motionVectorsSpecs = motionVectorField['motionVectors'].shape[1:3]  # Macroblock rows and columns
+    container = createContainer('thema_1_2.vc', [len(frames), width, height, fps])
+    writeContainerArrays(container, {'frameTypes': createFrameTypesArray(frameTypes),
+                                     **createMotionVectorArrays(encodedMotionVectors,
+                                                                createCodeLengthsHeaderVector(huffmanCodeBookVectors),
+                                                                motionVectorsSpecs)})
+
+    # Encode the sequence error images with the entropy coder (entropyCoding.entropyCoder), each group of frames with
+    # its own table (a single group by default, from the histogram), written to the container as soon as it is encoded
+    noOfGroups = writeErrorImageGroups(container, encodeSeqErrorImages(
+        seqErrorImages, frameTypes=frameTypes, histogram=seqErrorImagesHistogram, workers=os.cpu_count()))
+    closeContainer(container)
+    print(f'\tSequence error images encoded with {noOfGroups} {entropyCoder} tables successfully!')
+    print('\tEncoded motion vectors and sequence error images saved successfully!')
+    waitVideoOutputs()
+    if exportVideos:
+        print('Original grayscale video exported successfully!')
 
     return H
 
 
-def videoDecoder():
+def videoDecoder(frameStore=frameStore):
     """
         Decode the video
+        frameStore: directory of the memory-mapped files of the frame sequences (None: in memory), see
+        createFrameSequence
     """
-    encodedMotionVectors = readEncodedData('thema_1_2_eMV.pkl')
-    huffmanCodebookVectors = readEncodedData('thema_1_2_hCBV.pkl')
-    motionVectorsSpecs = readEncodedData('thema_1_2_mVS.pkl')
-    encodedMotionError = readEncodedData('thema_1_2_eSEI.pkl')
-    huffmanCodeBookError = readEncodedData('thema_1_2_hCBSEI.pkl')
-    videoProperties = readEncodedData('thema_1_2_vP.pkl')
+    # Map the container file, the coded frames are read from it as they are decoded
+    videoProperties, arrays = openContainer('thema_1_2.vc')
+    frameTypes = readFrameTypesArray(arrays['frameTypes'])
+    encodedMotionVectors, huffmanCodebookVectorsHeader, motionVectorsSpecs = readMotionVectorArrays(arrays)
+    huffmanCodebookVectors = readCodeLengthsHeaderVector(huffmanCodebookVectorsHeader)
+    encodedGroups = readErrorImageGroups(arrays)  # Read one group at a time as they are decoded
 
     print('\tEncoded video properties imported successfully!')
     width = videoProperties[1]
     height = videoProperties[2]
     fps = videoProperties[3]
 
-    # Decode the motion vectors
-    decodedMotionVectors = decodeHuffmanVector(encodedMotionVectors, huffmanCodebookVectors, motionVectorsSpecs[1],
-                                               motionVectorsSpecs[0])
-    decodedMotionVectors = [
-        [tuple(decodedMotionVectorsTuple.tolist()) for decodedMotionVectorsTuple in decodedMotionVectorsSubList] for
-        decodedMotionVectorsSubList in decodedMotionVectors]
+    # Decode the motion vector residuals, then add the median prediction back
+    decodedMotionVectorResiduals = decodeHuffmanVector(encodedMotionVectors, huffmanCodebookVectors, frameTypes,
+                                                       *motionVectorsSpecs)
+    decodedMotionVectorField = readMotionVectorResiduals(decodedMotionVectorResiduals)
 
-    # Decode the sequence of error frames
-    decodedSeqErrorImages = decodeHuffman(encodedMotionError, huffmanCodeBookError, width, height)
+    # Decode the sequence of error frames, with the entropy coder and the table of each group of frames
+    # Each intermediate frame sequence is written in place
+    noOfFrames = videoProperties[0]
+    decodedSeqErrorImages = decodeSeqErrorImages(
+        encodedGroups, width, height, workers=os.cpu_count(),
+        out=createFrameSequence(noOfFrames, height, width, 'thema_1_2_decodedSeqErrorImages', frameStore))
 
     # Calculate the motion compensated frames
-    motionCompensatedFrames = motionCompensationForDecoding(decodedMotionVectors, width, height, decodedSeqErrorImages)
+    motionCompensatedFrames = motionCompensationForDecoding(
+        decodedMotionVectorField, width, height, decodedSeqErrorImages,
+        createFrameSequence(noOfFrames - 1, height, width, 'thema_1_2_decodedCompensatedFrames', frameStore))
 
     # Add error sequence to the motion compensated frames
-    decodedFrames = addSeqErrorImagesToCompensatedFrames(motionCompensatedFrames, decodedSeqErrorImages)
-
-    # Convert the list to a numpy array
-    decodedFrames = np.array(decodedFrames, dtype='uint8')
+    decodedFrames = addSeqErrorImagesToCompensatedFrames(
+        motionCompensatedFrames, decodedSeqErrorImages,
+        createFrameSequence(noOfFrames, height, width, 'thema_1_2_decodedFrames', frameStore))
 
     # Create the video of the decoded frames
     createVideoOutput(decodedFrames, width, height, fps, 'thema_1_2_decodedVideo.avi')
+    waitVideoOutputs()
     print('Decoded grayscale video exported successfully!')
 
     H = entropyScore(decodedFrames)
@@ -7,30 +7,39 @@ from videoFunction import *
 videoPath = '../auxiliary2023/OriginalVideos/thema_2.avi'
 
 
-def algorithm():
-    # Read the video
-    frames, videoProperties = openVideo(videoPath)
+def algorithm(exportVideos=exportVideos, frameStore=frameStore):
+    """
+        Make the item disappear from the video
+        exportVideos: export the diagnostic videos, written in the background while the video is encoded
+        frameStore: directory of the memory-mapped files of the frame sequences (None: in memory), see
+        createFrameSequence
+    """
+    # Read the video, each frame is converted to grayscale as it is decoded
+    frames, videoProperties = readGrayscaleVideo(videoPath, prefetch=8, frameStore=frameStore)
     print(
-        f'The video has {len(frames)} frames, a height of {videoProperties[2]} pixels, a width of'
+        f'The video has {videoProperties[0]} frames, a height of {videoProperties[2]} pixels, a width of'
         f' {videoProperties[1]} pixels and a framerate of {videoProperties[3]} frames per second.')
 
-    # Convert the video to grayscale
-    frames = createGrayscaleVideo(frames)
-
     width = videoProperties[1]
     height = videoProperties[2]
     fps = videoProperties[3]
 
     # The grayscale original video
-    createVideoOutput(frames, width, height, fps, 'thema_2_originalGrayScaleVideo.avi')
-    print('Original grayscale video exported successfully!')
+    if exportVideos:
+        createVideoOutput(frames, width, height, fps, 'thema_2_originalGrayScaleVideo.avi')
+
+    # Calculate the motion vector field using the hierarchical search algorithm
+    motionVectorField = hierarchicalSearch(frames, workers=os.cpu_count())
 
-    # Calculate the motion vectors using the hierarchical search algorithm
-    motionVectors = hierarchicalSearch(frames)
+    # The motion compensation removes the item from the frames in place: the original video must be written first
+    waitVideoOutputs()
+    if exportVideos:
+        print('Original grayscale video exported successfully!')
 
     # Calculate the motion compensated frames
-    motionCompensatedFrames = motionCompensation(frames, motionVectors, width, height)
+    motionCompensatedFrames = motionCompensation(frames, motionVectorField, width, height)
     createVideoOutput(motionCompensatedFrames, width, height, fps, 'thema_2_final.avi')
+    waitVideoOutputs()
     print('Item disappeared successfully!')
 
 
@@ -0,0 +1,246 @@
+import struct
+
+import numpy as np
+
+from entropyCoding import createFrameIndex
+
+containerMagic = b'VC23'  # First bytes of a container file
+containerVersion = 2  # Layout version of the container, a reader only opens its own version
+containerAlignment = 8  # Byte alignment of the arrays in the container, so they are mapped as they are
+headerStruct = struct.Struct('<4sHHIIIIQd')  # magic, version, flags, frames, width, height, arrays, table offset, fps
+entryStruct = struct.Struct('<16s8sQ4q')  # name, dtype, byte offset, shape (-1 for the unused dimensions)
+entropyCoders = ('huffman', 'rans')  # Entropy coders of the groups of error frames, by their index in the container
+
+
+def createContainer(fileName, videoProperties):
+    """
+        Create a container file for the encoded video, whose arrays are written one after the other as they are
+        produced (see writeContainerArray), each one aligned to containerAlignment bytes. The table of the arrays
+        (name, dtype, byte offset and shape of each one) is written after them when the container is closed, and the
+        fixed header (the video properties, form: [frames, width, height, fps], see readVideoFrames, the number of
+        arrays and the byte offset of the table) is patched then.
+        Form: {'file': ..., 'videoProperties': ..., 'entries': [[name, dtype, byte offset, shape], ...]}
+    """
+    file = open('../auxiliary2023/VideoProperties/' + fileName, 'wb')
+    file.write(bytes(headerStruct.size))  # Zero until the container is closed, so an unfinished file cannot be opened
+    return {'file': file, 'videoProperties': videoProperties, 'entries': []}
+
+
+def writeContainerArray(container, name, array, append=False):
+    """
+        Write an array at the end of the container (a name of 16 characters at most, 4 dimensions at most)
+        append: extend the last written array, if it has the same name, along its first dimension
+    """
+    array = np.ascontiguousarray(array)
+    entries, file = container['entries'], container['file']
+    if append and entries and entries[-1][0] == name:
+        if array.dtype != entries[-1][1] or array.shape[1:] != entries[-1][3][1:]:
+            raise ValueError(f'Cannot append an array of shape {array.shape} to array {name!r}')
+        entries[-1][3] = (entries[-1][3][0] + len(array),) + array.shape[1:]
+    else:
+        if len(name) > 16 or not 1 <= array.ndim <= 4 or any(entry[0] == name for entry in entries):
+            raise ValueError(f'Cannot store array {name!r} of shape {array.shape} in the container')
+        file.write(bytes(-file.tell() % containerAlignment))
+        entries.append([name, array.dtype, file.tell(), array.shape])
+    file.write(array.tobytes())
+
+
+def writeContainerArrays(container, arrays):
+    """
+        Write a dict of arrays by name at the end of the container, in their order
+    """
+    for name, array in arrays.items():
+        writeContainerArray(container, name, array)
+
+
+def closeContainer(container):
+    """
+        Write the table of the arrays at the end of the container, then its header, and close it
+    """
+    file = container['file']
+    file.write(bytes(-file.tell() % containerAlignment))
+    tableOffset = file.tell()
+    for name, dtype, offset, shape in container['entries']:
+        file.write(entryStruct.pack(name.encode(), dtype.str.encode(), offset, *(shape + (-1,) * (4 - len(shape)))))
+
+    frames, width, height, fps = container['videoProperties']
+    file.seek(0)
+    file.write(headerStruct.pack(containerMagic, containerVersion, 0, int(frames), int(width), int(height),
+                                 len(container['entries']), tableOffset, float(fps)))
+    file.close()
+
+
+def openContainer(fileName):
+    """
+        Open a container file (see createContainer) by mapping it in memory: the arrays are views of the mapped file,
+        so only the parts of them that are read are loaded.
+        Return form: (videoProperties, arrays), videoProperties being [frames, width, height, fps]
+    """
+    data = np.memmap('../auxiliary2023/VideoProperties/' + fileName, dtype=np.uint8, mode='r')
+    magic, version, _, frames, width, height, noOfArrays, tableOffset, fps = headerStruct.unpack_from(data, 0)
+    if magic != containerMagic:
+        raise ValueError(f'{fileName} is not a container file')
+    if version != containerVersion:
+        raise ValueError(f'Unsupported container version: {version}')
+
+    arrays = {}
+    for k in range(noOfArrays):
+        name, dtype, offset, *shape = entryStruct.unpack_from(data, tableOffset + k * entryStruct.size)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        shape = tuple(dimension for dimension in shape if dimension >= 0)
+        arrays[name.rstrip(b'\0').decode()] = \
+            data[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+    return [frames, width, height, fps], arrays
+
+
+def createFrameTypesArray(frameTypes):
+    """
+        Create the array of the frame types string, one byte per frame
+    """
+    return np.frombuffer(frameTypes.encode(), dtype=np.uint8)
+
+
+def readFrameTypesArray(frameTypesArray):
+    """
+        Read the frame types string from its array
+    """
+    return frameTypesArray.tobytes().decode()
+
+
+def createCodedFrameArrays(encodedFrames, prefix):
+    """
+        Lay out a sequence of coded frames (form: (packedBytes, bitLength, rowOffsets[, noOfSymbols]), None for the
+        frames that are not coded) as arrays of the container, named with the prefix: the arrays of their index (see
+        createCodedFrameIndexArrays) and
+        Bits: the packed bytes of all the frames
+    """
+    return {**createCodedFrameIndexArrays(encodedFrames, createFrameIndex(encodedFrames), prefix),
+            prefix + 'Bits': np.frombuffer(b''.join(encodedFrame[0] for encodedFrame in encodedFrames
+                                                    if encodedFrame is not None), dtype=np.uint8)}
+
+
+def createCodedFrameIndexArrays(encodedFrames, frameIndex, prefix):
+    """
+        Lay out the index of a sequence of coded frames (their packed bytes are not used) as arrays of the container,
+        named with the prefix:
+        Coded: 1 for the coded frames
+        Index: byte offset of each frame in the bits, followed by the total length (frameIndex, see
+        entropyCoding.createFrameIndex)
+        Lengths: the bit length of each frame
+        Symbols: the number of symbols of each frame (0 if not given)
+        RowIndex: offset of the row offsets of each frame in the row offsets, followed by the total length
+        RowOffsets: the row offsets of all the frames
+    """
+    codedFrames = [encodedFrame for encodedFrame in encodedFrames if encodedFrame is not None]
+    rowCounts = [0 if encodedFrame is None else len(encodedFrame[2]) for encodedFrame in encodedFrames]
+    return {prefix + 'Coded': np.array([encodedFrame is not None for encodedFrame in encodedFrames], dtype=np.uint8),
+            prefix + 'Index': np.asarray(frameIndex, dtype=np.uint64),
+            prefix + 'Lengths': np.array([0 if encodedFrame is None else encodedFrame[1]
+                                          for encodedFrame in encodedFrames], dtype=np.uint64),
+            prefix + 'Symbols': np.array([encodedFrame[3] if encodedFrame is not None and len(encodedFrame) > 3 else 0
+                                          for encodedFrame in encodedFrames], dtype=np.uint64),
+            prefix + 'RowIndex': np.cumsum([0] + rowCounts, dtype=np.uint64),
+            prefix + 'RowOffsets': np.concatenate([np.zeros(0, dtype=np.uint32)] +
+                                                  [encodedFrame[2] for encodedFrame in codedFrames]).astype(np.uint32)}
+
+
+def readCodedFrame(arrays, prefix, i, withSymbols=False, mapped=False):
+    """
+        Read the i-th coded frame from the arrays of the container (see createCodedFrameArrays), None if the frame is
+        not coded. Only the bytes of that frame are read from the file.
+        withSymbols: append the number of symbols to the coded frame
+        mapped: keep the packed bytes as a view of the mapped file (read when they are used) instead of bytes
+    """
+    if not arrays[prefix + 'Coded'][i]:
+        return None
+    start, end = arrays[prefix + 'Index'][i:i + 2].astype(np.int64)
+    rowStart, rowEnd = arrays[prefix + 'RowIndex'][i:i + 2].astype(np.int64)
+    packedBytes = arrays[prefix + 'Bits'][start:end]
+    encodedFrame = (packedBytes if mapped else packedBytes.tobytes(), int(arrays[prefix + 'Lengths'][i]),
+                    np.array(arrays[prefix + 'RowOffsets'][rowStart:rowEnd]))
+    return encodedFrame + (int(arrays[prefix + 'Symbols'][i]),) if withSymbols else encodedFrame
+
+
+def writeErrorImageGroups(container, encodedGroups):
+    """
+        Write the error frames coded in groups (see entropyCoding.encodeSeqErrorImages) to the container as the groups
+        are coded, only one group being held at once: the packed bytes of their frames are appended to errorBits
+        group after group, then come the index of the coded frames (see createCodedFrameIndexArrays, prefix 'error')
+        and per group
+        groupCoders: the index of the entropy coder in entropyCoders
+        groupRunLengths: 1 if the frames are coded as (zero run, value) symbols
+        groupFrameIndex: the first frame of each group, followed by the total number of frames
+        groupHeaderIndex: the byte offset of each table header in the headers, followed by their total length
+        groupHeaders: the table headers of all the groups
+        Return: the number of groups
+    """
+    groupCoders, groupRunLengths, groupSizes, headers = [], [], [], []
+    encodedFrames, frameIndex = [], [np.zeros(1, dtype=np.uint64)]
+    writeContainerArray(container, 'errorBits', np.zeros(0, dtype=np.uint8))
+    for entropyCoder, zeroRunLength, header, encodedSeqErrorImages, groupFrameIndex in encodedGroups:
+        for encodedErrorImage in encodedSeqErrorImages:
+            if encodedErrorImage is not None:
+                writeContainerArray(container, 'errorBits', np.frombuffer(encodedErrorImage[0], dtype=np.uint8),
+                                    append=True)
+        # Only the index of the frames is kept, without their packed bytes
+        encodedFrames += [None if encodedErrorImage is None else (None,) + tuple(encodedErrorImage[1:])
+                          for encodedErrorImage in encodedSeqErrorImages]
+        frameIndex.append(frameIndex[-1][-1] + np.asarray(groupFrameIndex[1:], dtype=np.uint64))
+        groupCoders.append(entropyCoders.index(entropyCoder))
+        groupRunLengths.append(zeroRunLength)
+        groupSizes.append(len(encodedSeqErrorImages))
+        headers.append(header)
+
+    writeContainerArrays(container, {
+        **createCodedFrameIndexArrays(encodedFrames, np.concatenate(frameIndex), 'error'),
+        'groupCoders': np.array(groupCoders, dtype=np.uint8),
+        'groupRunLengths': np.array(groupRunLengths, dtype=np.uint8),
+        'groupFrameIndex': np.cumsum([0] + groupSizes, dtype=np.uint64),
+        'groupHeaderIndex': np.cumsum([0] + [len(header) for header in headers], dtype=np.uint64),
+        'groupHeaders': np.frombuffer(b''.join(headers), dtype=np.uint8)})
+    return len(groupCoders)
+
+
+def readErrorImageGroup(arrays, g):
+    """
+        Read the g-th group of error frames from the arrays of the container (see writeErrorImageGroups), form: see
+        entropyCoding.encodeSeqErrorImages. The packed bytes of the frames coded as pixel values are views of the
+        mapped file, which the decoding workers map themselves (see entropyCoding.findMappedBytes).
+    """
+    frameStart, frameEnd = arrays['groupFrameIndex'][g:g + 2].astype(np.int64)
+    headerStart, headerEnd = arrays['groupHeaderIndex'][g:g + 2].astype(np.int64)
+    zeroRunLength = bool(arrays['groupRunLengths'][g])
+    encodedSeqErrorImages = [readCodedFrame(arrays, 'error', i, zeroRunLength, mapped=not zeroRunLength)
+                             for i in range(frameStart, frameEnd)]
+    frameIndex = np.array(arrays['errorIndex'][frameStart:frameEnd + 1]) - arrays['errorIndex'][frameStart]
+    header = arrays['groupHeaders'][headerStart:headerEnd].tobytes()
+    return entropyCoders[arrays['groupCoders'][g]], zeroRunLength, header, encodedSeqErrorImages, frameIndex
+
+
+def readErrorImageGroups(arrays):
+    """
+        Read all the groups of error frames from the arrays of the container, one group at a time
+    """
+    for g in range(len(arrays['groupCoders'])):
+        yield readErrorImageGroup(arrays, g)
+
+
+def createMotionVectorArrays(encodedMotionVectors, header, motionVectorsSpecs):
+    """
+        Lay out the coded motion vectors (see huffmanVectors.encodeHuffmanVector) as arrays of the container: the coded
+        frames (see createCodedFrameArrays, prefix 'motion'), the header of their Huffman table (motionHeader) and the
+        macroblock rows and columns of the frames (motionSpecs)
+    """
+    return {'motionHeader': np.frombuffer(header, dtype=np.uint8),
+            'motionSpecs': np.array(motionVectorsSpecs, dtype=np.uint32),
+            **createCodedFrameArrays(encodedMotionVectors, 'motion')}
+
+
+def readMotionVectorArrays(arrays):
+    """
+        Read the coded motion vectors from the arrays of the container.
+        Return form: (encodedMotionVectors, header, motionVectorsSpecs)
+    """
+    encodedMotionVectors = [readCodedFrame(arrays, 'motion', i) for i in range(len(arrays['motionCoded']))]
+    return (encodedMotionVectors, arrays['motionHeader'].tobytes(),
+            tuple(int(specs) for specs in arrays['motionSpecs']))
@@ -1,4 +1,6 @@
-import pickle
+import os
+from queue import Full, Queue
+from threading import Event, Thread
 
 import cv2
 import numpy as np
@@ -7,75 +9,289 @@ from scipy.stats import entropy
 from imageFunction import calculateErrorImage
 from progressBar import progressBar
 
+prefetch = 0  # Frames read ahead by a background thread in readVideoFrames (0: no background thread)
+exportVideos = True  # Export the diagnostic videos of the encoders (original grayscale, motion compensated, errors)
+outputQueueSize = 16  # Frames waiting to be written by a video output at most, before the producer blocks
+videoOutputs = []  # Video outputs still being written by their worker thread, see waitVideoOutputs
+frameStore = None  # Directory of the memory-mapped files of the frame sequences (None: the sequences are in memory)
 
-def openVideo(file):
+
+def readVideoFrames(file, prefetch=prefetch):
     """
-        Open the video and return the frames and the video properties
+        Open the video and return a generator of its frames, read one at a time as they are requested, and the video
+        properties (form: [frames, width, height, fps], known before any frame is read)
+        prefetch: frames read ahead by a background thread (a bounded queue), so that the decoding of the video
+        overlaps the processing of its frames (0: each frame is read when it is requested)
     """
     video = cv2.VideoCapture(file)
+    video_properties = readVideoProperties(video)
+    frames = generateVideoFrames(video)
+    return (prefetchVideoFrames(frames, prefetch) if prefetch > 0 else frames), video_properties
+
+
+def readGrayscaleVideo(file, out=None, prefetch=prefetch, frameStore=frameStore):
+    """
+        Open the video and convert its frames to grayscale (8-bit luma) straight into one (frames, height, width) uint8
+        array as they are decoded, the BGR frames being dropped one at a time
+        out: a preallocated array (or np.memmap) for the grayscale frames, with room for the frame count of the video,
+        else a frame sequence is created from the frame count (see createFrameSequence), and grown if the video has more
+        frames (see resizeFrameSequence)
+        prefetch: frames decoded ahead by a background thread (see readVideoFrames)
+        frameStore: directory of the memory-mapped file of the created frame sequence (None: in memory)
+        Return form: (frames, video properties), the frames being the part of the array that holds the video
+    """
+    frames, video_properties = readVideoFrames(file, prefetch)
+    framesNum, videoWidth, videoHeight = video_properties[:3]
+    grayscaleFrames = out
+    if out is None:
+        name = os.path.splitext(os.path.basename(file))[0] + '_grayscaleFrames'
+        grayscaleFrames = createFrameSequence(framesNum, videoHeight, videoWidth, name, frameStore)
+    noOfFrames = 0
+    for noOfFrames, frame in enumerate(frames, 1):
+        if noOfFrames > len(grayscaleFrames):
+            if out is not None:
+                frames.close()
+                raise ValueError(f'The video has more frames than the output array ({len(out)})')
+            # More frames than the frame count, the sequence is doubled (in its file, with a frameStore)
+            grayscaleFrames = resizeFrameSequence(grayscaleFrames, 2 * len(grayscaleFrames) + 1, name, frameStore)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=grayscaleFrames[noOfFrames - 1])
+    return grayscaleFrames[:noOfFrames], video_properties
+
+
+def createFrameSequence(noOfFrames, height, width, name, frameStore=frameStore):
+    """
+        Create a zero (frames, height, width) uint8 frame sequence, for a stage of the pipeline to write its frames in
+        place: the np.memmap file name + '.raw' in the frameStore directory (overwritten if it exists), if given, so
+        that the frames are paged in and out by the OS instead of being held in memory, else an array
+    """
+    if frameStore is None or noOfFrames == 0:
+        return np.zeros((noOfFrames, height, width), dtype=np.uint8)
+    return np.memmap(os.path.join(frameStore, name + '.raw'), dtype=np.uint8, mode='w+',
+                     shape=(noOfFrames, height, width))
+
+
+def resizeFrameSequence(frames, noOfFrames, name, frameStore=frameStore):
+    """
+        Resize a frame sequence (see createFrameSequence) to noOfFrames frames, keeping its first frames: an np.memmap
+        is resized in its file and mapped again, an array is copied into a new sequence (in the frameStore, if given)
+    """
+    height, width = frames.shape[1:]
+    if isinstance(frames, np.memmap) and frames.filename is not None:
+        frames.flush()
+        with open(frames.filename, 'r+b') as file:
+            file.truncate(noOfFrames * height * width)
+        return np.memmap(frames.filename, dtype=np.uint8, mode='r+', shape=(noOfFrames, height, width))
+    resizedFrames = createFrameSequence(noOfFrames, height, width, name, frameStore)
+    resizedFrames[:min(len(frames), noOfFrames)] = frames[:noOfFrames]
+    return resizedFrames
+
+
+def readVideoProperties(video):
+    """
+        Read the properties of an opened video, form: [frames, width, height, fps]
+    """
     framesNum = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
     videoWidth = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
     videoHeight = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = video.get(cv2.CAP_PROP_FPS)
-    video_properties = [framesNum, videoWidth, videoHeight, fps]
-    frames = []
-    while True:
-        ret, frame = video.read()
-        if not ret:
-            break
-        frames.append(frame)
-    video.release()
-    return np.array(frames), video_properties
+    return [framesNum, videoWidth, videoHeight, fps]
+
+
+def generateVideoFrames(video):
+    """
+        Read the frames of an opened video one at a time, the video is released once they are all read (or the
+        generator is closed)
+    """
+    try:
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        video.release()
+
+
+def prefetchVideoFrames(frames, prefetch):
+    """
+        Read the frames of a generator ahead in a background thread, at most prefetch frames being held in the queue.
+        An error of the reader is raised when the frame it failed on is requested.
+    """
+    queue = Queue(maxsize=prefetch)
+    stop = Event()
+
+    def put(item):
+        # Wait for room in the queue, unless the frames are no longer requested
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def readFrames():
+        try:
+            for frame in frames:
+                if not put((frame, None)):
+                    return
+            put((None, None))
+        except Exception as error:
+            put((None, error))
+        finally:
+            frames.close()
+
+    reader = Thread(target=readFrames, daemon=True)
+    reader.start()
+    try:
+        while True:
+            frame, error = queue.get()
+            if error is not None:
+                raise error
+            if frame is None:
+                return
+            yield frame
+    finally:
+        stop.set()
+        reader.join()
 
 
 def createVideoOutput(frames, width, height, fps, name):
     """
-        Create the video output
+        Create the video output: the frames are converted and written by the worker thread of a video output (see
+        openVideoOutput), which finishes in the background after the last frame is queued (see waitVideoOutputs). The
+        frames must not be changed until they are written.
     """
-    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-    videoWriter = cv2.VideoWriter("../auxiliary2023/OutputVideos/" + name, fourcc, fps, (width, height))
+    videoOutput = openVideoOutput(width, height, fps, name)
     for frame in frames:
-        gray_color_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-        videoWriter.write(gray_color_frame)
-    videoWriter.release()
+        writeVideoOutput(videoOutput, frame)
+    closeVideoOutput(videoOutput, wait=False)
+    videoOutputs.append(videoOutput)
+
+
+def openVideoOutput(width, height, fps, name, queueSize=outputQueueSize):
+    """
+        Open a video output whose (grayscale) frames are converted to BGR, encoded and written by a worker thread, from
+        a queue of queueSize frames at most
+        Form: {'queue': ..., 'writer': ..., 'error': ...}, error being the error of the worker thread, if any
+    """
+    videoOutput = {'queue': Queue(maxsize=queueSize), 'writer': None, 'error': None}
+
+    def writeFrames():
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+        videoWriter = cv2.VideoWriter("../auxiliary2023/OutputVideos/" + name, fourcc, fps, (width, height))
+        try:
+            while True:
+                frame = videoOutput['queue'].get()
+                if frame is None:
+                    break
+                videoWriter.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        except Exception as error:
+            videoOutput['error'] = error
+            # Drop the remaining frames, so that the producer is not blocked
+            while videoOutput['queue'].get() is not None:
+                pass
+        finally:
+            videoWriter.release()
+
+    videoOutput['writer'] = Thread(target=writeFrames)
+    videoOutput['writer'].start()
+    return videoOutput
+
+
+def writeVideoOutput(videoOutput, frame):
+    """
+        Queue a frame to be written by the video output, waiting for room in the queue
+    """
+    videoOutput['queue'].put(frame)
+
+
+def closeVideoOutput(videoOutput, wait=True):
+    """
+        Queue the end of the video output, and wait for its frames to be written (if wait), raising the error of the
+        worker thread, if any
+    """
+    videoOutput['queue'].put(None)
+    if wait:
+        videoOutput['writer'].join()
+        if videoOutput['error'] is not None:
+            raise videoOutput['error']
+
+
+def waitVideoOutputs():
+    """
+        Wait for the video outputs that are written in the background (see createVideoOutput) to be written, raising
+        the error of any of them
+    """
+    while videoOutputs:
+        videoOutput = videoOutputs.pop(0)
+        videoOutput['writer'].join()
+        if videoOutput['error'] is not None:
+            raise videoOutput['error']
+
+
+def createHistogram():
+    """
+        Create an empty histogram of the pixel values (256 bins)
+    """
+    return np.zeros(256, dtype=np.int64)
 
 
-# Create video to grayscale
-def createGrayscaleVideo(frames):
+def updateHistogram(histogram, frame):
+    """
+        Add the pixel values of a frame to the histogram, in place
     """
-        Convert the video to grayscale
+    histogram += np.bincount(frame.ravel(), minlength=256)
+    return histogram
+
+
+def calculateHistogram(frames):
     """
-    grayscaleFrames = []
+        Calculate the histogram of the pixel values of a frames sequence, one frame at a time
+    """
+    histogram = createHistogram()
     for frame in frames:
-        grayFrame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        grayscaleFrames.append(grayFrame)
-    return np.array(grayscaleFrames)
+        updateHistogram(histogram, frame)
+    return histogram
 
 
-def calSeqErrorImages(frames):
+def calSeqErrorImages(frames, histogram=None, out=None):
     """
         Calculate the error frames sequence
+        histogram: if given, the error frames are added to it as they are calculated
+        out: the frame sequence the error frames are written in (see createFrameSequence), if given
     """
-    # Add the first frame to the error frames list (I frame)
-    seqErrorImages = [frames[0]]
+    # The first frame is its own error frame (I frame)
+    seqErrorImages = np.empty(np.shape(frames), dtype=np.uint8) if out is None else out
+    seqErrorImages[0] = frames[0]
+    if histogram is not None:
+        updateHistogram(histogram, frames[0])
 
     # Create the Encoding Differential Pulse Code Modulation - DPCM
     for P in range(1, len(frames)):
         # Calculate the error image of the current frame
         errorImage = calculateErrorImage(frames[P], frames[P - 1])
 
-        # Add the error image to the error frames list
-        seqErrorImages.append(errorImage)
+        # Write the error image in the error frames sequence
+        seqErrorImages[P] = errorImage
+        if histogram is not None:
+            updateHistogram(histogram, errorImage)
 
-    return np.array(seqErrorImages, dtype='uint8')
+    return seqErrorImages
 
 
-def calculateSeqErrorImages(originalFrames, motionCompensatedFrames):
+def calculateSeqErrorImages(originalFrames, motionCompensatedFrames, histogram=None, frameTypes=None, out=None):
     """
         Calculate the error frames sequence
+        histogram: if given, the error frames are added to it as they are calculated, except the ones of the skip
+        frames ('S' in frameTypes, if given) that are not encoded
+        out: the frame sequence the error frames are written in (see createFrameSequence), if given
     """
-    # Add the first frame to the error frames list (I frame)
-    seqErrorImages = [originalFrames[0]]
+    # The first frame is its own error frame (I frame)
+    seqErrorImages = np.empty(np.shape(originalFrames), dtype=np.uint8) if out is None else out
+    seqErrorImages[0] = originalFrames[0]
+    if histogram is not None:
+        updateHistogram(histogram, originalFrames[0])
 
     # Create the Encoding Differential Pulse Code Modulation - DPCM
     progressBar(0, len(originalFrames), 'Creating Sequence Error Images: ', 'Sequence Error Images Created!')
@@ -84,23 +300,24 @@ def calculateSeqErrorImages(originalFrames, motionCompensatedFrames):
         # Calculate the error image of the current frame
         errorImage = calculateErrorImage(originalFrames[P], motionCompensatedFrames[P])
 
-        # Add the error image to the error frames list
-        seqErrorImages.append(errorImage)
+        # Write the error image in the error frames sequence
+        seqErrorImages[P] = errorImage
+        if histogram is not None and (frameTypes is None or frameTypes[P] != 'S'):
+            updateHistogram(histogram, errorImage)
         progressBar(P + 1, len(originalFrames), 'Creating Sequence Error Images: ', 'Sequence Error Images Created!')
 
-    return np.array(seqErrorImages, dtype='uint8')
+    return seqErrorImages
 
 
-def addSeqErrorImagesToCompensatedFrames(motionCompensatedFrames, seqErrorImages):
+def addSeqErrorImagesToCompensatedFrames(motionCompensatedFrames, seqErrorImages, out=None):
     """
         Add the error frames sequence to the motion compensated frames.
+        out: the frame sequence the decoded frames are written in (see createFrameSequence), if given
     """
-    outputFrames = [seqErrorImages[0]]
+    outputFrames = np.empty(np.shape(seqErrorImages), dtype=np.uint8) if out is None else out
+    outputFrames[0] = seqErrorImages[0]
     for i in range(0, len(motionCompensatedFrames)):
-        seqErrorFrame = seqErrorImages[i + 1]
-        motionCompensatedFrame = motionCompensatedFrames[i]
-        outputFrame = motionCompensatedFrame + seqErrorFrame
-        outputFrames.append(outputFrame)
+        np.add(motionCompensatedFrames[i], seqErrorImages[i + 1], out=outputFrames[i + 1])
     return outputFrames
 
 
@@ -108,23 +325,13 @@ def entropyScore(errorFrames):
     """
         Calculate the entropy of the error frames sequence
     """
-    # values: unique values of error_frames, counts: how many times each value appears
-    values, counts = np.unique(errorFrames, return_counts=True)
-    return entropy(counts)
+    return entropyScoreFromHistogram(calculateHistogram(errorFrames))
 
 
-def saveEncodedData(data, fileName):
+def entropyScoreFromHistogram(histogram):
     """
-        Save the video properties to a binary file
+        Calculate the entropy of the pixel values from their histogram
     """
-    with open('../auxiliary2023/VideoProperties/' + fileName, 'wb') as file:
-        pickle.dump(data, file)
-
-
-def readEncodedData(fileName):
-    """
-        Read the video properties from a binary file
-    """
-    with open('../auxiliary2023/VideoProperties/' + fileName, 'rb') as file:
-        data = pickle.load(file)
-    return data
+    # counts: how many times each value appears (the values that never appear are dropped)
+    counts = histogram[histogram > 0]
+    return entropy(counts)
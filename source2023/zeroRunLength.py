@@ -0,0 +1,140 @@
+from itertools import repeat
+
+import numpy as np
+
+from huffman import createCanonicalHuffmanTable, createHuffmanCodeArrays, createHuffmanCodeLengths, \
+    createHuffmanDecodingTables, decodeHuffmanCodes, packHuffmanCodes
+from rans import createRansFrequencies, decodeRansCodes, packRansCodes
+
+maxZeroRun = 16  # Zeros covered by a (run, value) symbol at most, its value included
+noOfZeroRunLengthSymbols = maxZeroRun * 256  # The (run, value) symbols, as run * 256 + value
+
+
+def createZeroRunLengthSymbols(errorImage):
+    """
+        Create the (run, value) symbols of an error frame (row-major): each symbol is a run of zeros followed by a
+        value, as run * 256 + value. A run longer than maxZeroRun - 1 takes (maxZeroRun - 1, 0) symbols first, and the
+        trailing zeros end with a zero value.
+    """
+    pixels = errorImage.ravel()
+    nonZero = np.flatnonzero(pixels)
+    runs = np.diff(nonZero, prepend=-1) - 1
+    values = pixels[nonZero].astype(np.uint16)
+    trailingZeros = len(pixels) - 1 - (nonZero[-1] if len(nonZero) else -1)
+    if trailingZeros:
+        runs, values = np.append(runs, trailingZeros - 1), np.append(values, 0)
+
+    symbolCounts = runs // maxZeroRun + 1
+    symbols = np.full(int(symbolCounts.sum()), (maxZeroRun - 1) * 256, dtype=np.uint16)
+    symbols[np.cumsum(symbolCounts) - 1] = (runs % maxZeroRun) * 256 + values
+    return symbols
+
+
+def readZeroRunLengthSymbols(symbols, width, height):
+    """
+        Recreate an error frame from its (run, value) symbols
+    """
+    pixels = np.zeros(height * width, dtype=np.uint8)
+    pixels[np.cumsum((symbols >> 8).astype(np.int64) + 1) - 1] = symbols & 0xff
+    return pixels.reshape(height, width)
+
+
+def createSparseHeader(table):
+    """
+        Create the header of a table of the (run, value) symbols (Huffman code lengths or rANS frequencies): the
+        (symbol, table value) pairs of the symbols in the table, as uint16 values. Most of the symbols never appear.
+    """
+    symbols = np.flatnonzero(table)
+    return np.stack([symbols, np.asarray(table)[symbols]], axis=1).astype('<u2').tobytes()
+
+
+def readSparseHeader(header):
+    """
+        Read a table of the (run, value) symbols from its header
+    """
+    entries = np.frombuffer(header, dtype='<u2').reshape(-1, 2).astype(np.int64)
+    table = np.zeros(noOfZeroRunLengthSymbols, dtype=np.int64)
+    table[entries[:, 0]] = entries[:, 1]
+    return table
+
+
+def packZeroRunLengthSymbols(symbols, noOfLanes, entropyCoder, codeTable):
+    """
+        Encode the (run, value) symbols of an error frame, split in noOfLanes decoding lanes of the same length (the
+        last ones padded with the last symbol, which has a code in the table).
+        codeTable: the code arrays of the Huffman table (codeWords, codeLengths), or the rANS frequencies
+        Return form: (packedBytes, bitLength, rowOffsets, noOfSymbols)
+    """
+    laneLength = -(-len(symbols) // noOfLanes)
+    lanes = np.full(noOfLanes * laneLength, symbols[-1], dtype=np.uint16)
+    lanes[:len(symbols)] = symbols
+    if entropyCoder == 'rans':
+        encoded = packRansCodes(lanes.reshape(noOfLanes, laneLength), codeTable)
+    else:
+        encoded = packHuffmanCodes(lanes.reshape(noOfLanes, laneLength), *codeTable)
+    return encoded + (len(symbols),)
+
+
+def unpackZeroRunLengthSymbols(encodedErrorImage, entropyCoder, decodingTable, width, height):
+    """
+        Decode an error frame coded as (run, value) symbols, see packZeroRunLengthSymbols
+        decodingTable: the lookup tables of the Huffman decoder, or the rANS frequencies
+    """
+    packedBytes, _, rowOffsets, noOfSymbols = encodedErrorImage
+    lanes = np.empty((len(rowOffsets), -(-noOfSymbols // len(rowOffsets))), dtype=np.uint16)
+    if entropyCoder == 'rans':
+        decodeRansCodes(packedBytes, rowOffsets, decodingTable, lanes)
+    else:
+        decodeHuffmanCodes(packedBytes, rowOffsets.astype(np.int64), decodingTable, lanes)
+    return readZeroRunLengthSymbols(lanes.ravel()[:noOfSymbols], width, height)
+
+
+def encodeZeroRunLength(seqErrorImages, entropyCoder, frameTypes, executor=None):
+    """
+        Encode the error frames sequence as (run, value) symbols, with a table of those symbols (Huffman code lengths
+        or rANS frequencies) built from their histogram. Each frame is split in as many decoding lanes as it has rows.
+        The skip frames ('S' in frameTypes) are not encoded, they become None. The frames are encoded in the process
+        pool, if given.
+        Return form: (header, encodedSeqErrorImages), see createSparseHeader
+    """
+    seqSymbols = [None if frameType == 'S' else createZeroRunLengthSymbols(errorImage)
+                  for errorImage, frameType in zip(seqErrorImages, frameTypes)]
+    histogram = np.zeros(noOfZeroRunLengthSymbols, dtype=np.int64)
+    for symbols in seqSymbols:
+        if symbols is not None:
+            histogram += np.bincount(symbols, minlength=noOfZeroRunLengthSymbols)
+
+    if entropyCoder == 'rans':
+        codeTable = header = createRansFrequencies(histogram)
+    else:
+        header = createHuffmanCodeLengths(histogram)
+        codeTable = createHuffmanCodeArrays(createCanonicalHuffmanTable(header), noOfZeroRunLengthSymbols)
+
+    codedSymbols = [symbols for symbols in seqSymbols if symbols is not None]
+    noOfLanes = len(seqErrorImages[0])
+    encodedFrames = iter(list((map if executor is None else executor.map)(
+        packZeroRunLengthSymbols, codedSymbols, repeat(noOfLanes), repeat(entropyCoder), repeat(codeTable))))
+    return createSparseHeader(header), [None if symbols is None else next(encodedFrames) for symbols in seqSymbols]
+
+
+def decodeZeroRunLength(encodedSeqErrorImages, entropyCoder, header, out, executor=None):
+    """
+        Decode the error frames sequence coded as (run, value) symbols into the output sequence, the skip frames (None)
+        as zero error frames. The frames are decoded in the process pool, if given.
+    """
+    height, width = out.shape[1:]
+    if entropyCoder == 'rans':
+        decodingTable = readSparseHeader(header)
+    else:
+        huffmanTable = createCanonicalHuffmanTable(readSparseHeader(header))
+        decodingTable = createHuffmanDecodingTables(huffmanTable, np.array(list(huffmanTable), dtype=np.uint16)) \
+            if huffmanTable else None
+
+    codedFrames = [i for i, encodedErrorImage in enumerate(encodedSeqErrorImages) if encodedErrorImage is not None]
+    out[[encodedErrorImage is None for encodedErrorImage in encodedSeqErrorImages]] = 0
+    decodedFrames = (map if executor is None else executor.map)(
+        unpackZeroRunLengthSymbols, [encodedSeqErrorImages[i] for i in codedFrames], repeat(entropyCoder),
+        repeat(decodingTable), repeat(width), repeat(height))
+    for i, decodedFrame in zip(codedFrames, decodedFrames):
+        out[i] = decodedFrame
+    return out